@@ -1,117 +1,163 @@
-# app.py
-
-import os
-from dotenv import load_dotenv
-
-# 1. 先載入 .env
-load_dotenv()
-
-# 2. 初始化資料庫（create table if not exists…）
-import db
-from db import init_db
-init_db()
-
-from flask import Flask, request, abort
-
-from linebot.v3 import WebhookHandler
-from linebot.v3.exceptions import InvalidSignatureError
-from linebot.v3.webhooks import MessageEvent, TextMessageContent, PostbackEvent
-from linebot.v3.messaging import (
-    Configuration, ApiClient, MessagingApi,
-    ReplyMessageRequest, TextMessage,ImageMessage
-)
-
-# 從子模組 import 各功能處理器
-from news import handle_news
-from subscribetest import (
-    handle_subscribe,
-    handle_subscribe_postback,
-    handle_subscribe_text
-)
-from pushs import (
-    handle_push_message,
-    handle_push_postback,
-    start_push_scheduler
-)
-
-import threading
-
-app = Flask(__name__)
-
-# 3. 從環境變數讀取 LINE Bot 憑證
-configuration = Configuration(access_token=os.getenv("CHANNEL_ACCESS_TOKEN"))
-line_handler  = WebhookHandler(os.getenv("CHANNEL_SECRET"))
-
-# 4. 啟動背景推播排程
-threading.Thread(target=start_push_scheduler, daemon=True).start()
-
-@app.route("/callback", methods=["GET","POST"])
-def callback():
-    if request.method == "GET":
-        return "OK", 200
-    
-    signature = request.headers.get("X-Line-Signature", "")
-    body = request.get_data(as_text=True)
-    try:
-        line_handler.handle(body, signature)
-    except InvalidSignatureError:
-        abort(400)
-        
-    return "OK",200
-
-@line_handler.add(MessageEvent, message=TextMessageContent)
-def handle_message(event):
-    with ApiClient(configuration) as api_client:
-        line_bot_api = MessagingApi(api_client)
-        text = event.message.text.strip()
-
-        if text == "即時新聞":
-            return handle_news(event, line_bot_api)
-
-        elif text == "管理我的訂閱":
-            return handle_subscribe(event, line_bot_api)
-
-        elif text == "推播訊息":
-            return handle_push_message(event, line_bot_api)
-
-        else:
-            # 只有在訂閱文字模式下才消化，否則回文字
-            if not handle_subscribe_text(event, line_bot_api):
-                return line_bot_api.reply_message_with_http_info(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(text=text)]
-                    )
-                )
-
-@line_handler.add(PostbackEvent)
-def handle_postback(event):
-    with ApiClient(configuration) as api_client:
-        line_bot_api = MessagingApi(api_client)
-        data = event.postback.data or ""
-
-        # --- 推播相關 ---
-        if (
-            data.startswith("action=set_push_choice")
-            or data.startswith("action=set_push_time")
-            or data in ("action=confirm_push", "action=cancel_push")
-        ):
-            return handle_push_postback(event, line_bot_api)
-
-        # --- 訂閱相關 ---
-        if (
-            data.startswith("action=subscribe&topic=")
-            or data.startswith("action=unsubscribe&topic=")
-            or data in (
-                "action=start_add_subscription",
-                "action=start_remove_subscription",
-                "action=confirm_subscription",
-                "action=recommend_keywords",
-                "action=manage_subscription",
-            )
-        ):
-            return handle_subscribe_postback(event, line_bot_api)
-
-if __name__ == "__main__":
-    # 在本地測試可以跑 8000 埠，部署到 Vercel 時會自動以環境變數 PORT 覆蓋
-    app.run(host="0.0.0.0", port=8000, debug=True)
+# app.py
+
+import os
+from dotenv import load_dotenv
+
+# 1. 先載入 .env
+load_dotenv()
+
+# 2. 初始化資料庫（create table if not exists…）
+import db
+from db import init_db
+init_db()
+
+# 跨行程的訂閱快取失效通知（USER_STATE_NOTIFY=1 時才會啟動）
+import user_state
+user_state.start_listener()
+
+from flask import Flask, Response, request, abort
+
+from linebot.v3 import WebhookHandler
+from linebot.v3.exceptions import InvalidSignatureError
+from linebot.v3.webhooks import MessageEvent, TextMessageContent, PostbackEvent
+from linebot.v3.messaging import (
+    ReplyMessageRequest, TextMessage,ImageMessage
+)
+
+# 從子模組 import 各功能處理器
+from news import handle_news
+from subscribetest import (
+    handle_subscribe,
+    handle_subscribe_text
+)
+from pushs import (
+    handle_push_message,
+    start_push_scheduler
+)
+import postback
+
+from line_client import get_messaging_api
+from webhook_queue import (
+    WorkQueue, WEBHOOK_ASYNC, WEBHOOK_WORKERS,
+    WEBHOOK_QUEUE_SIZE, WEBHOOK_BACKPRESSURE, WEBHOOK_BLOCK_TIMEOUT
+)
+
+import threading
+
+import metrics
+import rss
+import flex
+import pushs
+import news_engine
+import cluster
+import ingest
+import trending
+import matcher
+
+app = Flask(__name__)
+
+# 3. 從環境變數讀取 LINE Bot 憑證（MessagingApi 由 line_client 共用）
+line_handler  = WebhookHandler(os.getenv("CHANNEL_SECRET"))
+
+# 驗章計時（同步與非同步模式都會經過 validate）
+_validator = line_handler.parser.signature_validator
+_validator.validate = metrics.timed("signature_verify_seconds")(_validator.validate)
+
+# 4. 啟動背景推播排程（多個 worker 都會啟動，由 cluster.coordinator 分配分片，不會重複發送）
+threading.Thread(target=start_push_scheduler, daemon=True).start()
+
+# 背景新聞匯入（NEWS_INGEST=1 時），匯入的標題比對所有訂閱關鍵字（KEYWORD_MATCH=1 時）
+matcher.start()
+ingest.start()
+
+# 推薦關鍵字（TRENDING=1 時）：背景統計訂閱與新聞熱門詞，postback 只讀快照
+trending.start()
+
+# 5. 非同步 webhook 模式：背景 worker 處理事件（只有開啟時才建立，WEBHOOK_BACKPRESSURE 也只在這時檢查）
+webhook_queue = None
+if WEBHOOK_ASYNC:
+    webhook_queue = WorkQueue(
+        line_handler.handle,
+        workers=WEBHOOK_WORKERS,
+        maxsize=WEBHOOK_QUEUE_SIZE,
+        policy=WEBHOOK_BACKPRESSURE,
+        block_timeout=WEBHOOK_BLOCK_TIMEOUT,
+    )
+    webhook_queue.start()
+
+# 6. /metrics 的 gauge：各模組既有的 stats()
+metrics.register_collector("db_pool", db.pool_stats)
+metrics.register_collector("news_cache", rss.cache_stats)
+metrics.register_collector("rss_http", rss.http_stats)
+metrics.register_collector("news_engine", news_engine.stats)
+metrics.register_collector("user_state", user_state.stats)
+metrics.register_collector("flex_cache", flex.flex_stats)
+metrics.register_collector("scheduler", lambda: pushs.scheduler_stats)
+metrics.register_collector("delivery", lambda: pushs.last_delivery_report)
+metrics.register_collector("postback", postback.stats)
+metrics.register_collector("cluster", cluster.coordinator.stats)
+metrics.register_collector("news_ingest", ingest.stats)
+metrics.register_collector("trending", trending.stats)
+metrics.register_collector("keyword_match", matcher.stats)
+if webhook_queue is not None:
+    metrics.register_collector("webhook_queue", webhook_queue.stats)
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/callback", methods=["GET","POST"])
+def callback():
+    if request.method == "GET":
+        return "OK", 200
+    
+    signature = request.headers.get("X-Line-Signature", "")
+    body = request.get_data(as_text=True)
+
+    if WEBHOOK_ASYNC:
+        # 先驗章，丟進佇列後立刻回 200，實際處理交給背景 worker
+        if not line_handler.parser.signature_validator.validate(body, signature):
+            abort(400)
+        if not webhook_queue.submit(body, signature) and WEBHOOK_BACKPRESSURE != "drop":
+            abort(503)
+        return "OK", 200
+
+    try:
+        line_handler.handle(body, signature)
+    except InvalidSignatureError:
+        abort(400)
+        
+    return "OK",200
+
+@line_handler.add(MessageEvent, message=TextMessageContent)
+def handle_message(event):
+    line_bot_api = get_messaging_api()
+    text = event.message.text.strip()
+
+    if text == "即時新聞":
+        return handle_news(event, line_bot_api)
+
+    elif text == "管理我的訂閱":
+        return handle_subscribe(event, line_bot_api)
+
+    elif text == "推播訊息":
+        return handle_push_message(event, line_bot_api)
+
+    else:
+        # 只有在訂閱文字模式下才消化，否則回文字
+        if not handle_subscribe_text(event, line_bot_api):
+            return line_bot_api.reply_message_with_http_info(
+                ReplyMessageRequest(
+                    reply_token=event.reply_token,
+                    messages=[TextMessage(text=text)]
+                )
+            )
+
+@line_handler.add(PostbackEvent)
+def handle_postback(event):
+    # 訂閱與推播的各個動作在 subscribetest / pushs 以 @postback.route 登記
+    return postback.dispatch(event, get_messaging_api())
+
+if __name__ == "__main__":
+    # 在本地測試可以跑 8000 埠，部署到 Vercel 時會自動以環境變數 PORT 覆蓋
+    app.run(host="0.0.0.0", port=8000, debug=True)
@@ -0,0 +1,140 @@
+# cluster.py
+# 多 worker / 多節點的推播排程協調：以 Postgres advisory lock 分配推播分片
+import os
+import math
+import time
+import zlib
+import random
+import threading
+
+import db
+
+# 設定（可由環境變數調整）
+PUSH_SHARDS        = int(os.getenv("PUSH_SHARDS", "16"))          # 使用者依 user_id hash 分成幾片
+PUSH_LOCK_KEY      = int(os.getenv("PUSH_LOCK_KEY", "72417"))     # advisory lock 的第一個 key
+PUSH_LOCK_RETRY    = float(os.getenv("PUSH_LOCK_RETRY", "5"))     # 鎖連線斷掉後幾秒再重試
+
+
+class ShardCoordinator:
+    """
+    每個行程一條專用的鎖連線：
+    - 持有 (key, 0) 的共享鎖代表「這個 worker 還活著」，持有者數量 = 存活的 worker 數
+    - 分片 s 由持有 (key, s + 1) 互斥鎖的 worker 負責
+    - 每個 worker 最多拿 ceil(分片數 / 存活 worker 數) 片；worker 死掉時連線中斷、鎖自動釋放，
+      其他 worker 下一分鐘就會接手（failover）
+    分片只決定「誰負責」，實際發送前仍以 db.claim_push_slots 確認同一分片同一分鐘只發送一次。
+    後端不支援 advisory lock（db.SUPPORTS_ADVISORY_LOCKS 為 False，例如 SQLite）時視為單機，擁有全部分片。
+    """
+
+    def __init__(self, shards=16, key=72417, retry=5):
+        self.shards = max(shards, 1)
+        self.key = key
+        self.retry = retry
+        self.standalone = not db.SUPPORTS_ADVISORY_LOCKS
+        self._conn = None
+        self._next_retry = 0.0
+        self._owned = set(range(self.shards)) if self.standalone else set()
+        self._lock = threading.Lock()
+        # 每個 worker 從不同的分片開始搶，減少一開始全部撞在同一片
+        self._offset = random.randrange(self.shards)
+        self._stats = {"members": 0, "share": 0, "acquired": 0, "released": 0,
+                       "session_errors": 0}
+
+    def shard_of(self, user_id):
+        return zlib.crc32(user_id.encode("utf-8")) % self.shards
+
+    def _session(self):
+        if self._conn is not None or self.standalone:
+            return self._conn
+        if time.monotonic() < self._next_retry:
+            return None
+        try:
+            conn = db.open_lock_session()
+        except Exception:
+            self._stats["session_errors"] += 1
+            self._next_retry = time.monotonic() + self.retry
+            return None
+        try:
+            db.lock_shared(conn, self.key, 0)
+        except Exception:
+            self._close(conn)
+            self._stats["session_errors"] += 1
+            self._next_retry = time.monotonic() + self.retry
+            return None
+        self._conn = conn
+        return conn
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _drop_session(self):
+        # 連線斷了，鎖也跟著沒了
+        self._close(self._conn)
+        self._conn = None
+        self._owned = set()
+        self._stats["session_errors"] += 1
+        self._next_retry = time.monotonic() + self.retry
+
+    def _fair_share(self, conn):
+        members = max(db.count_lock_holders(conn, self.key, 0), 1)
+        share = math.ceil(self.shards / members)
+        self._stats["members"], self._stats["share"] = members, share
+        return share
+
+    def acquire(self):
+        """
+        每分鐘發送前呼叫：把擁有的分片補到公平份額，
+        回傳 (擁有的分片, 這次新拿到的分片)
+        """
+        with self._lock:
+            conn = self._session()
+            if conn is None:
+                return set(self._owned), set()
+            gained = set()
+            try:
+                share = self._fair_share(conn)
+                for i in range(self.shards):
+                    if len(self._owned) >= share:
+                        break
+                    shard = (self._offset + i) % self.shards
+                    if shard not in self._owned and db.try_lock(conn, self.key, shard + 1):
+                        self._owned.add(shard)
+                        gained.add(shard)
+                self._stats["acquired"] += len(gained)
+            except Exception:
+                self._drop_session()
+                return set(), set()
+            return set(self._owned), gained
+
+    def rebalance(self):
+        """在兩次發送之間呼叫：持有超過公平份額時釋放多的分片，讓新加入的 worker 下一分鐘接手"""
+        with self._lock:
+            conn = self._session()
+            if conn is None:
+                return
+            try:
+                share = self._fair_share(conn)
+                for shard in sorted(self._owned)[share:]:
+                    db.unlock(conn, self.key, shard + 1)
+                    self._owned.discard(shard)
+                    self._stats["released"] += 1
+            except Exception:
+                self._drop_session()
+
+    def owned(self):
+        with self._lock:
+            return set(self._owned)
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s["owned"] = len(self._owned)
+        s["shards"] = self.shards
+        s["standalone"] = self.standalone
+        return s
+
+
+coordinator = ShardCoordinator(PUSH_SHARDS, PUSH_LOCK_KEY, PUSH_LOCK_RETRY)
@@ -0,0 +1,659 @@
+# db_postgres.py
+# PostgreSQL（pg8000）儲存後端，由 db.py 依 DATABASE_URL 選用
+import os
+import threading
+import time
+from contextlib import contextmanager
+import pg8000
+
+# 後端能力
+SUPPORTS_NOTIFY         = True    # LISTEN/NOTIFY
+SUPPORTS_ADVISORY_LOCKS = True    # pg_advisory_lock，用來分配推播分片
+
+__all__ = [
+    "SUPPORTS_NOTIFY", "SUPPORTS_ADVISORY_LOCKS",
+    "get_conn", "pool_stats", "NOTIFICATION_BUFFER", "notify", "open_listener",
+    "poll_notifications", "init_db", "list_subscriptions", "add_subscription",
+    "remove_subscription", "add_subscriptions", "remove_subscriptions",
+    "list_push_topics", "set_push_choice", "set_push_choices", "set_push_time",
+    "get_push_time", "list_push_schedule", "list_due_pushes", "list_enabled_push_topics",
+    "open_lock_session", "try_lock", "unlock", "lock_shared", "count_lock_holders",
+    "claim_push_slots", "list_subscribed_topics", "save_articles", "latest_articles",
+    "purge_articles", "load_delivered", "save_delivered", "count_topic_subscribers",
+    "list_topic_pairs", "recent_titles", "save_matched_articles",
+]
+
+url = None   # configure() 時設定的 urlparse 結果
+
+# 訂閱 / 推播設定依主題的位元組順序排列，與 SQLite 的 BINARY 排序一致，不受資料庫 locale 影響
+_TOPIC_ORDER = 'topic COLLATE "C"'
+
+# 連線池設定（可由環境變數調整）
+POOL_MIN_SIZE         = int(os.getenv("DB_POOL_MIN", "1"))
+POOL_MAX_SIZE         = int(os.getenv("DB_POOL_MAX", "10"))
+POOL_IDLE_TIMEOUT     = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))    # 閒置多久（秒）後關閉
+POOL_CHECKOUT_TIMEOUT = float(os.getenv("DB_POOL_CHECKOUT_TIMEOUT", "10")) # 等不到連線多久（秒）就放棄
+POOL_HEALTHCHECK_IDLE = float(os.getenv("DB_POOL_HEALTHCHECK_IDLE", "30")) # 閒置超過幾秒，借出前先 SELECT 1
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def _connect():
+    return pg8000.connect(
+        user=url.username,
+        password=url.password,
+        host=url.hostname,
+        port=url.port or 5432,
+        database=url.path.lstrip("/")
+    )
+
+
+class ConnectionPool:
+    """
+    執行緒安全的連線池：
+    - 最多 max_size 條連線，用完時等待 checkout_timeout 秒
+    - 閒置超過 idle_timeout 的連線會被關閉（保留 min_size 條）
+    - 閒置超過 healthcheck_idle 的連線借出前先檢查，壞掉就重連（DB 重啟後自動恢復）
+    """
+
+    def __init__(self, connect, min_size=1, max_size=10, idle_timeout=300,
+                 checkout_timeout=10, healthcheck_idle=30):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.healthcheck_idle = healthcheck_idle
+
+        self._cond   = threading.Condition()
+        self._idle   = []   # [(conn, last_used)]，後進先出，讓熱連線優先被使用
+        self._size   = 0    # 已建立（含借出中）的連線數
+        self._in_use = 0
+        self._stats  = {
+            "checkouts": 0, "waits": 0, "timeouts": 0,
+            "wait_time_total": 0.0, "wait_time_max": 0.0,
+            "created": 0, "discarded": 0, "healthcheck_failed": 0,
+        }
+
+    def acquire(self):
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+        waited = False
+        with self._cond:
+            stale = self._reap_idle_locked(start)
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # 先佔位，實際連線在鎖外建立
+                    self._size += 1
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"等待資料庫連線逾時（{self.checkout_timeout}s）")
+                waited = True
+                self._cond.wait(remaining)
+            self._in_use += 1
+            wait = time.monotonic() - start
+            self._stats["checkouts"] += 1
+            if waited:
+                self._stats["waits"] += 1
+            self._stats["wait_time_total"] += wait
+            self._stats["wait_time_max"] = max(self._stats["wait_time_max"], wait)
+
+        for c in stale:
+            self._close(c)
+
+        try:
+            if conn is None:
+                conn = self._new_conn()
+            elif time.monotonic() - last_used > self.healthcheck_idle and not self._healthy(conn):
+                with self._cond:
+                    self._stats["healthcheck_failed"] += 1
+                self._close(conn)
+                conn = self._new_conn()
+        except Exception:
+            # 建立連線失敗：歸還名額
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def release(self, conn, discard=False):
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._size -= 1
+                self._stats["discarded"] += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if discard:
+            self._close(conn)
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        with self._cond:
+            s = dict(self._stats)
+            s.update(size=self._size, in_use=self._in_use, idle=len(self._idle),
+                     min_size=self.min_size, max_size=self.max_size)
+        s["wait_time_avg"] = s["wait_time_total"] / s["checkouts"] if s["checkouts"] else 0.0
+        return s
+
+    def _reap_idle_locked(self, now):
+        # 關掉閒置過久的連線，但至少保留 min_size 條
+        stale = []
+        keep = []
+        for conn, last_used in self._idle:
+            if now - last_used > self.idle_timeout and self._size - len(stale) > self.min_size:
+                stale.append(conn)
+            else:
+                keep.append((conn, last_used))
+        if stale:
+            self._idle = keep
+            self._size -= len(stale)
+        return stale
+
+    def _new_conn(self):
+        conn = self._connect()
+        with self._cond:
+            self._stats["created"] += 1
+        return conn
+
+    @staticmethod
+    def _healthy(conn):
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchall()
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_pool = ConnectionPool(
+    _connect,
+    min_size=POOL_MIN_SIZE,
+    max_size=POOL_MAX_SIZE,
+    idle_timeout=POOL_IDLE_TIMEOUT,
+    checkout_timeout=POOL_CHECKOUT_TIMEOUT,
+    healthcheck_idle=POOL_HEALTHCHECK_IDLE,
+)
+
+def configure(parsed_url):
+    """設定連線目標（不會立刻連線，第一次借連線時才建立）"""
+    global url
+    url = parsed_url
+
+@contextmanager
+def get_conn():
+    """
+    從連線池借一條連線，離開 with 區塊時歸還（與 db_sqlite.get_conn 相同）：
+    正常離開時 commit，發生錯誤會 rollback，歸還的連線不會留著未結束的交易；
+    連線本身壞掉（網路斷線、DB 重啟）則直接丟棄。
+    """
+    conn = _pool.acquire()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException as e:
+        broken = isinstance(e, pg8000.InterfaceError)
+        if not broken:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+        _pool.release(conn, discard=broken)
+        raise
+    else:
+        _pool.release(conn)
+
+def pool_stats():
+    """連線池狀態：size / in_use / idle / 等待次數與時間等"""
+    return _pool.stats()
+
+def _query(sql, params=()):
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+        cur.close()
+        conn.commit()
+    return rows
+
+def _execute(sql, params=()):
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        conn.commit()
+        cur.close()
+
+# pg8000 每條連線最多暫存的通知數
+NOTIFICATION_BUFFER = 100
+
+def notify(channel, payload):
+    _query("SELECT pg_notify(%s, %s)", (channel, payload))
+
+def open_listener(channel):
+    """建立一條不進連線池的專用連線並 LISTEN channel（給背景執行緒用）"""
+    conn = _connect()
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(f'LISTEN "{channel}"')
+    cur.close()
+    return conn
+
+def poll_notifications(conn):
+    """送一個輕量查詢讓 pg8000 讀進待處理的通知，回傳 payload 清單"""
+    cur = conn.cursor()
+    cur.execute("SELECT 1")
+    cur.fetchall()
+    cur.close()
+    payloads = []
+    while conn.notifications:
+        _pid, _channel, payload = conn.notifications.popleft()
+        payloads.append(payload)
+    return payloads
+
+def open_lock_session():
+    """建立一條不進連線池的專用連線，給 advisory lock 使用（連線中斷時鎖自動釋放）"""
+    conn = _connect()
+    conn.autocommit = True
+    return conn
+
+def _scalar(conn, sql, params):
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    row = cur.fetchone()
+    cur.close()
+    return row[0]
+
+def try_lock(conn, key, n):
+    return _scalar(conn, "SELECT pg_try_advisory_lock(%s, %s)", (key, n))
+
+def unlock(conn, key, n):
+    return _scalar(conn, "SELECT pg_advisory_unlock(%s, %s)", (key, n))
+
+def lock_shared(conn, key, n):
+    _scalar(conn, "SELECT pg_advisory_lock_shared(%s, %s)::text", (key, n))
+
+def count_lock_holders(conn, key, n):
+    """目前資料庫中持有 advisory lock (key, n) 的連線數"""
+    return _scalar(conn, """
+      SELECT count(*) FROM pg_locks
+      WHERE locktype = 'advisory' AND granted
+        AND database = (SELECT oid FROM pg_database WHERE datname = current_database())
+        AND classid = CAST(%s AS INTEGER) AND objid = CAST(%s AS INTEGER) AND objsubid = 2
+    """, (key, n))
+
+def claim_push_slots(shards, slot):
+    """
+    slot 為 "YYYY-MM-DD HH:MM"。對每個分片原子地把 last_slot 推進到 slot，
+    回傳成功推進（這一分鐘還沒有人發送過）的分片清單。
+    """
+    rows = _query("""
+      INSERT INTO push_shard_state(shard, last_slot)
+      SELECT s, %s FROM unnest(CAST(%s AS INTEGER[])) AS s
+      ON CONFLICT(shard) DO UPDATE SET last_slot=EXCLUDED.last_slot
+        WHERE push_shard_state.last_slot < EXCLUDED.last_slot
+      RETURNING shard
+    """, (slot, list(shards)))
+    return [r[0] for r in rows]
+
+def list_subscribed_topics():
+    rows = _query("SELECT DISTINCT topic FROM subscriptions")
+    return [r[0] for r in rows]
+
+def save_articles(topic, articles, fetched_at):
+    """
+    articles: [{"id", "title_hash", "title", "url", "published"}, ...]（已正規化）
+    一個 statement 寫入，重複的（同網址或同標題）略過，回傳實際新增的筆數
+    """
+    if not articles:
+        return 0
+    rows = _query("""
+      INSERT INTO news_articles(topic, article_id, title_hash, title, url, published_at, fetched_at)
+      SELECT %s, a.id, a.th, a.title, a.url, a.pub, %s
+      FROM unnest(CAST(%s AS TEXT[]), CAST(%s AS TEXT[]), CAST(%s AS TEXT[]),
+                  CAST(%s AS TEXT[]), CAST(%s AS DOUBLE PRECISION[])) AS a(id, th, title, url, pub)
+      ON CONFLICT DO NOTHING
+      RETURNING article_id
+    """, (topic, fetched_at,
+          [a["id"] for a in articles], [a["title_hash"] for a in articles],
+          [a["title"] for a in articles], [a["url"] for a in articles],
+          [a["published"] for a in articles]))
+    return len(rows)
+
+def save_matched_articles(matches, fetched_at):
+    """
+    matches: { topic: [正規化後的新聞, ...] }（關鍵字比對到的新聞寫到該關鍵字底下）
+    所有主題一個 statement 寫入，回傳實際新增的筆數
+    """
+    pairs = [(topic, a) for topic, articles in matches.items() for a in articles]
+    if not pairs:
+        return 0
+    rows = _query("""
+      INSERT INTO news_articles(topic, article_id, title_hash, title, url, published_at, fetched_at)
+      SELECT a.topic, a.id, a.th, a.title, a.url, a.pub, %s
+      FROM unnest(CAST(%s AS TEXT[]), CAST(%s AS TEXT[]), CAST(%s AS TEXT[]), CAST(%s AS TEXT[]),
+                  CAST(%s AS TEXT[]), CAST(%s AS DOUBLE PRECISION[])) AS a(topic, id, th, title, url, pub)
+      ON CONFLICT DO NOTHING
+      RETURNING article_id
+    """, (fetched_at, [t for t, _a in pairs],
+          [a["id"] for _t, a in pairs], [a["title_hash"] for _t, a in pairs],
+          [a["title"] for _t, a in pairs], [a["url"] for _t, a in pairs],
+          [a["published"] for _t, a in pairs]))
+    return len(rows)
+
+def latest_articles(topics, count):
+    """
+    一次查詢撈出每個主題最新的 count 則（每個主題走索引取前 count 筆），
+    回傳 { topic: [{"title", "url", "published"}, ...] }
+    """
+    rows = _query("""
+      SELECT t.topic, a.title, a.url, a.published_at
+      FROM unnest(CAST(%s AS TEXT[])) AS t(topic)
+      CROSS JOIN LATERAL (
+        SELECT title, url, published_at FROM news_articles
+        WHERE topic = t.topic
+        ORDER BY published_at DESC, fetched_at DESC
+        LIMIT %s
+      ) a
+    """, (list(topics), count))
+    result = {}
+    for topic, title, url, published in rows:
+        result.setdefault(topic, []).append({"title": title, "url": url, "published": published})
+    return result
+
+def purge_articles(before):
+    """刪除 before 之前匯入（fetched_at）的新聞；依發布時間刪的話，feed 裡還在的舊新聞下次會被當成新的再寫入"""
+    rows = _query("DELETE FROM news_articles WHERE fetched_at < %s RETURNING 1", (before,))
+    return len(rows)
+
+def count_topic_subscribers():
+    """回傳 { topic: 訂閱人數 }"""
+    rows = _query("SELECT topic, count(*) FROM subscriptions GROUP BY topic")
+    return {topic: n for topic, n in rows}
+
+def list_topic_pairs(min_count=1):
+    """
+    同時訂閱兩個主題的人數（稀疏，只回傳有共同訂閱者的組合），
+    回傳 [(topic_a, topic_b, 人數), ...]，topic_a < topic_b
+    """
+    return [tuple(r) for r in _query("""
+      SELECT a.topic, b.topic, count(*)
+      FROM subscriptions a
+      JOIN subscriptions b ON b.user_id = a.user_id AND a.topic < b.topic
+      GROUP BY a.topic, b.topic
+      HAVING count(*) >= %s
+    """, (min_count,))]
+
+def recent_titles(since, limit=10000):
+    """published_at >= since 的新聞標題（去重），最新的在前"""
+    rows = _query("""
+      SELECT title FROM news_articles
+      WHERE published_at >= %s
+      GROUP BY title
+      ORDER BY max(published_at) DESC
+      LIMIT %s
+    """, (since, limit))
+    return [r[0] for r in rows]
+
+def load_delivered(user_ids):
+    """回傳 { user_id: (filter bytes, item_count) }，沒有紀錄的使用者不在結果中"""
+    rows = _query("""
+      SELECT user_id, filter, item_count FROM delivered_filters
+      WHERE user_id = ANY(CAST(%s AS TEXT[]))
+    """, (list(user_ids),))
+    return {user_id: (bytes(data), count) for user_id, data, count in rows}
+
+def save_delivered(records):
+    """records: [(user_id, filter bytes, item_count), ...]，一個 statement 寫入"""
+    if not records:
+        return
+    _execute("""
+      INSERT INTO delivered_filters(user_id, filter, item_count)
+      SELECT * FROM unnest(CAST(%s AS TEXT[]), CAST(%s AS BYTEA[]), CAST(%s AS INTEGER[]))
+      ON CONFLICT(user_id) DO UPDATE SET filter=EXCLUDED.filter, item_count=EXCLUDED.item_count
+    """, ([r[0] for r in records], [r[1] for r in records], [r[2] for r in records]))
+
+def init_db():
+    with get_conn() as conn:
+        cur = conn.cursor()
+        # 建立三張表格
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS subscriptions (
+          user_id TEXT NOT NULL,
+          topic   TEXT NOT NULL,
+          PRIMARY KEY(user_id, topic)
+        );
+        """)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS push_topics (
+          user_id    TEXT NOT NULL,
+          topic      TEXT NOT NULL,
+          is_enabled BOOLEAN NOT NULL,
+          PRIMARY KEY(user_id, topic)
+        );
+        """)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS push_schedule (
+          user_id   TEXT PRIMARY KEY,
+          push_time TEXT NOT NULL
+        );
+        """)
+        # 排程每分鐘以 push_time 查詢到期使用者
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_push_schedule_time
+          ON push_schedule(push_time);
+        """)
+        # 每個推播分片最後發送到哪一分鐘（多 worker 時避免重複發送）
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS push_shard_state (
+          shard     INTEGER PRIMARY KEY,
+          last_slot TEXT NOT NULL
+        );
+        """)
+        # 背景匯入的新聞：同主題內以網址與標題雜湊去重
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS news_articles (
+          topic        TEXT NOT NULL,
+          article_id   TEXT NOT NULL,
+          title_hash   TEXT NOT NULL,
+          title        TEXT NOT NULL,
+          url          TEXT NOT NULL,
+          published_at DOUBLE PRECISION NOT NULL,
+          fetched_at   DOUBLE PRECISION NOT NULL,
+          PRIMARY KEY(topic, article_id)
+        );
+        """)
+        cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_news_articles_title
+          ON news_articles(topic, title_hash);
+        """)
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_news_articles_latest
+          ON news_articles(topic, published_at DESC);
+        """)
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_news_articles_published
+          ON news_articles(published_at);
+        """)
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_news_articles_fetched
+          ON news_articles(fetched_at);
+        """)
+        # 每位使用者已送過的新聞（Bloom filter，見 seen.py）
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS delivered_filters (
+          user_id    TEXT PRIMARY KEY,
+          filter     BYTEA NOT NULL,
+          item_count INTEGER NOT NULL
+        );
+        """)
+        conn.commit()
+        cur.close()
+
+def list_subscriptions(user_id):
+    rows = _query(f"SELECT topic FROM subscriptions WHERE user_id=%s ORDER BY {_TOPIC_ORDER}", (user_id,))
+    return [r[0] for r in rows]
+
+def add_subscription(user_id, topic):
+    _execute(
+      "INSERT INTO subscriptions(user_id, topic) VALUES(%s, %s) ON CONFLICT DO NOTHING",
+      (user_id, topic)
+    )
+
+def remove_subscription(user_id, topic):
+    _execute(
+      "DELETE FROM subscriptions WHERE user_id=%s AND topic=%s",
+      (user_id, topic)
+    )
+
+def add_subscriptions(user_id, topics):
+    """
+    一次交易新增多個訂閱，回傳新增後的完整訂閱清單（依主題排序）
+    （RETURNING 的結果併上交易前既有的訂閱）
+    """
+    rows = _query(f"""
+      WITH ins AS (
+        INSERT INTO subscriptions(user_id, topic)
+        SELECT %s, t FROM unnest(CAST(%s AS TEXT[])) AS t
+        ON CONFLICT DO NOTHING
+        RETURNING topic
+      )
+      SELECT topic FROM (
+        SELECT topic FROM subscriptions WHERE user_id=%s
+        UNION
+        SELECT topic FROM ins
+      ) AS s
+      ORDER BY {_TOPIC_ORDER}
+    """, (user_id, list(topics), user_id))
+    return [r[0] for r in rows]
+
+def remove_subscriptions(user_id, topics):
+    """一次交易刪除多個訂閱，回傳刪除後剩下的訂閱清單（依主題排序）"""
+    rows = _query(f"""
+      WITH del AS (
+        DELETE FROM subscriptions
+        WHERE user_id=%s AND topic = ANY(CAST(%s AS TEXT[]))
+        RETURNING topic
+      )
+      SELECT topic FROM subscriptions
+      WHERE user_id=%s AND topic NOT IN (SELECT topic FROM del)
+      ORDER BY {_TOPIC_ORDER}
+    """, (user_id, list(topics), user_id))
+    return [r[0] for r in rows]
+
+def list_push_topics(user_id):
+    rows = _query(
+      f"SELECT topic, is_enabled FROM push_topics WHERE user_id=%s ORDER BY {_TOPIC_ORDER}",
+      (user_id,)
+    )
+    return {r[0]: r[1] for r in rows}
+
+def set_push_choice(user_id, topic, choice: bool):
+    _execute("""
+      INSERT INTO push_topics(user_id, topic, is_enabled)
+      VALUES(%s, %s, %s)
+      ON CONFLICT(user_id, topic) DO UPDATE SET is_enabled=EXCLUDED.is_enabled
+    """, (user_id, topic, choice))
+
+def set_push_choices(user_id, choices):
+    """
+    choices: { topic: bool }，一次交易寫入多個推播選擇，
+    回傳寫入後該使用者完整的推播設定 { topic: bool }
+    """
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.executemany("""
+          INSERT INTO push_topics(user_id, topic, is_enabled)
+          VALUES(%s, %s, %s)
+          ON CONFLICT(user_id, topic) DO UPDATE SET is_enabled=EXCLUDED.is_enabled
+        """, [(user_id, topic, bool(choice)) for topic, choice in choices.items()])
+        cur.execute(
+          f"SELECT topic, is_enabled FROM push_topics WHERE user_id=%s ORDER BY {_TOPIC_ORDER}",
+          (user_id,)
+        )
+        rows = cur.fetchall()
+        conn.commit()
+        cur.close()
+    return {r[0]: r[1] for r in rows}
+
+def set_push_time(user_id, push_time: str):
+    # push_time 為 None 表示取消推播時間（欄位為 NOT NULL，直接刪除該筆）
+    if push_time is None:
+        _execute("DELETE FROM push_schedule WHERE user_id=%s", (user_id,))
+        return
+    _execute("""
+      INSERT INTO push_schedule(user_id, push_time)
+      VALUES(%s, %s)
+      ON CONFLICT(user_id) DO UPDATE SET push_time=EXCLUDED.push_time
+    """, (user_id, push_time))
+
+def get_push_time(user_id):
+    rows = _query("SELECT push_time FROM push_schedule WHERE user_id=%s", (user_id,))
+    return rows[0][0] if rows else None
+
+def list_push_schedule():
+    """
+    從資料庫撈出所有使用者的推播時間設定，
+    回傳格式為 dict: { user_id: push_time, ... }
+    """
+    rows = _query("SELECT user_id, push_time FROM push_schedule")
+    # 把 list of tuples 轉成 dict
+    return {user_id: push_time for user_id, push_time in rows}
+
+def list_due_pushes(push_time):
+    """
+    一次查詢撈出在 push_time（"HH:MM"）到期的使用者與其啟用的推播主題，
+    回傳格式為 dict: { user_id: [topic, ...], ... }
+    """
+    rows = _query(f"""
+      SELECT s.user_id, t.topic
+      FROM push_schedule s
+      JOIN push_topics t ON t.user_id = s.user_id AND t.is_enabled
+      WHERE s.push_time = %s
+      ORDER BY s.user_id, t.{_TOPIC_ORDER}
+    """, (push_time,))
+    due = {}
+    for user_id, topic in rows:
+        due.setdefault(user_id, []).append(topic)
+    return due
+
+def list_enabled_push_topics(user_ids):
+    """
+    一次查詢撈出多位使用者啟用的推播主題，
+    回傳格式為 dict: { user_id: [topic, ...], ... }
+    """
+    rows = _query(f"""
+      SELECT user_id, topic FROM push_topics
+      WHERE is_enabled AND user_id = ANY(CAST(%s AS TEXT[]))
+      ORDER BY user_id, {_TOPIC_ORDER}
+    """, (list(user_ids),))
+    result = {}
+    for user_id, topic in rows:
+        result.setdefault(user_id, []).append(topic)
+    return result
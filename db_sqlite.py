@@ -0,0 +1,407 @@
+# db_sqlite.py
+# 內嵌 SQLite 儲存後端（WAL 模式），給單機部署與壓測使用，由 db.py 依 DATABASE_URL 選用
+import os
+import sqlite3
+import weakref
+import threading
+from contextlib import contextmanager
+
+# 後端能力：沒有 LISTEN/NOTIFY 與 advisory lock，這些操作（notify、open_listener、
+# open_lock_session …）不提供；呼叫端先看旗標，不會啟動跨行程通知，cluster 視為單機
+SUPPORTS_NOTIFY         = False
+SUPPORTS_ADVISORY_LOCKS = False
+
+__all__ = [
+    "SUPPORTS_NOTIFY", "SUPPORTS_ADVISORY_LOCKS",
+    "get_conn", "pool_stats", "init_db", "list_subscriptions", "add_subscription",
+    "remove_subscription", "add_subscriptions", "remove_subscriptions",
+    "list_push_topics", "set_push_choice", "set_push_choices", "set_push_time",
+    "get_push_time", "list_push_schedule", "list_due_pushes", "list_enabled_push_topics",
+    "claim_push_slots", "list_subscribed_topics", "save_articles", "latest_articles",
+    "purge_articles", "load_delivered", "save_delivered", "count_topic_subscribers",
+    "list_topic_pairs", "recent_titles", "save_matched_articles",
+]
+
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "5"))   # 等待寫入鎖的秒數
+_MAX_VARIABLES = 500   # IN (...) 每批最多幾個參數
+
+_path = None
+_uri = False
+_local = threading.local()
+_lock = threading.Lock()
+_open = 0      # 目前開著的連線數（統計用）
+_created = 0   # 累計建立過的連線數
+
+# 記憶體資料庫需要保留一條連線，否則最後一條關閉時資料就消失
+_keepalive = None
+# 共用快取的記憶體資料庫是表格層級的鎖，衝突時直接回 "table is locked"、不會等 busy timeout，
+# 所以記憶體模式下整個交易串行執行（檔案模式仍是 WAL 並行）
+_memory_lock = None
+
+
+def configure(parsed_url):
+    """sqlite:///相對路徑.db、sqlite:////絕對路徑.db 或 sqlite:///:memory:"""
+    global _path, _uri, _keepalive, _memory_lock
+    path = parsed_url.path[1:] if parsed_url.path.startswith("/") else parsed_url.path
+    if path in ("", ":memory:"):
+        # 共用快取的記憶體資料庫，讓各執行緒看到同一份資料
+        _path, _uri = f"file:linebot-{id(_local)}?mode=memory&cache=shared", True
+        _memory_lock = threading.RLock()
+        _keepalive = _connect()
+    else:
+        _path, _uri, _memory_lock = path, False, None
+
+def _connect():
+    global _open, _created
+    conn = sqlite3.connect(_path, uri=_uri, timeout=SQLITE_BUSY_TIMEOUT,
+                           check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with _lock:
+        _open += 1
+        _created += 1
+    return conn
+
+def _close(conn):
+    global _open
+    try:
+        conn.close()
+    except Exception:
+        pass
+    with _lock:
+        _open -= 1
+
+
+class _ThreadConn:
+    # sqlite3.Connection 不能被 weakref，包一層讓執行緒結束、thread-local 被回收時關閉連線
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn):
+        self.conn = conn
+
+
+@contextmanager
+def get_conn():
+    """每個執行緒一條連線（WAL 下讀寫可並行）；正常離開時 commit，錯誤時 rollback"""
+    holder = getattr(_local, "holder", None)
+    if holder is None:
+        holder = _local.holder = _ThreadConn(_connect())
+        weakref.finalize(holder, _close, holder.conn)
+    conn = holder.conn
+    serial = _memory_lock
+    if serial is not None:
+        serial.acquire()
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+    finally:
+        if serial is not None:
+            serial.release()
+
+def pool_stats():
+    with _lock:
+        return {"backend": "sqlite", "size": _open, "created": _created}
+
+def _query(sql, params=()):
+    with get_conn() as conn:
+        return conn.execute(sql, params).fetchall()
+
+def _execute(sql, params=()):
+    with get_conn() as conn:
+        conn.execute(sql, params)
+
+def _chunks(items):
+    items = list(items)
+    for i in range(0, len(items), _MAX_VARIABLES):
+        yield items[i:i + _MAX_VARIABLES]
+
+def claim_push_slots(shards, slot):
+    """把各分片的 last_slot 推進到 slot，回傳成功推進的分片清單（寫入鎖保證只有一個行程成功）"""
+    claimed = []
+    with get_conn() as conn:
+        for shard in shards:
+            row = conn.execute("""
+              INSERT INTO push_shard_state(shard, last_slot) VALUES(?, ?)
+              ON CONFLICT(shard) DO UPDATE SET last_slot=excluded.last_slot
+                WHERE push_shard_state.last_slot < excluded.last_slot
+              RETURNING shard
+            """, (shard, slot)).fetchone()
+            if row:
+                claimed.append(row[0])
+    return claimed
+
+def list_subscribed_topics():
+    rows = _query("SELECT DISTINCT topic FROM subscriptions")
+    return [r[0] for r in rows]
+
+def save_articles(topic, articles, fetched_at):
+    """寫入正規化後的新聞，重複的（同網址或同標題）略過，回傳實際新增的筆數"""
+    if not articles:
+        return 0
+    with get_conn() as conn:
+        before = conn.total_changes
+        conn.executemany("""
+          INSERT INTO news_articles(topic, article_id, title_hash, title, url, published_at, fetched_at)
+          VALUES(?, ?, ?, ?, ?, ?, ?)
+          ON CONFLICT DO NOTHING
+        """, [(topic, a["id"], a["title_hash"], a["title"], a["url"], a["published"], fetched_at)
+              for a in articles])
+        return conn.total_changes - before
+
+def save_matched_articles(matches, fetched_at):
+    """matches: { topic: [正規化後的新聞, ...] }，一次寫入，回傳實際新增的筆數"""
+    rows = [(topic, a["id"], a["title_hash"], a["title"], a["url"], a["published"], fetched_at)
+            for topic, articles in matches.items() for a in articles]
+    if not rows:
+        return 0
+    with get_conn() as conn:
+        before = conn.total_changes
+        conn.executemany("""
+          INSERT INTO news_articles(topic, article_id, title_hash, title, url, published_at, fetched_at)
+          VALUES(?, ?, ?, ?, ?, ?, ?)
+          ON CONFLICT DO NOTHING
+        """, rows)
+        return conn.total_changes - before
+
+def latest_articles(topics, count):
+    """一次查詢撈出每個主題最新的 count 則，回傳 { topic: [{"title", "url", "published"}, ...] }"""
+    result = {}
+    with get_conn() as conn:
+        for chunk in _chunks(topics):
+            marks = ",".join("?" * len(chunk))
+            rows = conn.execute(f"""
+              SELECT topic, title, url, published_at FROM (
+                SELECT topic, title, url, published_at,
+                       ROW_NUMBER() OVER (PARTITION BY topic
+                                          ORDER BY published_at DESC, fetched_at DESC) AS rn
+                FROM news_articles WHERE topic IN ({marks})
+              ) WHERE rn <= ?
+              ORDER BY topic, rn
+            """, chunk + [count]).fetchall()
+            for topic, title, url, published in rows:
+                result.setdefault(topic, []).append({"title": title, "url": url, "published": published})
+    return result
+
+def purge_articles(before):
+    """刪除 before 之前匯入（fetched_at）的新聞；依發布時間刪的話，feed 裡還在的舊新聞下次會被當成新的再寫入"""
+    with get_conn() as conn:
+        return conn.execute("DELETE FROM news_articles WHERE fetched_at < ?", (before,)).rowcount
+
+def count_topic_subscribers():
+    rows = _query("SELECT topic, count(*) FROM subscriptions GROUP BY topic")
+    return {topic: n for topic, n in rows}
+
+def list_topic_pairs(min_count=1):
+    """同時訂閱兩個主題的人數，回傳 [(topic_a, topic_b, 人數), ...]，topic_a < topic_b"""
+    return _query("""
+      SELECT a.topic, b.topic, count(*)
+      FROM subscriptions a
+      JOIN subscriptions b ON b.user_id = a.user_id AND a.topic < b.topic
+      GROUP BY a.topic, b.topic
+      HAVING count(*) >= ?
+    """, (min_count,))
+
+def recent_titles(since, limit=10000):
+    rows = _query("""
+      SELECT title FROM news_articles
+      WHERE published_at >= ?
+      GROUP BY title
+      ORDER BY max(published_at) DESC
+      LIMIT ?
+    """, (since, limit))
+    return [r[0] for r in rows]
+
+def load_delivered(user_ids):
+    """回傳 { user_id: (filter bytes, item_count) }，沒有紀錄的使用者不在結果中"""
+    result = {}
+    with get_conn() as conn:
+        for chunk in _chunks(user_ids):
+            marks = ",".join("?" * len(chunk))
+            rows = conn.execute(f"""
+              SELECT user_id, filter, item_count FROM delivered_filters
+              WHERE user_id IN ({marks})
+            """, chunk).fetchall()
+            for user_id, data, count in rows:
+                result[user_id] = (bytes(data), count)
+    return result
+
+def save_delivered(records):
+    """records: [(user_id, filter bytes, item_count), ...]，同一個交易內以 executemany 寫入"""
+    if not records:
+        return
+    with get_conn() as conn:
+        conn.executemany("""
+          INSERT INTO delivered_filters(user_id, filter, item_count) VALUES(?, ?, ?)
+          ON CONFLICT(user_id) DO UPDATE SET filter=excluded.filter, item_count=excluded.item_count
+        """, records)
+
+def init_db():
+    with get_conn() as conn:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS subscriptions (
+          user_id TEXT NOT NULL,
+          topic   TEXT NOT NULL,
+          PRIMARY KEY(user_id, topic)
+        )
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS push_topics (
+          user_id    TEXT NOT NULL,
+          topic      TEXT NOT NULL,
+          is_enabled BOOLEAN NOT NULL,
+          PRIMARY KEY(user_id, topic)
+        )
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS push_schedule (
+          user_id   TEXT PRIMARY KEY,
+          push_time TEXT NOT NULL
+        )
+        """)
+        conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_push_schedule_time
+          ON push_schedule(push_time)
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS push_shard_state (
+          shard     INTEGER PRIMARY KEY,
+          last_slot TEXT NOT NULL
+        )
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS news_articles (
+          topic        TEXT NOT NULL,
+          article_id   TEXT NOT NULL,
+          title_hash   TEXT NOT NULL,
+          title        TEXT NOT NULL,
+          url          TEXT NOT NULL,
+          published_at REAL NOT NULL,
+          fetched_at   REAL NOT NULL,
+          PRIMARY KEY(topic, article_id)
+        )
+        """)
+        conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_news_articles_title
+          ON news_articles(topic, title_hash)
+        """)
+        conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_news_articles_latest
+          ON news_articles(topic, published_at DESC)
+        """)
+        conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_news_articles_published
+          ON news_articles(published_at)
+        """)
+        conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_news_articles_fetched
+          ON news_articles(fetched_at)
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS delivered_filters (
+          user_id    TEXT PRIMARY KEY,
+          filter     BLOB NOT NULL,
+          item_count INTEGER NOT NULL
+        )
+        """)
+
+def list_subscriptions(user_id):
+    rows = _query("SELECT topic FROM subscriptions WHERE user_id=? ORDER BY topic", (user_id,))
+    return [r[0] for r in rows]
+
+def add_subscription(user_id, topic):
+    add_subscriptions(user_id, [topic])
+
+def remove_subscription(user_id, topic):
+    remove_subscriptions(user_id, [topic])
+
+def add_subscriptions(user_id, topics):
+    """一次交易新增多個訂閱，回傳新增後的完整訂閱清單（依主題排序）"""
+    with get_conn() as conn:
+        conn.executemany(
+          "INSERT INTO subscriptions(user_id, topic) VALUES(?, ?) ON CONFLICT DO NOTHING",
+          [(user_id, t) for t in topics]
+        )
+        rows = conn.execute("SELECT topic FROM subscriptions WHERE user_id=? ORDER BY topic",
+                            (user_id,)).fetchall()
+    return [r[0] for r in rows]
+
+def remove_subscriptions(user_id, topics):
+    """一次交易刪除多個訂閱，回傳刪除後剩下的訂閱清單（依主題排序）"""
+    with get_conn() as conn:
+        conn.executemany(
+          "DELETE FROM subscriptions WHERE user_id=? AND topic=?",
+          [(user_id, t) for t in topics]
+        )
+        rows = conn.execute("SELECT topic FROM subscriptions WHERE user_id=? ORDER BY topic",
+                            (user_id,)).fetchall()
+    return [r[0] for r in rows]
+
+def list_push_topics(user_id):
+    rows = _query("SELECT topic, is_enabled FROM push_topics WHERE user_id=? ORDER BY topic", (user_id,))
+    return {r[0]: bool(r[1]) for r in rows}
+
+def set_push_choice(user_id, topic, choice: bool):
+    set_push_choices(user_id, {topic: choice})
+
+def set_push_choices(user_id, choices):
+    """一次交易寫入多個推播選擇，回傳寫入後完整的推播設定 { topic: bool }"""
+    with get_conn() as conn:
+        conn.executemany("""
+          INSERT INTO push_topics(user_id, topic, is_enabled)
+          VALUES(?, ?, ?)
+          ON CONFLICT(user_id, topic) DO UPDATE SET is_enabled=excluded.is_enabled
+        """, [(user_id, topic, bool(choice)) for topic, choice in choices.items()])
+        rows = conn.execute(
+          "SELECT topic, is_enabled FROM push_topics WHERE user_id=? ORDER BY topic", (user_id,)
+        ).fetchall()
+    return {r[0]: bool(r[1]) for r in rows}
+
+def set_push_time(user_id, push_time: str):
+    # push_time 為 None 表示取消推播時間
+    if push_time is None:
+        _execute("DELETE FROM push_schedule WHERE user_id=?", (user_id,))
+        return
+    _execute("""
+      INSERT INTO push_schedule(user_id, push_time)
+      VALUES(?, ?)
+      ON CONFLICT(user_id) DO UPDATE SET push_time=excluded.push_time
+    """, (user_id, push_time))
+
+def get_push_time(user_id):
+    rows = _query("SELECT push_time FROM push_schedule WHERE user_id=?", (user_id,))
+    return rows[0][0] if rows else None
+
+def list_push_schedule():
+    rows = _query("SELECT user_id, push_time FROM push_schedule")
+    return {user_id: push_time for user_id, push_time in rows}
+
+def list_due_pushes(push_time):
+    rows = _query("""
+      SELECT s.user_id, t.topic
+      FROM push_schedule s
+      JOIN push_topics t ON t.user_id = s.user_id AND t.is_enabled
+      WHERE s.push_time = ?
+      ORDER BY s.user_id, t.topic
+    """, (push_time,))
+    due = {}
+    for user_id, topic in rows:
+        due.setdefault(user_id, []).append(topic)
+    return due
+
+def list_enabled_push_topics(user_ids):
+    result = {}
+    with get_conn() as conn:
+        for chunk in _chunks(user_ids):
+            marks = ",".join("?" * len(chunk))
+            rows = conn.execute(f"""
+              SELECT user_id, topic FROM push_topics
+              WHERE is_enabled AND user_id IN ({marks})
+              ORDER BY user_id, topic
+            """, chunk).fetchall()
+            for user_id, topic in rows:
+                result.setdefault(user_id, []).append(topic)
+    return result
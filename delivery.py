@@ -0,0 +1,97 @@
+# delivery.py
+# 排程推播的發送階段：內容相同的使用者合併成 multicast，其餘並行 push
+import os
+import time
+import threading
+import concurrent.futures
+
+from linebot.v3.messaging import PushMessageRequest, MulticastRequest
+from linebot.v3.messaging.exceptions import ApiException
+
+MULTICAST_MAX_RECIPIENTS = 500   # LINE multicast 每次最多 500 人
+
+# 發送設定（可由環境變數調整）
+PUSH_SEND_WORKERS  = int(os.getenv("PUSH_SEND_WORKERS", "8"))
+PUSH_RATE_LIMIT    = float(os.getenv("PUSH_RATE_LIMIT", "100"))    # 每秒最多幾次 API 呼叫，0 = 不限
+PUSH_MAX_RETRIES   = int(os.getenv("PUSH_MAX_RETRIES", "3"))       # 遇到 429 最多重試幾次
+PUSH_RETRY_BACKOFF = float(os.getenv("PUSH_RETRY_BACKOFF", "1"))   # 重試等待秒數（指數成長）
+
+
+class RateLimiter:
+    # 固定間隔的速率限制，多執行緒共用
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next)
+            self._next = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+def _retry_after(e, attempt):
+    # 優先採用伺服器給的 Retry-After，否則指數退避
+    try:
+        return float(e.headers.get("Retry-After"))
+    except (AttributeError, TypeError, ValueError):
+        return PUSH_RETRY_BACKOFF * (2 ** attempt)
+
+def _send(send, request, limiter, stats, lock):
+    for attempt in range(PUSH_MAX_RETRIES + 1):
+        limiter.wait()
+        try:
+            send(request)
+            return True
+        except ApiException as e:
+            if e.status != 429 or attempt == PUSH_MAX_RETRIES:
+                return False
+            with lock:
+                stats["retried"] += 1
+            time.sleep(_retry_after(e, attempt))
+        except Exception:
+            return False
+    return False
+
+def deliver(api, batches, delivered_users=None):
+    """
+    batches: [(messages, [user_id, ...]), ...]，同一批的使用者收到完全相同的訊息。
+    多人的批次以 multicast 發送（每次最多 500 人），只有一人的批次則並行 push。
+    delivered_users 若給 list，成功送達的 user_id 會加進去。
+    回傳本次發送的統計。
+    """
+    start = time.monotonic()
+    stats = {"users": sum(len(uids) for _, uids in batches), "delivered": 0, "failed": 0,
+             "retried": 0, "multicast_calls": 0, "push_calls": 0, "elapsed": 0.0}
+
+    jobs = []   # [(send, request, recipients)]
+    for messages, uids in batches:
+        if len(uids) == 1:
+            jobs.append((api.push_message, PushMessageRequest(to=uids[0], messages=messages), uids))
+            stats["push_calls"] += 1
+            continue
+        for i in range(0, len(uids), MULTICAST_MAX_RECIPIENTS):
+            chunk = uids[i:i + MULTICAST_MAX_RECIPIENTS]
+            jobs.append((api.multicast, MulticastRequest(to=chunk, messages=messages), chunk))
+            stats["multicast_calls"] += 1
+
+    limiter = RateLimiter(PUSH_RATE_LIMIT)
+    lock = threading.Lock()
+    if jobs:
+        workers = max(1, min(PUSH_SEND_WORKERS, len(jobs)))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as exe:
+            futures = {exe.submit(_send, send, req, limiter, stats, lock): uids
+                       for send, req, uids in jobs}
+            for fut in concurrent.futures.as_completed(futures):
+                ok = fut.result()
+                stats["delivered" if ok else "failed"] += len(futures[fut])
+                if ok and delivered_users is not None:
+                    delivered_users.extend(futures[fut])
+
+    stats["elapsed"] = time.monotonic() - start
+    return stats
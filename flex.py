@@ -0,0 +1,85 @@
+# flex.py
+# 新聞輪播的 Flex 產生：每則新聞的 bubble 驗證一次後快取，再組成輪播
+import os
+import json
+import threading
+from collections import OrderedDict
+
+from linebot.v3.messaging import FlexMessage, FlexCarousel, FlexBubble
+
+import metrics
+
+# LINE 限制
+MAX_BUBBLES_PER_CAROUSEL = 12
+MAX_CAROUSEL_BYTES       = 50 * 1000   # 單一 Flex 輪播 JSON 上限約 50KB
+MAX_MESSAGES_PER_REQUEST = 5           # push / multicast / reply 一次最多 5 則
+
+FLEX_CACHE_SIZE = int(os.getenv("FLEX_CACHE_SIZE", "2048"))
+
+_CAROUSEL_OVERHEAD = len('{"type":"carousel","contents":[]}')
+
+
+def bubble_dict(topic, n):
+    return {
+        "type":"bubble","size":"micro",
+        "body":{"type":"box","layout":"vertical","contents":[
+            {"type":"text","text":topic,"weight":"bold","size":"md","margin":"md"},
+            {"type":"text","text":n["title"],"size":"sm","weight":"bold","wrap":True,"margin":"sm"}
+        ]},
+        "footer":{"type":"box","layout":"vertical","contents":[
+            {"type":"button","action":{"type":"uri","label":"開啟新聞","uri":n["url"]},
+             "style":"primary","height":"sm","gravity":"center","margin":"md"}
+        ],"spacing":"sm","paddingAll":"10px"}
+    }
+
+
+_lock = threading.Lock()
+_bubbles = OrderedDict()   # (topic, url, title) -> (FlexBubble, JSON bytes)
+flex_stats_counters = {"hits": 0, "misses": 0}
+
+def news_bubble(topic, n):
+    """回傳 (已驗證的 FlexBubble, JSON 大小)，同一則新聞只驗證一次"""
+    key = (topic, n["url"], n["title"])
+    with _lock:
+        cached = _bubbles.get(key)
+        if cached is not None:
+            _bubbles.move_to_end(key)
+            flex_stats_counters["hits"] += 1
+            return cached
+        flex_stats_counters["misses"] += 1
+
+    d = bubble_dict(topic, n)
+    cached = (FlexBubble.from_dict(d),
+              len(json.dumps(d, ensure_ascii=False, separators=(",", ":")).encode("utf-8")))
+    with _lock:
+        _bubbles[key] = cached
+        while len(_bubbles) > FLEX_CACHE_SIZE:
+            _bubbles.popitem(last=False)
+    return cached
+
+@metrics.timed("flex_build_seconds")
+def build_carousel_messages(articles, alt_text):
+    """
+    articles: [(topic, {"title", "url"}), ...]
+    依 LINE 限制分頁：每個輪播最多 12 個 bubble、不超過大小上限，
+    最多 5 則訊息（超出的新聞捨棄）。
+    """
+    pages, page, size = [], [], _CAROUSEL_OVERHEAD
+    for topic, n in articles:
+        bubble, nbytes = news_bubble(topic, n)
+        if page and (len(page) >= MAX_BUBBLES_PER_CAROUSEL
+                     or size + nbytes + 1 > MAX_CAROUSEL_BYTES):
+            pages.append(page)
+            page, size = [], _CAROUSEL_OVERHEAD
+        page.append(bubble)
+        size += nbytes + 1
+    if page:
+        pages.append(page)
+    return [FlexMessage(alt_text=alt_text, contents=FlexCarousel(contents=p))
+            for p in pages[:MAX_MESSAGES_PER_REQUEST]]
+
+def flex_stats():
+    with _lock:
+        s = dict(flex_stats_counters)
+        s["size"] = len(_bubbles)
+    return s
@@ -0,0 +1,274 @@
+# ingest.py
+# 背景新聞匯入：輪詢每個有人訂閱的主題，正規化、去重後寫進 news_articles，
+# 即時新聞與排程推播改從資料庫讀最新的幾則，不必在請求當下等 RSS
+import os
+import re
+import time
+import heapq
+import hashlib
+import threading
+import concurrent.futures
+
+import db
+import rss
+import matcher   # 匯入的標題比對所有訂閱關鍵字，比對到的寫到該關鍵字底下
+from cluster import coordinator   # 多 worker 時每個主題只由負責該分片的 worker 輪詢
+from subscribetest import ALL_TOPICS
+
+# 設定（可由環境變數調整）
+NEWS_INGEST              = os.getenv("NEWS_INGEST", "0") == "1"                    # 背景匯入新聞（預設關閉）
+NEWS_INGEST_MIN_INTERVAL = float(os.getenv("NEWS_INGEST_MIN_INTERVAL", "60"))     # 最快幾秒輪詢一次
+NEWS_INGEST_MAX_INTERVAL = float(os.getenv("NEWS_INGEST_MAX_INTERVAL", "1800"))   # 最慢幾秒輪詢一次
+NEWS_INGEST_ITEMS        = int(os.getenv("NEWS_INGEST_ITEMS", "20"))              # 每次讀幾則
+NEWS_INGEST_WORKERS      = int(os.getenv("NEWS_INGEST_WORKERS", "4"))
+NEWS_INGEST_TOPIC_REFRESH = float(os.getenv("NEWS_INGEST_TOPIC_REFRESH", "60"))   # 幾秒重新讀一次訂閱主題
+NEWS_RETENTION_DAYS      = float(os.getenv("NEWS_RETENTION_DAYS", "7"))
+# 關鍵字比對開啟時一定輪詢的主題（新聞來源）；其他關鍵字最近有從這些新聞比對到就不單獨查 RSS
+# 預設為可訂閱的主題清單
+NEWS_FEED_TOPICS = [t for t in os.getenv("NEWS_FEED_TOPICS", ",".join(ALL_TOPICS)).split(",") if t]
+
+# 有新新聞時輪詢間隔減半，沒有時拉長 1.5 倍
+SPEEDUP  = 0.5
+SLOWDOWN = 1.5
+PURGE_EVERY = 3600
+
+_SPACES = re.compile(r"\s+")
+
+
+def _digest(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def normalize(items, fetched_at):
+    """
+    RSS 項目 -> 寫入用的資料列；以網址（沒有網址時用標題）與標題雜湊去重。
+    發布時間已超過保存期限的略過：這些新聞清掉之後仍可能留在 feed 裡，不能再當成新新聞寫入。
+    """
+    oldest = fetched_at - NEWS_RETENTION_DAYS * 86400
+    rows, seen = [], set()
+    for n in items:
+        published = n.get("published") or fetched_at
+        if published < oldest:
+            continue
+        title = _SPACES.sub(" ", n.get("title") or "").strip()
+        url = (n.get("url") or "").strip().split("#", 1)[0]
+        if not title or not url:
+            continue
+        article_id = _digest(url)
+        title_hash = _digest(title.casefold())
+        if article_id in seen or title_hash in seen:
+            continue
+        seen.update((article_id, title_hash))
+        rows.append({"id": article_id, "title_hash": title_hash, "title": title, "url": url,
+                     "published": published})
+    return rows
+
+
+class _Topic:
+    __slots__ = ("interval", "next_poll", "polls", "new_articles", "last_new", "paused")
+
+    def __init__(self, interval, next_poll):
+        self.interval     = interval
+        self.next_poll    = next_poll
+        self.polls        = 0
+        self.new_articles = 0
+        self.last_new     = None
+        self.paused       = False   # 暫停輪詢（已由其他主題的新聞涵蓋），保留輪詢間隔
+
+
+class NewsIngester:
+    """
+    每個主題各自的輪詢間隔：有新新聞就加快（最快 min_interval），
+    連續沒有新新聞就放慢（最慢 max_interval），讓冷門主題不浪費請求。
+    """
+
+    def __init__(self, min_interval=60, max_interval=1800, items=20, workers=4):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.items = items
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(workers, 1), thread_name_prefix="news-ingest")
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._topics = {}    # topic -> _Topic
+        self._heap = []      # [(next_poll, topic)]，過期的項目取出時略過
+        self._running = set()
+        self._started = False
+        self._stats = {"polls": 0, "new_articles": 0, "matched_articles": 0, "errors": 0,
+                       "purged": 0, "fallback_topics": 0}
+
+    def track(self, topics):
+        """開始輪詢這些主題（已在輪詢中的不變，暫停中的恢復、沿用原本的間隔），新主題立即排入"""
+        now = time.time()
+        added = False
+        with self._lock:
+            for topic in topics:
+                state = self._topics.get(topic)
+                if state is None:
+                    state = self._topics[topic] = _Topic(self.min_interval, now)
+                elif state.paused:
+                    state.paused = False
+                    state.next_poll = max(state.next_poll, now)
+                else:
+                    continue
+                heapq.heappush(self._heap, (state.next_poll, topic))
+                added = True
+        if added:
+            self._wake.set()
+
+    def _sync_topics(self):
+        # 以 DB 的訂閱為準：新訂閱的主題加入，已經沒人訂閱的移除
+        subscribed = set(db.list_subscribed_topics())
+        wanted = subscribed
+        if matcher.KEYWORD_MATCH:
+            # 固定的新聞來源一定輪詢；關鍵字在 max_interval 內有從其他主題的新聞比對到就暫停，
+            # 不必單獨查（仍有人訂閱，保留狀態，涵蓋不到時沿用原本的間隔恢復）
+            wanted = set(NEWS_FEED_TOPICS) | {
+                t for t in subscribed if not matcher.covered(t, self.max_interval)}
+            subscribed = subscribed | wanted
+        with self._lock:
+            for topic, state in list(self._topics.items()):
+                if topic not in subscribed:
+                    del self._topics[topic]
+                elif topic not in wanted:
+                    state.paused = True
+        self.track(wanted)
+
+    def _mine(self, topic):
+        return coordinator.standalone or coordinator.shard_of(topic) in coordinator.owned()
+
+    def poll(self, topic):
+        """抓一次並寫入，回傳新增的筆數"""
+        fetched_at = time.time()
+        matched = 0
+        try:
+            rows = normalize(rss.fetch_feed(topic, self.items), fetched_at)
+            new = db.save_articles(topic, rows, fetched_at)
+            if matcher.KEYWORD_MATCH and rows:
+                matched = db.save_matched_articles(matcher.match_articles(rows, exclude=topic), fetched_at)
+        except Exception:
+            with self._lock:
+                self._stats["errors"] += 1
+            new = None
+        with self._lock:
+            self._stats["polls"] += 1
+            state = self._topics.get(topic)
+            if state is not None:
+                state.polls += 1
+                if new:
+                    state.new_articles += new
+                    state.last_new = fetched_at
+                    state.interval = max(self.min_interval, state.interval * SPEEDUP)
+                else:
+                    # 沒有新新聞或抓取失敗都放慢
+                    state.interval = min(self.max_interval, state.interval * SLOWDOWN)
+                state.next_poll = time.time() + state.interval
+                heapq.heappush(self._heap, (state.next_poll, topic))
+            self._stats["new_articles"] += new or 0
+            if new is not None:
+                self._stats["matched_articles"] += matched
+            self._running.discard(topic)
+        return new or 0
+
+    def _due(self, now):
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                next_poll, topic = heapq.heappop(self._heap)
+                state = self._topics.get(topic)
+                if (state is None or state.paused or state.next_poll != next_poll
+                        or topic in self._running or topic in due):
+                    continue   # 主題已移除、暫停或已重新排程（恢復時可能重複排入）
+                due.append(topic)
+            wait = self._heap[0][0] - now if self._heap else NEWS_INGEST_TOPIC_REFRESH
+        return due, wait
+
+    def _reschedule(self, topic):
+        # 不歸本 worker 負責的主題，晚一點再確認
+        with self._lock:
+            state = self._topics.get(topic)
+            if state is not None:
+                state.next_poll = time.time() + self.min_interval
+                heapq.heappush(self._heap, (state.next_poll, topic))
+
+    def run(self):
+        last_sync = last_purge = 0.0
+        while True:
+            now = time.time()
+            try:
+                if now - last_sync >= NEWS_INGEST_TOPIC_REFRESH:
+                    self._sync_topics()
+                    last_sync = now
+                if now - last_purge >= PURGE_EVERY:
+                    purged = db.purge_articles(now - NEWS_RETENTION_DAYS * 86400)
+                    with self._lock:
+                        self._stats["purged"] += purged
+                    last_purge = now
+            except Exception:
+                with self._lock:
+                    self._stats["errors"] += 1
+            due, wait = self._due(time.time())
+            for topic in due:
+                if not self._mine(topic):
+                    self._reschedule(topic)
+                    continue
+                with self._lock:
+                    self._running.add(topic)
+                self._executor.submit(self.poll, topic)
+            self._wake.wait(min(max(wait, 0.1), NEWS_INGEST_TOPIC_REFRESH))
+            self._wake.clear()
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        threading.Thread(target=self.run, name="news-ingest", daemon=True).start()
+
+    def latest(self, topics, count, fetch):
+        """
+        一次查詢讀出每個主題最新的 count 則（順序同 topics）。
+        資料庫裡還沒有的主題（剛訂閱、尚未匯入）改用 fetch(topics) 即時抓，並寫入、開始輪詢。
+        """
+        topics = list(topics)
+        if not topics:
+            return {}
+        stored = db.latest_articles(topics, count)
+        missing = [t for t in topics if t not in stored]
+        if missing:
+            with self._lock:
+                self._stats["fallback_topics"] += len(missing)
+            fetched = fetch(missing)
+            now = time.time()
+            for topic, items in fetched.items():
+                if items:
+                    stored[topic] = items[:count]
+                    try:
+                        db.save_articles(topic, normalize(items, now), now)
+                    except Exception:
+                        pass
+            self.track(missing)
+        return {t: stored[t] for t in topics if stored.get(t)}
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            intervals = [t.interval for t in self._topics.values() if not t.paused]
+            s["topics"] = len(intervals)
+            s["paused_topics"] = len(self._topics) - len(intervals)
+        s["interval_min"] = min(intervals) if intervals else 0.0
+        s["interval_max"] = max(intervals) if intervals else 0.0
+        s["interval_avg"] = sum(intervals) / len(intervals) if intervals else 0.0
+        return s
+
+
+ingester = NewsIngester(min_interval=NEWS_INGEST_MIN_INTERVAL,
+                        max_interval=NEWS_INGEST_MAX_INTERVAL,
+                        items=NEWS_INGEST_ITEMS,
+                        workers=NEWS_INGEST_WORKERS)
+
+latest = ingester.latest
+stats = ingester.stats
+
+def start():
+    """NEWS_INGEST=1 時啟動背景匯入"""
+    if NEWS_INGEST:
+        ingester.start()
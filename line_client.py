@@ -0,0 +1,41 @@
+# line_client.py
+# 全程共用一個 MessagingApi，保留與 LINE API 的 keep-alive / TLS 連線
+import os
+import threading
+
+from linebot.v3.messaging import Configuration, ApiClient, MessagingApi
+
+import metrics
+
+# 連線設定（可由環境變數調整）
+LINE_API_POOL_SIZE       = int(os.getenv("LINE_API_POOL_SIZE", "16"))          # 同時連線數上限
+LINE_API_CONNECT_TIMEOUT = float(os.getenv("LINE_API_CONNECT_TIMEOUT", "3"))   # 秒
+LINE_API_READ_TIMEOUT    = float(os.getenv("LINE_API_READ_TIMEOUT", "10"))     # 秒
+LINE_API_HOST            = os.getenv("LINE_API_HOST")   # 壓測時指向 mock server，預設為官方 API
+
+
+class _TimeoutApiClient(ApiClient):
+    # SDK 預設沒有逾時；呼叫端沒指定 _request_timeout 時一律套用預設值
+    def call_api(self, *args, **kwargs):
+        if kwargs.get("_request_timeout") is None:
+            kwargs["_request_timeout"] = (LINE_API_CONNECT_TIMEOUT, LINE_API_READ_TIMEOUT)
+        # 第一個參數是 API 路徑，例如 /v2/bot/message/reply
+        with metrics.timer("line_api_seconds", path=args[0] if args else "unknown"):
+            return super().call_api(*args, **kwargs)
+
+
+_lock = threading.Lock()
+_messaging_api = None
+
+def get_messaging_api():
+    """回傳共用的 MessagingApi（第一次呼叫時建立，之後所有執行緒共用同一個連線池）"""
+    global _messaging_api
+    if _messaging_api is None:
+        with _lock:
+            if _messaging_api is None:
+                config = Configuration(access_token=os.getenv("CHANNEL_ACCESS_TOKEN"))
+                config.connection_pool_maxsize = LINE_API_POOL_SIZE
+                if LINE_API_HOST:
+                    config.host = LINE_API_HOST
+                _messaging_api = MessagingApi(_TimeoutApiClient(config))
+    return _messaging_api
@@ -0,0 +1,991 @@
+# loadtest.py
+# Webhook 壓測工具：本機起 mock LINE API 與 mock Google News RSS，
+# 以固定速率送出有正確簽章的 webhook 到 Flask app，最後輸出 JSON 報告。
+#
+#   python loadtest.py --rate 50 --duration 30 --users 200
+#   python loadtest.py --push-users 5000 --out report.json
+#   python loadtest.py --postback-bench 200000 --duration 0
+#   python loadtest.py --scheduler-workers 4 --push-users 2000
+#   python loadtest.py --dedup-bench 100000 --duration 0
+#   python loadtest.py --merge-bench 5000 --duration 0
+#   python loadtest.py --trending-bench 1000000 --duration 0
+#   python loadtest.py --match-bench 100000 --duration 0
+#   python loadtest.py --db-bench 20000 --duration 0
+#   python loadtest.py --fetch-bench 5000 --fetch-topics 200 --rss-delay 0.05 --duration 0
+#   python loadtest.py --client-bench 2000 --duration 0
+#   python loadtest.py --rss-parse-bench 5000 --duration 0
+#   python loadtest.py --flex-bench 5000 --duration 0
+#
+# 預設使用 sqlite:///:memory:，不需要 Postgres；要測 Postgres 可自行設定 DATABASE_URL。
+import os
+import sys
+import json
+import time
+import hmac
+import base64
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+import concurrent.futures
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHANNEL_SECRET = "loadtest-secret"
+
+TEXT_EVENTS = ["即時新聞", "管理我的訂閱", "推播訊息", "隨便聊聊"]
+POSTBACK_EVENTS = [
+    "action=recommend_keywords",
+    "action=manage_subscription",
+    "action=start_add_subscription",
+    "action=subscribe&topic={topic}",
+    "action=start_remove_subscription",
+    "action=unsubscribe&topic={topic}",
+    "action=confirm_subscription",
+    "action=set_push_choice&topic={topic}&choice=1",
+    "action=set_push_time",
+    "action=confirm_push",
+]
+
+
+# ---- mock servers ----
+
+class _MockLineHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # header 與 body 分兩次寫出，keep-alive 連線上遇到 Nagle + delayed ACK 會多等約 40ms
+    disable_nagle_algorithm = True
+    calls = Counter()
+    recipients = Counter()   # user_id -> 收到幾次 push / multicast
+    connections = 0          # 建立過的 TCP 連線數（keep-alive 時一條連線處理多個請求）
+    lock = threading.Lock()
+    delay = 0.0
+
+    def setup(self):
+        super().setup()
+        with self.lock:
+            _MockLineHandler.connections += 1
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length)
+        path = self.path.split("?")[0]
+        to = []
+        if path.endswith(("/push", "/multicast")):
+            to = json.loads(raw or b"{}").get("to") or []
+            if isinstance(to, str):
+                to = [to]
+        with self.lock:
+            self.calls[path] += 1
+            self.recipients.update(to)
+        if self.delay:
+            time.sleep(self.delay)
+        if path.endswith("/multicast"):
+            body = b"{}"
+        else:
+            body = json.dumps({"sentMessages": [{"id": "1", "quoteToken": "q"}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _MockRssHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    calls = Counter()
+    lock = threading.Lock()
+    items = 50
+    delay = 0.0
+
+    def do_GET(self):
+        with self.lock:
+            self.calls["rss"] += 1
+        if self.delay:
+            time.sleep(self.delay)
+        seed = abs(hash(self.path)) % 10000
+        items = "".join(
+            f"<item><title>測試新聞 {seed}-{i}</title>"
+            f"<link>https://news.example.com/{seed}/{i}</link></item>"
+            for i in range(self.items)
+        )
+        body = f'<?xml version="1.0" encoding="UTF-8"?><rss><channel>{items}</channel></rss>'.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/rss+xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ---- webhook payloads ----
+
+def sign(body):
+    digest = hmac.new(CHANNEL_SECRET.encode(), body.encode(), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+def _base_event(kind, user_id):
+    return {
+        "type": kind,
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": user_id},
+        "webhookEventId": f"LT{random.getrandbits(64):016x}",
+        "deliveryContext": {"isRedelivery": False},
+        "replyToken": f"{random.getrandbits(64):016x}",
+    }
+
+def make_payload(user_id, topics):
+    """隨機產生一個文字或 postback 事件，回傳 (種類, body)"""
+    if random.random() < 0.4:
+        text = random.choice(TEXT_EVENTS)
+        event = _base_event("message", user_id)
+        event["message"] = {"id": "1", "type": "text", "quoteToken": "q", "text": text}
+        kind = f"text:{text}"
+    else:
+        data = random.choice(POSTBACK_EVENTS).format(topic=random.choice(topics))
+        event = _base_event("postback", user_id)
+        event["postback"] = {"data": data}
+        if data == "action=set_push_time":
+            event["postback"]["params"] = {"time": f"{random.randrange(24):02d}:{random.randrange(60):02d}"}
+        kind = "postback:" + data.split("&")[0]
+    body = json.dumps({"destination": "Uloadtest", "events": [event]}, ensure_ascii=False)
+    return kind, body
+
+
+# ---- helpers ----
+
+def percentiles(samples):
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    s = sorted(samples)
+    pick = lambda q: s[min(len(s) - 1, int(q * len(s)))]
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": s[-1]}
+
+def _count_db_calls(db, counter, lock):
+    # 包住 db 的每個操作，統計查詢次數
+    for name in db.backend.__all__:
+        fn = getattr(db, name)
+        if not callable(fn) or name in ("get_conn",):
+            continue
+        def wrapped(*args, __fn=fn, __name=name, **kwargs):
+            with lock:
+                counter[__name] += 1
+            return __fn(*args, **kwargs)
+        setattr(db, name, wrapped)
+
+
+def run_webhooks(app, args, topics):
+    import logging
+    import requests
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/callback"
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+
+    latencies, by_kind, statuses = [], {}, Counter()
+    lock = threading.Lock()
+
+    def fire(kind, body):
+        start = time.perf_counter()
+        try:
+            r = session.post(url, data=body.encode("utf-8"), timeout=30, headers={
+                "Content-Type": "application/json", "X-Line-Signature": sign(body)})
+            status = r.status_code
+        except Exception:
+            status = "error"
+        took = time.perf_counter() - start
+        with lock:
+            latencies.append(took)
+            by_kind.setdefault(kind, []).append(took)
+            statuses[status] += 1
+
+    total = int(args.rate * args.duration)
+    interval = 1.0 / args.rate
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as exe:
+        for i in range(total):
+            # 開放式負載：依時間表送出，不等前一個請求完成
+            target = start + i * interval
+            now = time.perf_counter()
+            if target > now:
+                time.sleep(target - now)
+            user_id = f"Uload{random.randrange(args.users):06d}"
+            exe.submit(fire, *make_payload(user_id, topics))
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    errors = sum(n for status, n in statuses.items() if status != 200)
+    return {
+        "requests": total,
+        "elapsed": elapsed,
+        "throughput": total / elapsed if elapsed else 0.0,
+        "latency": percentiles(latencies),
+        "latency_by_event": {k: percentiles(v) for k, v in sorted(by_kind.items())},
+        "status": {str(k): v for k, v in statuses.items()},
+        "error_rate": errors / total if total else 0.0,
+    }
+
+def _take(counter, lock):
+    with lock:
+        snapshot = dict(counter)
+        counter.clear()
+    return {"calls": snapshot, "total": sum(snapshot.values())}
+
+def _legacy_route(data):
+    # 改用 postback 路由前 app.handle_postback + 各模組的判斷方式，只留下分類與解析，供比較
+    if (
+        data.startswith("action=set_push_choice")
+        or data.startswith("action=set_push_time")
+        or data in ("action=confirm_push", "action=cancel_push")
+    ):
+        if data.startswith("action=set_push_choice"):
+            parts = dict(p.split("=",1) for p in data.split("&")[1:])
+            return "set_push_choice", parts
+        if data == "action=set_push_time":
+            return "set_push_time", {}
+        if data == "action=confirm_push":
+            return "confirm_push", {}
+        return None
+    if (
+        data.startswith("action=subscribe&topic=")
+        or data.startswith("action=unsubscribe&topic=")
+        or data in (
+            "action=start_add_subscription",
+            "action=start_remove_subscription",
+            "action=confirm_subscription",
+            "action=recommend_keywords",
+            "action=manage_subscription",
+        )
+    ):
+        for name in ("recommend_keywords", "manage_subscription", "start_add_subscription"):
+            if data == "action=" + name:
+                return name, {}
+        if data.startswith("action=subscribe&topic="):
+            return "subscribe", {"topic": data.split("action=subscribe&topic=")[1]}
+        if data == "action=start_remove_subscription":
+            return "start_remove_subscription", {}
+        if data.startswith("action=unsubscribe&topic="):
+            return "unsubscribe", {"topic": data.split("action=unsubscribe&topic=")[1]}
+        if data == "action=confirm_subscription":
+            return "confirm_subscription", {}
+    return None
+
+def run_postback_bench(n, topics):
+    """每個事件的路由成本（不含處理器本身）：舊的 startswith 鏈 vs. postback.parse + 查表"""
+    import postback
+    import subscribetest, pushs   # 登記路由
+    samples = [random.choice(POSTBACK_EVENTS).format(topic=random.choice(topics)) for _ in range(1000)]
+    samples += ["action=" + "x" * 400, "topic=地震", "action=subscribe&topic"]
+
+    result = {"events": n}
+    for label, fn in (("legacy_chain", _legacy_route), ("dispatch_table", postback.resolve)):
+        start = time.perf_counter()
+        for i in range(n):
+            fn(samples[i % len(samples)])
+        result[label + "_ns_per_event"] = (time.perf_counter() - start) / n * 1e9
+    return result
+
+def run_dedup_bench(users, per_user=30, probes=20000):
+    """每位使用者已送過紀錄的記憶體、寫入 / 查詢成本與實測誤判率"""
+    import seen
+    filters = {}
+    start = time.perf_counter()
+    for i in range(users):
+        f = seen.new_filter()
+        for j in range(per_user):
+            f.add(f"https://news.example.com/{i}/{j}")
+        filters[i] = f
+    add_seconds = time.perf_counter() - start
+
+    # 查詢從沒送過的網址，命中即為誤判
+    sample = random.sample(range(users), min(users, 1000))
+    false_hits = 0
+    start = time.perf_counter()
+    for p in range(probes):
+        if f"https://other.example.com/{p}" in filters[sample[p % len(sample)]]:
+            false_hits += 1
+    check_seconds = time.perf_counter() - start
+
+    f = filters[0]
+    start = time.perf_counter()
+    blobs = [(i, f.to_bytes(), f.count) for i, f in filters.items()]
+    serialize_seconds = time.perf_counter() - start
+    bytes_per_user = len(blobs[0][1])
+    return {
+        "users": users,
+        "articles_per_user": per_user,
+        "bits_per_generation": f.bits,
+        "hashes": f.k,
+        "capacity_per_generation": f.capacity,
+        "bytes_per_user": bytes_per_user,
+        "total_mb": bytes_per_user * users / 1e6,
+        "add_us": add_seconds / (users * per_user) * 1e6,
+        "check_us": check_seconds / probes * 1e6,
+        "serialize_seconds": serialize_seconds,
+        "false_positive_rate": false_hits / probes,
+        "target_false_positive_rate": seen.DELIVERY_BLOOM_FP,
+    }
+
+def _google_link(url):
+    # 模擬 Google News 舊格式的轉址：/rss/articles/<base64(protobuf 內含原始網址)>
+    raw = b"\x08\x13\x22" + bytes([len(url)]) + url.encode() + b"\xd2\x01\x00"
+    token = base64.urlsafe_b64encode(raw).decode().rstrip("=")
+    return f"https://news.google.com/rss/articles/{token}?oc=5"
+
+def make_feeds(stories, topics, seed=7):
+    """
+    產生類似 Google News 的多主題 feed：同一則新聞出現在 1~3 個主題，
+    網址可能是轉址、原始網址或其他媒體轉載的網址（只能靠標題判斷），
+    標題的媒體名稱與標點不同。回傳 (news_by_topic, 正確的群組)
+    """
+    rng = random.Random(seed)
+    words = "颱風豪雨土石流地震海嘯火災洪水暴風雪停班停課撤離警報災情搶修淹水坍方道路中斷氣象署發布"
+    sources = ["中央社", "自由時報", "聯合新聞網", "TVBS", "公視新聞"]
+    news_by_topic, truth = {t: [] for t in topics}, {}
+    for s in range(stories):
+        base = "".join(rng.choice(words) for _ in range(rng.randint(14, 28))) + f"第{s}報"
+        url = f"https://www.news{s % 50}.example.com/article/{s}"
+        for topic in rng.sample(topics, rng.randint(1, 3)):
+            title = base if rng.random() < 0.5 else base.replace("報", "報！", 1)
+            if rng.random() < 0.3:
+                title = rng.choice(["快訊", "〔更新〕", "最新"]) + title   # 近似重複，靠 MinHash
+            r = rng.random()
+            if r < 0.3:
+                link = f"https://{rng.choice(sources).lower()}.example.org/{s}-{topic}"
+            elif r < 0.65:
+                link = _google_link(url)
+            else:
+                link = url + "?utm_source=rss"
+            n = {"title": f"{title} - {rng.choice(sources)}", "url": link}
+            news_by_topic[topic].append(n)
+            truth[id(n)] = s
+    return news_by_topic, truth
+
+def run_merge_bench(stories, topics):
+    """跨主題合併：分群耗時（看是否線性成長）與相對於正確答案的合併結果"""
+    import merge
+    result = {"runs": []}
+    for scale in (1, 2, 4):
+        news_by_topic, truth = make_feeds(stories * scale, topics)
+        items = [n for ns in news_by_topic.values() for n in ns]
+        start = time.perf_counter()
+        keys = merge.cluster_keys(items)
+        elapsed = time.perf_counter() - start
+        # 以「同一則新聞被分到同一群」與「不同新聞不會被合併」評估
+        by_story, by_key = {}, {}
+        for n, key in zip(items, keys):
+            by_story.setdefault(truth[id(n)], set()).add(key)
+            by_key.setdefault(key, set()).add(truth[id(n)])
+        result["runs"].append({
+            "stories": stories * scale,
+            "items": len(items),
+            "seconds": elapsed,
+            "us_per_item": elapsed / len(items) * 1e6,
+            "clusters": len(by_key),
+            "stories_split": sum(1 for ks in by_story.values() if len(ks) > 1),
+            "wrong_merges": sum(1 for ss in by_key.values() if len(ss) > 1),
+        })
+    return result
+
+def run_trending_bench(rows, per_user=5, groups=200, group_size=10, calls=20000, seed=11):
+    """
+    推薦關鍵字：寫入 rows 筆合成訂閱（使用者多半訂同一興趣群組的主題，群組熱門度為 Zipf），
+    量測從 DB 重新統計、組快照、每次推薦與每次增量更新的成本，
+    並檢查相關主題是否落在同一群組（共同訂閱訊號是否有效）。
+    """
+    import db
+    import trending
+    rng = random.Random(seed)
+    topic_group = {f"主題{g}-{k}": g for g in range(groups) for k in range(group_size)}
+    weights = [1 / (g + 1) for g in range(groups)]
+    users = rows // per_user
+    data = []
+    for u in range(users):
+        g = rng.choices(range(groups), weights)[0]
+        picked = set()
+        while len(picked) < per_user:
+            # 八成訂同一群組，其餘隨機
+            h = g if rng.random() < 0.8 else rng.randrange(groups)
+            picked.add(f"主題{h}-{rng.randrange(group_size)}")
+        data.extend((f"bench-{u}", t) for t in picked)
+    mark = "?" if db.url.scheme.startswith("sqlite") else "%s"
+    start = time.perf_counter()
+    with db.get_conn() as conn:
+        cur = conn.cursor()
+        cur.executemany(f"INSERT INTO subscriptions(user_id, topic) VALUES({mark}, {mark})", data)
+        conn.commit()
+    insert_seconds = time.perf_counter() - start
+
+    index = trending.TrendingIndex()
+    try:
+        start = time.perf_counter()
+        index.recount()
+        recount_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        snap = index.build()
+        build_seconds = time.perf_counter() - start
+
+        sample = [[t for uid, t in data[i * per_user:(i + 1) * per_user]]
+                  for i in rng.sample(range(users), min(users, 1000))]
+        start = time.perf_counter()
+        for i in range(calls):
+            index.recommend(sample[i % len(sample)], 5)
+        recommend_us = (time.perf_counter() - start) / calls * 1e6
+
+        # 增量更新：訂閱一個新主題再取消（每次 2 個事件）
+        start = time.perf_counter()
+        for i in range(calls // 2):
+            subs = sample[i % len(sample)]
+            extra = subs + ["主題0-0" if "主題0-0" not in subs else "主題1-0"]
+            index.on_subscriptions_changed("bench", subs, extra)
+            index.on_subscriptions_changed("bench", extra, subs)
+        update_us = (time.perf_counter() - start) / (calls // 2 * 2) * 1e6
+
+        same = total = 0
+        for topic, related in snap["related"].items():
+            for other, _score in related[:5]:
+                total += 1
+                same += topic_group[other] == topic_group[topic]
+        stats = index.stats()
+    finally:
+        with db.get_conn() as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM subscriptions WHERE user_id LIKE 'bench-%'")
+            conn.commit()
+    return {
+        "rows": len(data),
+        "users": users,
+        "topics": stats["topics"],
+        "nonzero_pairs": stats["pairs"],
+        "insert_seconds": insert_seconds,
+        "recount_seconds": recount_seconds,
+        "build_seconds": build_seconds,
+        "recommend_us": recommend_us,
+        "incremental_update_us": update_us,
+        "related_same_group_ratio": same / total if total else 0.0,
+        "example": {t: [o for o, _s in snap["related"].get(t, [])[:5]] for t in ("主題0-0", "主題50-3")},
+        "recommend_example": index.recommend(["主題0-0", "主題0-1"], 5),
+    }
+
+def _naive_match(keys, text):
+    # 對照組：每個關鍵字各做一次子字串搜尋（邊界規則同 matcher.Automaton）
+    alnum = "0123456789abcdefghijklmnopqrstuvwxyz"
+    found = set()
+    for key in keys:
+        i = text.find(key)
+        while i >= 0:
+            end = i + len(key)
+            if not (key[0] in alnum and i > 0 and text[i - 1] in alnum) and \
+               not (key[-1] in alnum and end < len(text) and text[end] in alnum):
+                found.add(key)
+                break
+            i = text.find(key, i + 1)
+    return found
+
+def run_match_bench(keywords, headlines=20000, naive_sample=200, seed=13):
+    """
+    關鍵字比對：keywords 個訂閱關鍵字建自動機的時間、每則標題的比對成本（對照逐一子字串搜尋），
+    結果是否與逐一搜尋一致，以及訂閱變更時增量更新（delta）的成本
+    """
+    import matcher
+    rng = random.Random(seed)
+    chars = "颱風豪雨地震海嘯火災洪水停班課撤離警報災情搶修淹水坍方道路中斷氣象署發布台積電輝達晶片股市選舉立法院總統疫苗醫院學校"
+    latin = ["ai", "nvidia", "tsmc", "apple", "iphone", "covid", "gpu", "ev", "tesla", "openai"]
+    keys = set()
+    while len(keys) < keywords:
+        if rng.random() < 0.1:
+            keys.add(rng.choice(latin) + str(rng.randrange(1000)))
+        else:
+            keys.add("".join(rng.choice(chars) for _ in range(rng.randint(2, 5))))
+    keys = list(keys)
+    titles = []
+    for _ in range(headlines):
+        words = ["".join(rng.choice(chars) for _ in range(rng.randint(2, 6))) for _ in range(4)]
+        words.insert(rng.randrange(5), rng.choice(keys) if rng.random() < 0.5 else rng.choice(latin).upper())
+        titles.append(" ".join(words) + " - 中央社")
+
+    m = matcher.KeywordMatcher(delta_limit=matcher.KEYWORD_MATCH_DELTA)
+    start = time.perf_counter()
+    m.load({k: 1 for k in keys})
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    total = 0
+    for title in titles:
+        total += len(m.match(title))
+    match_seconds = time.perf_counter() - start
+
+    sample = titles[:naive_sample]
+    start = time.perf_counter()
+    naive = [_naive_match(keys, t.casefold()) for t in sample]
+    naive_seconds = time.perf_counter() - start
+    mismatches = sum(1 for t, expect in zip(sample, naive) if set(m.match(t)) != expect)
+
+    # 增量：逐一新增關鍵字（每次重建 delta），量測平均成本
+    extra = [f"新關鍵字{i}" for i in range(min(matcher.KEYWORD_MATCH_DELTA, 1000))]
+    start = time.perf_counter()
+    for k in extra:
+        m.add([k])
+    add_ms = (time.perf_counter() - start) / len(extra) * 1e3
+    added_visible = all(k in m.match(f"快訊 {k} 最新") for k in extra[-5:])
+    start = time.perf_counter()
+    m.rebuild()
+    fold_seconds = time.perf_counter() - start
+    stats = m.stats()
+    return {
+        "keywords": len(keys),
+        "headlines": len(titles),
+        "build_seconds": build_seconds,
+        "automaton_nodes": stats["main_nodes"],
+        "headlines_per_second": len(titles) / match_seconds,
+        "us_per_headline": match_seconds / len(titles) * 1e6,
+        "naive_us_per_headline": naive_seconds / len(sample) * 1e6,
+        "speedup": (naive_seconds / len(sample)) / (match_seconds / len(titles)),
+        "matches_per_headline": total / len(titles),
+        "mismatches_vs_naive": mismatches,
+        "incremental_add_ms": add_ms,
+        "incremental_visible": added_visible,
+        "fold_seconds": fold_seconds,
+    }
+
+def run_db_bench(users, topics, threads=8):
+    """
+    儲存後端吞吐量：threads 個執行緒同時對 users 位使用者做寫入 / 讀取，
+    回傳每種操作每秒幾次（跑在 DATABASE_URL 指定的後端上）
+    """
+    import db
+    rng = random.Random(17)
+    uids = [f"Udbbench{i:06d}" for i in range(users)]
+    chosen = {uid: rng.sample(topics, k=rng.randint(1, 3)) for uid in uids}
+    times = {uid: f"{rng.randrange(24):02d}:{rng.randrange(60):02d}" for uid in uids}
+
+    def timed(fn):
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as exe:
+            list(exe.map(fn, uids))
+        elapsed = time.perf_counter() - start
+        return {"seconds": elapsed, "ops_per_second": users / elapsed}
+
+    def setup(uid):
+        db.add_subscriptions(uid, chosen[uid])
+        db.set_push_choices(uid, {t: True for t in chosen[uid]})
+        db.set_push_time(uid, times[uid])
+
+    result = {"backend": db.url.scheme, "users": users, "threads": threads}
+    result["write_settings"] = timed(setup)
+    result["list_subscriptions"] = timed(db.list_subscriptions)
+    result["list_push_topics"] = timed(db.list_push_topics)
+    result["get_push_time"] = timed(db.get_push_time)
+    result["remove_subscriptions"] = timed(lambda uid: db.remove_subscriptions(uid, chosen[uid][:1]))
+
+    minutes = sorted(set(times.values()))
+    start = time.perf_counter()
+    due = sum(len(db.list_due_pushes(m)) for m in minutes)
+    elapsed = time.perf_counter() - start
+    result["list_due_pushes"] = {"minutes": len(minutes), "users": due,
+                                 "ms_per_minute": elapsed / len(minutes) * 1e3}
+    start = time.perf_counter()
+    enabled = db.list_enabled_push_topics(uids)
+    result["list_enabled_push_topics"] = {"users": len(enabled),
+                                          "seconds": time.perf_counter() - start}
+    result["pool"] = db.pool_stats()
+
+    # 清掉壓測資料，不影響後面的 webhook / 推播測試
+    with db.get_conn() as conn:
+        cur = conn.cursor()
+        for table in ("subscriptions", "push_topics", "push_schedule"):
+            cur.execute(f"DELETE FROM {table} WHERE user_id LIKE 'Udbbench%'")
+        conn.commit()
+    return result
+
+def run_fetch_bench(users, topics, legacy_sample=100, seed=19):
+    """
+    排程推播抓新聞：users 位使用者 × topics 個主題（每人訂 1~3 個），每一輪 tick 的牆鐘時間與 RSS 請求數。
+    pushs.fetch_topics 每個主題只抓一次並行抓取；對照舊作法（逐一使用者、逐一主題循序抓），
+    舊作法太慢，只跑 legacy_sample 位使用者再依比例推算。
+    """
+    import rss
+    import pushs
+    rng = random.Random(seed)
+    names = [f"主題{i}" for i in range(topics)]
+    subs = [rng.sample(names, k=min(topics, rng.randint(1, 3))) for _ in range(users)]
+    unique = sorted({t for ts in subs for t in ts})
+
+    def rss_calls():
+        with _MockRssHandler.lock:
+            return _MockRssHandler.calls["rss"]
+
+    ticks = []
+    for _ in range(3):
+        rss.news_cache.clear()   # 每一輪都是冷快取
+        before = rss_calls()
+        start = time.perf_counter()
+        news = pushs.fetch_topics(unique, count=pushs.PUSH_FETCH_COUNT)
+        ticks.append({"seconds": time.perf_counter() - start, "rss_requests": rss_calls() - before,
+                      "topics_with_news": sum(1 for v in news.values() if v)})
+
+    sample = subs[:legacy_sample]
+    before = rss_calls()
+    start = time.perf_counter()
+    for ts in sample:
+        for t in ts:
+            rss._download_news(t, pushs.PUSH_FETCH_COUNT)
+    legacy_seconds = time.perf_counter() - start
+    legacy_requests = sum(len(ts) for ts in subs)
+    return {
+        "users": users,
+        "topics": topics,
+        "subscribed_topics": len(unique),
+        "fetch_workers": pushs.PUSH_FETCH_WORKERS,
+        "rss_delay": _MockRssHandler.delay,
+        "ticks": ticks,
+        "tick_seconds_avg": sum(t["seconds"] for t in ticks) / len(ticks),
+        "legacy_rss_requests": legacy_requests,
+        "legacy_sample_users": len(sample),
+        "legacy_sample_requests": rss_calls() - before,
+        "legacy_estimated_seconds": legacy_seconds / len(sample) * users if sample else 0.0,
+    }
+
+def make_feed(items, seed=23):
+    """產生類似 Google News 的大型 RSS（每則含 description），回傳 bytes"""
+    rng = random.Random(seed)
+    words = "颱風豪雨土石流地震海嘯火災洪水停班停課撤離警報災情搶修淹水坍方"
+    parts = ['<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel><title>bench</title>']
+    for i in range(items):
+        title = "".join(rng.choice(words) for _ in range(rng.randint(14, 28)))
+        desc = "".join(rng.choice(words) for _ in range(rng.randint(200, 400)))
+        parts.append(f"<item><title>{title} - 中央社</title>"
+                     f"<link>https://news.example.com/{i}</link>"
+                     f"<pubDate>Mon, 03 Jun 2024 08:{i % 60:02d}:00 GMT</pubDate>"
+                     f"<description>{desc}</description></item>")
+    parts.append("</channel></rss>")
+    return "".join(parts).encode("utf-8")
+
+def run_rss_parse_bench(items, counts=(3, 10), repeat=5):
+    """
+    RSS 解析：rss.parse_items 串流解析（讀到 count 則就停、有 byte 上限、用完的元素就釋放）
+    對照舊作法（整份下載成 bytes，ET.fromstring 建完整樹再取前 count 則）。
+    tracemalloc 量尖峰記憶體，包含舊作法的整份回應；兩邊都從同一份 chunk 串流開始。
+    """
+    import tracemalloc
+    import xml.etree.ElementTree as ET
+    import rss
+    feed = make_feed(items)
+
+    def chunks():
+        for i in range(0, len(feed), rss.RSS_CHUNK_SIZE):
+            yield feed[i:i + rss.RSS_CHUNK_SIZE]
+
+    def legacy(count):
+        root = ET.fromstring(b"".join(chunks()))
+        return [{"title": (item.findtext("title") or "").strip(),
+                 "url": (item.findtext("link") or "").strip(),
+                 "published": rss.parse_pubdate(item.findtext("pubDate"))}
+                for item in root.findall(".//item")[:count]]
+
+    def streaming(count):
+        return rss.parse_items(chunks(), count, rss.RSS_MAX_BYTES)
+
+    def measure(fn, count):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn(count)
+            samples.append(time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            parsed = fn(count)
+            _current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return dict(percentiles(samples), parsed=len(parsed), peak_kb=peak / 1024)
+
+    result = {"items": items, "feed_bytes": len(feed), "max_bytes": rss.RSS_MAX_BYTES, "runs": []}
+    for count in tuple(counts) + (items,):
+        result["runs"].append({"count": count,
+                               "legacy": measure(legacy, count),
+                               "streaming": measure(streaming, count)})
+    return result
+
+def run_flex_bench(users, topics=50, per_topic=3, seed=29):
+    """
+    每位使用者的輪播建構時間：flex.build_carousel_messages（bubble 驗證一次後快取）
+    對照舊作法（每次從頭組整個輪播 dict 再 FlexContainer.from_dict 重新驗證）。
+    每人訂 1~4 個主題，每個主題 per_topic 則新聞，同一主題的新聞所有人共用。
+    """
+    import flex
+    from linebot.v3.messaging import FlexMessage, FlexContainer
+    rng = random.Random(seed)
+    news = {f"主題{t}": [{"title": f"主題{t} 的第 {i} 則新聞標題", "url": f"https://news.example.com/{t}/{i}"}
+                         for i in range(per_topic)] for t in range(topics)}
+    names = list(news)
+    subs = [rng.sample(names, k=rng.randint(1, 4)) for _ in range(users)]
+
+    def legacy(ts):
+        bubbles = [flex.bubble_dict(t, n) for t in ts for n in news[t]][:flex.MAX_BUBBLES_PER_CAROUSEL]
+        return [FlexMessage(alt_text="新聞", contents=FlexContainer.from_dict(
+            {"type": "carousel", "contents": bubbles}))]
+
+    def cached(ts):
+        return flex.build_carousel_messages([(t, n) for t in ts for n in news[t]], "新聞")
+
+    result = {"users": users, "topics": topics, "per_topic": per_topic}
+    for label, fn in (("legacy_from_dict", legacy), ("cached_bubbles", cached)):
+        before = flex.flex_stats()
+        samples = []
+        start = time.perf_counter()
+        for ts in subs:
+            t0 = time.perf_counter()
+            fn(ts)
+            samples.append(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - start
+        after = flex.flex_stats()
+        result[label] = dict(percentiles(samples), seconds=elapsed, us_per_user=elapsed / users * 1e6,
+                             cache_hits=after["hits"] - before["hits"],
+                             cache_misses=after["misses"] - before["misses"])
+    return result
+
+def run_client_bench(calls, threads=8):
+    """
+    LINE API client：每次呼叫都新建 ApiClient（舊作法，每個事件一條新連線）
+    對照 line_client 共用的 client（keep-alive 連線池），回傳延遲分布與建立的連線數
+    """
+    import line_client
+    from linebot.v3.messaging import (
+        Configuration, ApiClient, MessagingApi, ReplyMessageRequest, TextMessage,
+    )
+    request = ReplyMessageRequest(reply_token="bench", messages=[TextMessage(text="hi")])
+
+    def fresh(_):
+        config = Configuration(access_token=os.getenv("CHANNEL_ACCESS_TOKEN"),
+                               host=os.environ["LINE_API_HOST"])
+        start = time.perf_counter()
+        with ApiClient(config) as client:
+            MessagingApi(client).reply_message(request)
+        return time.perf_counter() - start
+
+    def pooled(_):
+        start = time.perf_counter()
+        line_client.get_messaging_api().reply_message(request)
+        return time.perf_counter() - start
+
+    pooled(0)   # 先建立共用 client，不計入
+    result = {"calls": calls, "threads": threads}
+    for label, fn in (("fresh_client", fresh), ("shared_client", pooled)):
+        for mode, workers in (("sequential", 1), ("concurrent", threads)):
+            with _MockLineHandler.lock:
+                before = _MockLineHandler.connections
+            start = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as exe:
+                samples = list(exe.map(fn, range(calls)))
+            elapsed = time.perf_counter() - start
+            with _MockLineHandler.lock:
+                connections = _MockLineHandler.connections - before
+            result[f"{label}_{mode}"] = dict(percentiles(samples), calls_per_second=calls / elapsed,
+                                             connections=connections)
+    return result
+
+def run_push(args, topics, db_calls, db_lock):
+    import db
+    import pushs
+    push_time = "03:33"
+    for i in range(args.push_users):
+        uid = f"Upush{i:06d}"
+        chosen = random.sample(topics, k=min(len(topics), random.randint(1, 3)))
+        db.add_subscriptions(uid, chosen)
+        db.set_push_choices(uid, {t: True for t in chosen})
+        db.set_push_time(uid, push_time)
+    pushs.push_wheel.load(db.list_push_schedule())
+    user_ids = pushs.push_wheel.due(3 * 60 + 33)
+    _take(db_calls, db_lock)   # 不計入準備資料的寫入
+    start = time.perf_counter()
+    pushs.send_scheduled_news(push_time, user_ids)
+    return {
+        "due_users": len(user_ids),
+        "tick_seconds": time.perf_counter() - start,
+        "delivery": dict(pushs.last_delivery_report),
+        "db_queries": _take(db_calls, db_lock),
+    }
+
+
+def run_scheduler_workers(args, topics):
+    """
+    起 N 個行程同時跑同一分鐘的排程（模擬 gunicorn 多 worker），
+    以 mock LINE 收到的收件人檢查每位使用者剛好收到一次推播。
+    SQLite 沒有 advisory lock，每個行程都是單機模式、只靠 claim_push_slots 去重；
+    要測分片分配需將 DATABASE_URL 指向 Postgres（分片邏輯另見 tests/test_cluster.py）。
+    """
+    import db
+    db.init_db()
+    slot = datetime.now().replace(second=0, microsecond=0)
+    push_time = slot.strftime("%H:%M")
+    users = [f"Ushard{i:06d}" for i in range(args.push_users or 1000)]
+    for uid in users:
+        chosen = random.sample(topics, k=random.randint(1, 3))
+        db.add_subscriptions(uid, chosen)
+        db.set_push_choices(uid, {t: True for t in chosen})
+        db.set_push_time(uid, push_time)
+
+    # 給每個行程時間 import 並加入分片協調，再一起開始
+    start_at = time.time() + 3 + 0.2 * args.scheduler_workers
+    procs = [subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                               "--scheduler-worker", slot.isoformat(),
+                               "--start-at", str(start_at)],
+                              stdout=subprocess.PIPE)
+             for _ in range(args.scheduler_workers)]
+    workers = []
+    for p in procs:
+        out, _ = p.communicate(timeout=300)
+        workers.append(json.loads(out) if p.returncode == 0 else {"returncode": p.returncode})
+
+    received = _MockLineHandler.recipients
+    duplicates = [uid for uid in users if received[uid] > 1]
+    missing = [uid for uid in users if received[uid] == 0]
+    return {
+        "workers": workers,
+        "advisory_locks": db.SUPPORTS_ADVISORY_LOCKS,
+        "users": len(users),
+        "received_once": sum(1 for uid in users if received[uid] == 1),
+        "duplicates": len(duplicates),
+        "missing": len(missing),
+        "ok": not duplicates and not missing,
+    }
+
+def _scheduler_worker(args):
+    # 子行程：載入時間輪、加入分片協調，時間到時跑一次 _run_slot
+    import db
+    import pushs
+    pushs.push_wheel.load(db.list_push_schedule())
+    pushs.coordinator.acquire()
+    time.sleep(max(0.0, args.start_at - 1 - time.time()))
+    pushs.coordinator.rebalance()   # 等所有 worker 都加入後釋放超額分片
+    time.sleep(max(0.0, args.start_at - time.time()))
+    pushs._run_slot(datetime.fromisoformat(args.scheduler_worker))
+    print(json.dumps({
+        "pid": os.getpid(),
+        "due_users": pushs.scheduler_stats["due_users_last"],
+        "cluster": pushs.coordinator.stats(),
+        "delivery": pushs.last_delivery_report,
+    }))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LINE Bot webhook 壓測")
+    parser.add_argument("--rate", type=float, default=20, help="每秒送出的 webhook 數")
+    parser.add_argument("--duration", type=float, default=10, help="持續秒數")
+    parser.add_argument("--concurrency", type=int, default=32, help="同時進行的請求上限")
+    parser.add_argument("--users", type=int, default=100, help="模擬的使用者數")
+    parser.add_argument("--push-users", type=int, default=0, help="額外測一次排程推播的使用者數")
+    parser.add_argument("--line-delay", type=float, default=0.0, help="mock LINE API 每次回應延遲（秒）")
+    parser.add_argument("--rss-delay", type=float, default=0.0, help="mock RSS 每次回應延遲（秒）")
+    parser.add_argument("--postback-bench", type=int, default=0, help="比較 postback 路由成本的事件數")
+    parser.add_argument("--dedup-bench", type=int, default=0, help="已送過紀錄的 benchmark 使用者數")
+    parser.add_argument("--merge-bench", type=int, default=0, help="跨主題合併 benchmark 的新聞數")
+    parser.add_argument("--trending-bench", type=int, default=0, help="推薦關鍵字 benchmark 的訂閱筆數")
+    parser.add_argument("--match-bench", type=int, default=0, help="關鍵字比對 benchmark 的關鍵字數")
+    parser.add_argument("--db-bench", type=int, default=0, help="儲存後端吞吐量 benchmark 的使用者數")
+    parser.add_argument("--fetch-bench", type=int, default=0, help="排程抓新聞 benchmark 的使用者數")
+    parser.add_argument("--client-bench", type=int, default=0, help="LINE API client 比較的呼叫次數")
+    parser.add_argument("--rss-parse-bench", type=int, default=0, help="RSS 解析 benchmark 的 feed 新聞則數")
+    parser.add_argument("--flex-bench", type=int, default=0, help="輪播建構 benchmark 的使用者數")
+    parser.add_argument("--fetch-topics", type=int, default=50, help="排程抓新聞 benchmark 的主題數")
+    parser.add_argument("--scheduler-workers", type=int, default=0,
+                        help="以多個行程同時跑排程，檢查每位使用者只收到一次推播")
+    parser.add_argument("--scheduler-worker", help=argparse.SUPPRESS)
+    parser.add_argument("--start-at", type=float, help=argparse.SUPPRESS)
+    parser.add_argument("--out", help="報告輸出路徑（預設印到 stdout）")
+    args = parser.parse_args(argv)
+    if args.scheduler_worker:
+        return _scheduler_worker(args)
+
+    _MockLineHandler.delay = args.line_delay
+    _MockRssHandler.delay = args.rss_delay
+    line_server = _serve(_MockLineHandler)
+    rss_server = _serve(_MockRssHandler)
+
+    # 必須在 import app 之前設定好環境變數；多行程測試需要共用的資料庫檔案
+    if args.scheduler_workers:
+        os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "loadtest.db"))
+    os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+    os.environ["CHANNEL_SECRET"] = CHANNEL_SECRET
+    os.environ["CHANNEL_ACCESS_TOKEN"] = "loadtest-token"
+    os.environ["LINE_API_HOST"] = f"http://127.0.0.1:{line_server.server_port}"
+    os.environ["RSS_BASE_URL"] = f"http://127.0.0.1:{rss_server.server_port}/rss/"
+
+    if args.scheduler_workers:
+        from subscribetest import ALL_TOPICS
+        report = {"config": vars(args), "scheduler": run_scheduler_workers(args, ALL_TOPICS)}
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return 0 if report["scheduler"]["ok"] else 1
+
+    import db
+    db_calls, db_lock = Counter(), threading.Lock()
+    _count_db_calls(db, db_calls, db_lock)
+
+    import app as line_app
+    from subscribetest import ALL_TOPICS
+
+    report = {"config": vars(args), "database": db.url.scheme}
+    _take(db_calls, db_lock)   # 不計入 init_db 與啟動時的查詢
+    if args.dedup_bench:
+        report["delivery_dedup"] = run_dedup_bench(args.dedup_bench)
+    if args.merge_bench:
+        report["article_merge"] = run_merge_bench(args.merge_bench, ALL_TOPICS)
+    if args.client_bench:
+        report["line_client"] = run_client_bench(args.client_bench)
+    if args.flex_bench:
+        report["flex_build"] = run_flex_bench(args.flex_bench)
+    if args.rss_parse_bench:
+        report["rss_parse"] = run_rss_parse_bench(args.rss_parse_bench)
+    if args.fetch_bench:
+        report["push_fetch"] = run_fetch_bench(args.fetch_bench, args.fetch_topics)
+    if args.db_bench:
+        report["db_throughput"] = run_db_bench(args.db_bench, ALL_TOPICS)
+    if args.match_bench:
+        report["keyword_match"] = run_match_bench(args.match_bench)
+    if args.trending_bench:
+        report["trending"] = run_trending_bench(args.trending_bench)
+    if args.postback_bench:
+        report["postback_routing"] = run_postback_bench(args.postback_bench, ALL_TOPICS)
+    report["webhook"] = run_webhooks(line_app.app, args, ALL_TOPICS)
+    if line_app.WEBHOOK_ASYNC:
+        # 非同步模式下等佇列清空再統計
+        line_app.webhook_queue._queue.join()
+        report["webhook"]["queue"] = line_app.webhook_queue.stats()
+    report["webhook"]["db_queries"] = _take(db_calls, db_lock)
+    if args.push_users:
+        report["push"] = run_push(args, ALL_TOPICS, db_calls, db_lock)
+    report["line_api_calls"] = dict(_MockLineHandler.calls)
+    report["rss_calls"] = dict(_MockRssHandler.calls)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
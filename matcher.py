@@ -0,0 +1,331 @@
+# matcher.py
+# 關鍵字比對：所有使用者訂閱的關鍵字組成一個 Aho-Corasick 自動機，
+# 每則匯入的新聞標題只掃一次，就得到所有出現在標題裡的關鍵字；
+# 比對到的新聞直接寫到該關鍵字底下，自訂關鍵字不必各自查一次 Google News
+import os
+import time
+import threading
+from collections import deque
+
+import db
+import user_state
+
+# 設定（可由環境變數調整）
+KEYWORD_MATCH        = os.getenv("KEYWORD_MATCH", "0") == "1"                 # 匯入新聞比對訂閱關鍵字（預設關閉）
+KEYWORD_MATCH_DELTA  = int(os.getenv("KEYWORD_MATCH_DELTA", "1000"))      # 新增幾個關鍵字後併回主自動機
+KEYWORD_MATCH_RESYNC = float(os.getenv("KEYWORD_MATCH_RESYNC", "600"))    # 幾秒從 DB 重新讀一次訂閱
+KEYWORD_MIN_LENGTH   = int(os.getenv("KEYWORD_MIN_LENGTH", "2"))          # 太短的關鍵字（單字）不比對
+
+_ASCII_WORD = frozenset("0123456789abcdefghijklmnopqrstuvwxyz")
+
+
+def keyword_key(keyword):
+    """比對用的形式：不分大小寫、去掉前後空白"""
+    return keyword.strip().casefold()
+
+
+class Automaton:
+    """
+    不可變的 Aho-Corasick 自動機：建好之後只讀，可在多個執行緒同時 scan。
+    英數字開頭 / 結尾的關鍵字要求邊界不是英數字，避免「AI」比對到「MAIN」。
+    """
+    __slots__ = ("goto", "fail", "out", "bounded", "size")
+
+    def __init__(self, keys=()):
+        goto, out, bounded = [{}], [()], {}
+        for key in keys:
+            if key[0] in _ASCII_WORD or key[-1] in _ASCII_WORD:
+                bounded[key] = (key[0] in _ASCII_WORD, key[-1] in _ASCII_WORD)
+            node = 0
+            for ch in key:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = goto[node][ch] = len(goto)
+                    goto.append({})
+                    out.append(())
+                node = nxt
+            out[node] = (key,)
+        # BFS 算 failure link，並把 failure 鏈上的輸出合併進來，掃描時不必再走鏈
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in goto[node].items():
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                target = goto[f].get(ch, 0)
+                fail[nxt] = target if target != nxt else 0
+                if out[fail[nxt]]:
+                    out[nxt] = out[nxt] + out[fail[nxt]]
+                queue.append(nxt)
+        self.goto, self.fail, self.out, self.bounded = goto, fail, out, bounded
+        self.size = sum(1 for o in out if o)
+
+    def scan(self, text):
+        """回傳 text（已 casefold）裡出現的所有 key"""
+        goto, fail, out, bounded = self.goto, self.fail, self.out, self.bounded
+        found = set()
+        node = 0
+        last = len(text) - 1
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                for key in out[node]:
+                    if key in found:
+                        continue
+                    edges = bounded.get(key)
+                    if edges:
+                        start = i - len(key) + 1
+                        if edges[0] and start > 0 and text[start - 1] in _ASCII_WORD:
+                            continue
+                        if edges[1] and i < last and text[i + 1] in _ASCII_WORD:
+                            continue
+                    found.add(key)
+        return found
+
+
+class KeywordMatcher:
+    """
+    主自動機（main）+ 增量自動機（delta）：
+    - 新增關鍵字時只重建 delta（最多 KEYWORD_MATCH_DELTA 個，毫秒級），
+      delta 滿了才在背景把全部關鍵字重建成新的 main 再換上
+    - 取消訂閱只把關鍵字從對照表移除，自動機裡的舊節點比對到也會被略過，
+      移除的數量多了一樣在背景重建
+    掃描時 main 與 delta 各掃一次，兩者都是線性時間，與關鍵字數量無關。
+    """
+
+    def __init__(self, delta_limit=1000, resync=600, min_length=2):
+        self.delta_limit = max(delta_limit, 1)
+        self.resync = resync
+        self.min_length = min_length
+        self._lock = threading.Lock()
+        self._keywords = {}        # key -> { 原本的寫法: 訂閱人數 }
+        self._main = Automaton()
+        self._main_keys = frozenset()
+        self._pending = set()      # 還不在 main 裡的 key
+        self._delta = Automaton()
+        self._removed = 0          # main 裡已經沒人訂閱的 key 數
+        self._rebuilding = False
+        self._started = False
+        self._last_match = {}      # key -> 由其他主題比對到的新聞裡最新的發布時間
+        self._stats = {"scanned": 0, "matches": 0, "rebuilds": 0, "delta_builds": 0,
+                       "resyncs": 0, "errors": 0, "rebuild_seconds": 0.0}
+
+    # ---- 關鍵字 ----
+    def _usable(self, key):
+        return len(key) >= self.min_length
+
+    def _add_locked(self, keyword, n=1):
+        key = keyword_key(keyword)
+        if not self._usable(key):
+            return False
+        forms = self._keywords.get(key)
+        pending_added = False
+        if forms is None:
+            forms = self._keywords[key] = {}
+            if key in self._main_keys:
+                self._removed -= 1
+            else:
+                self._pending.add(key)
+                pending_added = True
+        forms[keyword] = forms.get(keyword, 0) + n
+        return pending_added
+
+    def _remove_locked(self, keyword):
+        key = keyword_key(keyword)
+        forms = self._keywords.get(key)
+        if forms is None or keyword not in forms:
+            return
+        forms[keyword] -= 1
+        if forms[keyword] <= 0:
+            del forms[keyword]
+        if not forms:
+            del self._keywords[key]
+            self._last_match.pop(key, None)
+            if key in self._pending:
+                self._pending.discard(key)
+            else:
+                self._removed += 1
+
+    def _changed_locked(self, pending_changed):
+        # pending 有變就重建 delta；回傳要不要在背景重建 main
+        if pending_changed:
+            self._delta = Automaton(self._pending)
+            self._stats["delta_builds"] += 1
+        too_many = (len(self._pending) > self.delta_limit or
+                    self._removed > max(self.delta_limit, len(self._keywords) // 10))
+        return too_many and not self._rebuilding
+
+    def add(self, keywords):
+        with self._lock:
+            pending_changed = any([self._add_locked(k) for k in keywords])
+            rebuild = self._changed_locked(pending_changed)
+        if rebuild:
+            self._rebuild_async()
+
+    def remove(self, keywords):
+        with self._lock:
+            pending = len(self._pending)
+            for k in keywords:
+                self._remove_locked(k)
+            rebuild = self._changed_locked(len(self._pending) != pending)
+        if rebuild:
+            self._rebuild_async()
+
+    def on_subscriptions_changed(self, user_id, before, after):
+        """user_state 的訂閱變更事件：只處理差異（不知道原本的訂閱時只確保新的都在）"""
+        if before is None:
+            with self._lock:
+                missing = [k for k in after if keyword_key(k) not in self._keywords]
+            self.add(missing)
+            return
+        before_set, after_set = set(before), set(after)
+        removed = [k for k in before if k not in after_set]
+        added = [k for k in after if k not in before_set]
+        if removed:
+            self.remove(removed)
+        if added:
+            self.add(added)
+
+    def load(self, counts):
+        """以 { 關鍵字: 訂閱人數 } 整個取代，立即重建（啟動與定期重新同步時使用）"""
+        keywords = {}
+        for keyword, n in counts.items():
+            key = keyword_key(keyword)
+            if self._usable(key) and n > 0:
+                keywords.setdefault(key, {})[keyword] = n
+        started = time.perf_counter()
+        main = Automaton(keywords)
+        with self._lock:
+            # 讀 DB 之後才新增的（還在 pending、DB 結果裡沒有）保留下來
+            self._pending = {k for k in self._pending if k not in keywords and k in self._keywords}
+            for k in self._pending:
+                keywords[k] = self._keywords[k]
+            self._keywords = keywords
+            self._main, self._main_keys = main, frozenset(keywords) - self._pending
+            self._delta = Automaton(self._pending)
+            self._removed = 0
+            self._last_match = {k: t for k, t in self._last_match.items() if k in keywords}
+            self._stats["resyncs"] += 1
+            self._stats["rebuild_seconds"] = time.perf_counter() - started
+
+    def rebuild(self):
+        """把目前所有關鍵字重建成 main，清空 delta 與已移除的節點"""
+        with self._lock:
+            keys = list(self._keywords)
+            self._rebuilding = True
+        started = time.perf_counter()
+        try:
+            main = Automaton(keys)
+        except Exception:
+            with self._lock:
+                self._rebuilding = False
+            raise
+        with self._lock:
+            self._main, self._main_keys = main, frozenset(keys)
+            self._pending = {k for k in self._pending if k not in self._main_keys}
+            self._delta = Automaton(self._pending)
+            self._removed = sum(1 for k in self._main_keys if k not in self._keywords)
+            self._rebuilding = False
+            self._stats["rebuilds"] += 1
+            self._stats["rebuild_seconds"] = time.perf_counter() - started
+
+    def _rebuild_async(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild_safe, name="keyword-rebuild", daemon=True).start()
+
+    def _rebuild_safe(self):
+        try:
+            self.rebuild()
+        except Exception:
+            with self._lock:
+                self._stats["errors"] += 1
+
+    # ---- 比對 ----
+    def match(self, text):
+        """標題裡出現的所有訂閱關鍵字（原本的寫法），標題只掃一次"""
+        with self._lock:
+            main, delta = self._main, self._delta
+        folded = (text or "").casefold()
+        keys = main.scan(folded) | delta.scan(folded)
+        if not keys:
+            return []
+        found = []
+        with self._lock:
+            for key in keys:
+                found.extend(self._keywords.get(key, ()))
+        return found
+
+    def match_articles(self, articles, exclude=None):
+        """
+        articles: 正規化後的新聞。回傳 { 關鍵字: [新聞, ...] }，
+        exclude 為這批新聞本身的主題（不必再寫一次，也不算成「由其他主題比對到」）
+        """
+        matches = {}
+        for a in articles:
+            for keyword in self.match(a["title"]):
+                if keyword != exclude:
+                    matches.setdefault(keyword, []).append(a)
+        with self._lock:
+            self._stats["scanned"] += len(articles)
+            self._stats["matches"] += sum(len(v) for v in matches.values())
+            # 記下比對到的新聞裡最新的發布時間（同一批舊新聞重複比對不會讓關鍵字一直算有涵蓋）
+            for keyword, found in matches.items():
+                key = keyword_key(keyword)
+                newest = max(a["published"] for a in found)
+                if newest > self._last_match.get(key, 0):
+                    self._last_match[key] = newest
+        return matches
+
+    def covered(self, keyword, within):
+        """最近 within 秒內發布的新聞裡，有沒有從其他主題比對到這個關鍵字（有就不必單獨查 RSS）"""
+        with self._lock:
+            last = self._last_match.get(keyword_key(keyword))
+        return last is not None and time.time() - last < within
+
+    # ---- 背景 ----
+    def run(self):
+        while True:
+            try:
+                self.load(db.count_topic_subscribers())
+            except Exception:
+                with self._lock:
+                    self._stats["errors"] += 1
+            time.sleep(self.resync)
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        threading.Thread(target=self.run, name="keyword-match", daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s["keywords"] = len(self._keywords)
+            s["main_keywords"] = self._main.size
+            s["main_nodes"] = len(self._main.goto)
+            s["pending"] = len(self._pending)
+            s["removed"] = self._removed
+        return s
+
+
+matcher = KeywordMatcher(delta_limit=KEYWORD_MATCH_DELTA, resync=KEYWORD_MATCH_RESYNC,
+                         min_length=KEYWORD_MIN_LENGTH)
+
+match = matcher.match
+match_articles = matcher.match_articles
+covered = matcher.covered
+stats = matcher.stats
+
+def start():
+    """KEYWORD_MATCH=1 時登記訂閱變更事件並啟動背景同步"""
+    if KEYWORD_MATCH:
+        user_state.on_subscriptions_changed(matcher.on_subscriptions_changed)
+        matcher.start()
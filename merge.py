@@ -0,0 +1,168 @@
+# merge.py
+# 同一則新聞出現在多個主題時（大雨 / 洪水 / 土石流 …）合併成一個 bubble：
+# 先以正規化網址（含 Google News 轉址）比對，再以標題 shingle 的 MinHash + LSH 找近似重複
+import os
+import re
+import zlib
+import base64
+import random
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+# 設定（可由環境變數調整）
+NEWS_MERGE           = os.getenv("NEWS_MERGE", "0") == "1"                    # 跨主題合併重複新聞（預設關閉）
+NEWS_MERGE_THRESHOLD = float(os.getenv("NEWS_MERGE_THRESHOLD", "0.6"))   # 標題相似度（Jaccard）門檻
+
+SHINGLE = 3          # 字元 3-gram（中文標題沒有空白可切詞）
+BANDS, ROWS = 16, 2  # LSH：16 個 band、每個 band 2 列，共 32 個 MinHash
+TOPIC_SEPARATOR = "・"
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(_PRIME)) for _ in range(BANDS * ROWS)]
+
+_GOOGLE_ARTICLE = re.compile(r"^/(?:rss/)?articles/([A-Za-z0-9_-]+)")
+_TRACKING = {"oc", "fbclid", "gclid", "hl", "gl", "ceid"}
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def _canonical_plain(url):
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if not (k.startswith("utm_") or k in _TRACKING)]
+    path = parts.path.rstrip("/")
+    return host + path + ("?" + urlencode(query) if query else "")
+
+def canonical_url(url):
+    """
+    比對用的網址：去掉 scheme、www、追蹤參數、fragment 與結尾斜線。
+    Google News 的 /rss/articles/<id> 轉址：舊格式的 id 是 base64 protobuf，
+    裡面直接帶原始網址，解得出來就用原始網址；解不出來就用 id 本身。
+    """
+    if not url:
+        return ""
+    parts = urlsplit(url.strip())
+    if (parts.hostname or "").lower() == "news.google.com":
+        m = _GOOGLE_ARTICLE.match(parts.path)
+        if m:
+            token = m.group(1)
+            try:
+                raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+            except (ValueError, TypeError):
+                raw = b""
+            start = raw.find(b"http")
+            if start >= 0:
+                end = start
+                while end < len(raw) and 0x21 <= raw[end] <= 0x7e:
+                    end += 1
+                return _canonical_plain(raw[start:end].decode("ascii"))
+            return "news.google.com/articles/" + token
+        # news.google.com/url?url=原始網址
+        target = dict(parse_qsl(parts.query)).get("url")
+        if target:
+            return _canonical_plain(target)
+    return _canonical_plain(url)
+
+def title_key(title):
+    """去掉 Google News 標題結尾的「 - 媒體名稱」與標點、空白"""
+    title = title or ""
+    head, sep, _source = title.rpartition(" - ")
+    if sep and head:
+        title = head
+    return _NON_WORD.sub("", title.casefold())
+
+def shingles(text):
+    if len(text) <= SHINGLE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE] for i in range(len(text) - SHINGLE + 1)}
+
+def minhash(shingle_set):
+    hashes = [zlib.crc32(s.encode("utf-8")) for s in shingle_set]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+def _similarity(sig_a, sig_b):
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+
+def cluster_keys(items, threshold=None):
+    """
+    items: [{"title", "url"}, ...]。回傳與 items 對應的群組編號清單，
+    同一則新聞（網址相同或標題相似度 >= threshold）得到相同編號。
+    每則新聞的簽章只算一次，LSH 分桶後只比對同桶的候選，整體為線性時間。
+    """
+    threshold = NEWS_MERGE_THRESHOLD if threshold is None else threshold
+    parent = list(range(len(items)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+
+    by_url, by_title, signatures, buckets = {}, {}, {}, {}
+    for i, n in enumerate(items):
+        url = canonical_url(n.get("url"))
+        if url:
+            union(i, by_url.setdefault(url, i))
+        key = title_key(n.get("title"))
+        if not key:
+            continue
+        if key in by_title:
+            union(i, by_title[key])
+            continue
+        by_title[key] = i
+        sig = signatures[i] = minhash(shingles(key))
+        for band in range(BANDS):
+            bucket = (band, tuple(sig[band * ROWS:(band + 1) * ROWS]))
+            for j in buckets.get(bucket, ()):
+                if find(i) != find(j) and _similarity(sig, signatures[j]) >= threshold:
+                    union(i, j)
+            buckets.setdefault(bucket, []).append(i)
+    return [find(i) for i in range(len(items))]
+
+def cluster_index(news_by_topic, threshold=None):
+    """
+    news_by_topic: { topic: [news, ...] }。對這一輪抓到的所有新聞只分群一次，
+    回傳 { url: 群組編號 }，之後每位使用者的合併只需查表。
+    """
+    items = [n for ns in news_by_topic.values() for n in ns]
+    return {n["url"]: key for n, key in zip(items, cluster_keys(items, threshold))}
+
+def merge_articles(articles, index=None, threshold=None):
+    """
+    articles: [(topic, {"title", "url", ...}), ...]（build_carousel_messages 的輸入格式）
+    重複的新聞合併成第一次出現的那則，主題標成「大雨・洪水」，
+    被合併掉的網址放在 merged_urls（已送過紀錄會一併記下）。順序依第一次出現。
+    index 為 cluster_index() 的結果；沒有時就地分群。
+    """
+    if len(articles) < 2:
+        return articles
+    if index is None:
+        keys = cluster_keys([n for _topic, n in articles], threshold)
+    else:
+        keys = [index.get(n["url"], n["url"]) for _topic, n in articles]
+    groups = {}
+    for (topic, n), key in zip(articles, keys):
+        group = groups.get(key)
+        if group is None:
+            groups[key] = [[topic], n, []]
+            continue
+        if topic not in group[0]:
+            group[0].append(topic)
+        if n["url"] != group[1]["url"]:
+            group[2].append(n["url"])
+    if len(groups) == len(articles):
+        return articles
+    merged = []
+    for topics, n, urls in groups.values():
+        if urls:
+            n = dict(n, merged_urls=urls)
+        merged.append((TOPIC_SEPARATOR.join(topics), n))
+    return merged
@@ -0,0 +1,150 @@
+# metrics.py
+# 輕量的計時 / 計數工具，輸出 Prometheus 文字格式給 /metrics
+#   METRICS_ENABLED=0 時 timed() 直接回傳原函式、timer() 回傳空的 context manager，幾乎沒有額外負擔
+import os
+import time
+import threading
+from bisect import bisect_left
+from functools import wraps
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+PREFIX = "linebot_"
+
+# 延遲直方圖的邊界（秒）
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_histograms = {}   # (name, labels) -> [bucket counts..., count, sum]
+_counters = {}     # (name, labels) -> value
+_help = {}         # name -> 說明
+_collectors = []   # [(prefix, fn)]，fn 回傳 { key: 數值 }
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+def observe(name, seconds, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = (name, _labels_key(labels))
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [0] * (len(BUCKETS) + 1) + [0, 0.0]
+        h[bisect_left(BUCKETS, seconds)] += 1
+        h[-2] += 1
+        h[-1] += seconds
+
+def inc(name, value=1, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = (name, _labels_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name, labels):
+        self.name, self.labels = name, labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+        if exc_type is not None:
+            inc(self.name.replace("_seconds", "_errors_total"), **self.labels)
+        return False
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP = _NoopTimer()
+
+def timer(name, **labels):
+    """with metrics.timer("xxx_seconds", op="..."): ..."""
+    if not METRICS_ENABLED:
+        return _NOOP
+    return _Timer(name, labels)
+
+def timed(name, **labels):
+    """函式裝飾器；停用時直接回傳原函式"""
+    def decorator(fn):
+        if not METRICS_ENABLED:
+            return fn
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Timer(name, labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def describe(name, text):
+    _help[name] = text
+
+def register_collector(prefix, fn):
+    """登記一個回傳 { key: 數值 } 的函式，輸出時轉成 gauge：<prefix>_<key>"""
+    _collectors.append((prefix, fn))
+
+
+def _fmt_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                    for k, v in pairs)
+    return "{" + body + "}"
+
+def render():
+    """輸出 Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        histograms = {k: list(v) for k, v in _histograms.items()}
+        counters = dict(_counters)
+
+    seen = set()
+    for (name, labels), h in sorted(histograms.items()):
+        full = PREFIX + name
+        if full not in seen:
+            seen.add(full)
+            if name in _help:
+                lines.append(f"# HELP {full} {_help[name]}")
+            lines.append(f"# TYPE {full} histogram")
+        cumulative = 0
+        for bound, n in zip(BUCKETS + ("+Inf",), h[:len(BUCKETS) + 1]):
+            cumulative += n
+            lines.append(f"{full}_bucket{_fmt_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{full}_count{_fmt_labels(labels)} {h[-2]}")
+        lines.append(f"{full}_sum{_fmt_labels(labels)} {h[-1]}")
+
+    for (name, labels), value in sorted(counters.items()):
+        full = PREFIX + name
+        if full not in seen:
+            seen.add(full)
+            lines.append(f"# TYPE {full} counter")
+        lines.append(f"{full}{_fmt_labels(labels)} {value}")
+
+    for prefix, fn in _collectors:
+        try:
+            values = fn()
+        except Exception:
+            continue
+        for key, value in sorted(values.items()):
+            if isinstance(value, bool):
+                value = int(value)
+            if not isinstance(value, (int, float)):
+                continue
+            full = f"{PREFIX}{prefix}_{key}"
+            lines.append(f"# TYPE {full} gauge")
+            lines.append(f"{full} {value}")
+    return "\n".join(lines) + "\n"
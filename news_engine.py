@@ -0,0 +1,128 @@
+# news_engine.py
+# 即時新聞的 asyncio 抓取引擎：一個常駐的 event loop，Flask handler 把主題批次丟進來
+import os
+import time
+import asyncio
+import threading
+import concurrent.futures
+from bisect import bisect_left
+
+from rss import fetch_google_news   # 與排程推播共用同一個快取與 HTTP session
+
+# 設定（可由環境變數調整）
+NEWS_ENGINE_WORKERS = int(os.getenv("NEWS_ENGINE_WORKERS", "16"))     # 同時進行的 RSS 抓取數
+NEWS_TOPIC_TIMEOUT  = float(os.getenv("NEWS_TOPIC_TIMEOUT", "3"))     # 單一主題最多等幾秒
+NEWS_DEADLINE       = float(os.getenv("NEWS_DEADLINE", "5"))          # 整批最多等幾秒
+
+# 延遲直方圖的邊界（秒），最後一格為 +Inf
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+MAX_TRACKED_TOPICS = 1000
+
+
+class NewsEngine:
+    """
+    在獨立執行緒跑一個 event loop。fetch_topics() 可從任何執行緒呼叫：
+    每個主題有各自的逾時，整批有總期限，逾時的主題直接略過（回傳部分結果）。
+    RSS 抓取本身是阻塞的 requests，交給固定大小的執行緒池執行。
+    """
+
+    def __init__(self, workers=16, topic_timeout=3, deadline=5):
+        self.topic_timeout = topic_timeout
+        self.deadline = deadline
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(workers, 1), thread_name_prefix="news-engine")
+        self._loop = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._histograms = {}   # topic -> {"buckets": [...], "count", "sum"}
+        self._stats = {"batches": 0, "topics": 0, "topic_timeouts": 0,
+                       "deadline_misses": 0, "errors": 0}
+
+    def _ensure_loop(self):
+        if self._loop is not None:
+            return self._loop
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="news-engine-loop",
+                                 daemon=True).start()
+                self._loop = loop
+        return self._loop
+
+    def fetch_topics(self, topics, count=3):
+        """回傳 { topic: [news, ...] }，只包含在期限內完成的主題（順序同 topics）"""
+        if not topics:
+            return {}
+        loop = self._ensure_loop()
+        fut = asyncio.run_coroutine_threadsafe(self._fetch_batch(list(topics), count), loop)
+        try:
+            return fut.result(self.deadline + 1)
+        except concurrent.futures.TimeoutError:
+            fut.cancel()
+            return {}
+
+    async def _fetch_batch(self, topics, count):
+        tasks = {asyncio.ensure_future(self._fetch_one(t, count)): t for t in topics}
+        done, pending = await asyncio.wait(tasks, timeout=self.deadline)
+        for task in pending:
+            task.cancel()
+        with self._stats_lock:
+            self._stats["batches"] += 1
+            self._stats["topics"] += len(topics)
+            self._stats["deadline_misses"] += len(pending)
+        results = {}
+        for task in done:
+            items = task.result()
+            if items is not None:
+                results[tasks[task]] = items
+        return {t: results[t] for t in topics if t in results}
+
+    async def _fetch_one(self, topic, count):
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        try:
+            items = await asyncio.wait_for(
+                loop.run_in_executor(self._executor, fetch_google_news, topic, count),
+                timeout=self.topic_timeout)
+        except asyncio.TimeoutError:
+            # 背景執行緒仍會抓完並寫入快取，下次請求就能命中
+            with self._stats_lock:
+                self._stats["topic_timeouts"] += 1
+            self._observe(topic, time.monotonic() - start)
+            return None
+        except Exception:
+            with self._stats_lock:
+                self._stats["errors"] += 1
+            return None
+        self._observe(topic, time.monotonic() - start)
+        return items
+
+    def _observe(self, topic, seconds):
+        with self._stats_lock:
+            h = self._histograms.get(topic)
+            if h is None:
+                if len(self._histograms) >= MAX_TRACKED_TOPICS:
+                    topic = "_other"
+                    h = self._histograms.get(topic)
+                if h is None:
+                    h = self._histograms[topic] = {
+                        "buckets": [0] * (len(LATENCY_BUCKETS) + 1), "count": 0, "sum": 0.0}
+            h["buckets"][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            h["count"] += 1
+            h["sum"] += seconds
+
+    def stats(self):
+        with self._stats_lock:
+            s = dict(self._stats)
+            s["latency"] = {t: {"buckets": list(h["buckets"]), "count": h["count"], "sum": h["sum"]}
+                            for t, h in self._histograms.items()}
+        s["bucket_bounds"] = LATENCY_BUCKETS
+        return s
+
+
+engine = NewsEngine(workers=NEWS_ENGINE_WORKERS,
+                    topic_timeout=NEWS_TOPIC_TIMEOUT,
+                    deadline=NEWS_DEADLINE)
+
+fetch_topics = engine.fetch_topics
+stats = engine.stats
@@ -0,0 +1,139 @@
+# postback.py
+# Postback 路由：data 只解析一次成 Action，再用 dict 查表分派給各模組登記的處理器
+#   subscribetest / pushs 在 import 時以 @postback.route("動作", "必要參數"...) 登記
+import os
+import threading
+from functools import lru_cache
+from urllib.parse import unquote
+
+import metrics
+
+# LINE 的 postback data 上限是 300 字元，超過一律視為惡意或錯誤的 payload
+POSTBACK_MAX_LENGTH = int(os.getenv("POSTBACK_MAX_LENGTH", "300"))
+POSTBACK_MAX_PARAMS = 8
+# 按鈕產生的 data 種類有限（動作 × 主題），解析結果快取起來，重複的 postback 只剩一次查表
+POSTBACK_CACHE_SIZE = int(os.getenv("POSTBACK_CACHE_SIZE", "4096"))
+
+
+class Action:
+    """解析後的 postback：name 為 action=... 的值，params 為其餘參數"""
+    __slots__ = ("name", "params")
+
+    def __init__(self, name, params):
+        self.name, self.params = name, params
+
+    def get(self, key, default=None):
+        return self.params.get(key, default)
+
+    def __getitem__(self, key):
+        return self.params[key]
+
+    def __repr__(self):
+        return f"Action({self.name!r}, {self.params!r})"
+
+
+def _quote(value):
+    # 只跳脫會破壞格式的字元；中文維持原樣，避免 percent-encoding 後超過 300 字元上限
+    return str(value).replace("%", "%25").replace("&", "%26").replace("=", "%3D")
+
+def build(name, **params):
+    """
+    產生按鈕用的 data：build("unsubscribe", topic="AT&T") -> "action=unsubscribe&topic=AT%26T"
+    使用者自訂的主題可能含有 & 或 =，一律經過這裡產生，parse 時再還原。
+    """
+    return "&".join([f"action={_quote(name)}"] + [f"{k}={_quote(v)}" for k, v in params.items()])
+
+def parse(data):
+    """
+    "action=subscribe&topic=地震" -> Action("subscribe", {"topic": "地震"})
+    格式錯誤（過長、參數過多、缺少 action、沒有 '='、重複參數）回傳 None。
+    參數值以 unquote 還原（build 產生的 %26、%3D、%25）。
+    """
+    if not data or len(data) > POSTBACK_MAX_LENGTH or not data.startswith("action="):
+        return None
+    name, _, rest = data[7:].partition("&")
+    name = unquote(name)
+    if not name:
+        return None
+    params = {}
+    if rest:
+        parts = rest.split("&", POSTBACK_MAX_PARAMS)
+        if len(parts) > POSTBACK_MAX_PARAMS:
+            return None
+        for p in parts:
+            k, sep, v = p.partition("=")
+            k = unquote(k)
+            if not sep or not k or k in params:
+                return None
+            params[k] = unquote(v)
+    return Action(name, params)
+
+
+_routes = {}   # name -> (handler, required params)
+_lock = threading.Lock()
+_stats = {"dispatched": 0, "unknown": 0, "malformed": 0}
+
+def route(name, *required):
+    """
+    登記處理器：handler(event, line_bot_api, action)
+    required 為必要參數，缺少時視同格式錯誤、不呼叫處理器。
+    """
+    def decorator(fn):
+        if name in _routes:
+            raise ValueError(f"postback 動作重複登記：{name}")
+        _routes[name] = (fn, frozenset(required))
+        _resolve.cache_clear()
+        return fn
+    return decorator
+
+def _count(key):
+    with _lock:
+        _stats[key] += 1
+
+@lru_cache(maxsize=POSTBACK_CACHE_SIZE)
+def _resolve(data):
+    """data -> (handler, Action)；無法處理時回傳統計用的字串 malformed 或 unknown"""
+    action = parse(data)
+    if action is None:
+        return "malformed"
+    entry = _routes.get(action.name)
+    if entry is None:
+        return "unknown"
+    handler, required = entry
+    if required and not action.params.keys() >= required:
+        return "malformed"
+    return handler, action
+
+def resolve(data):
+    """回傳 (handler, Action) 或 None；處理器只能讀取 Action，不可修改（結果會被重複使用）"""
+    if not data or len(data) > POSTBACK_MAX_LENGTH:
+        return None
+    resolved = _resolve(data)
+    return resolved if type(resolved) is tuple else None
+
+def dispatch(event, line_bot_api):
+    """解析並分派一個 PostbackEvent；無法處理時回傳 None"""
+    data = event.postback.data
+    if not data or len(data) > POSTBACK_MAX_LENGTH:
+        # 過長的 payload 不進快取
+        _count("malformed")
+        return None
+    resolved = _resolve(data)
+    if type(resolved) is not tuple:
+        _count(resolved)
+        return None
+    handler, action = resolved
+    _count("dispatched")
+    with metrics.timer("postback_seconds", action=action.name):
+        return handler(event, line_bot_api, action)
+
+def routes():
+    return sorted(_routes)
+
+def stats():
+    with _lock:
+        s = dict(_stats)
+    info = _resolve.cache_info()
+    s["routes"] = len(_routes)
+    s["cache_hits"], s["cache_misses"], s["cache_size"] = info.hits, info.misses, info.currsize
+    return s
@@ -1,176 +1,372 @@
-# pushs.py
-import os, time, schedule
-from datetime import datetime, timedelta
-from urllib.parse import quote
-import requests, xml.etree.ElementTree as ET
-from dotenv import load_dotenv
-load_dotenv()
-
-from linebot.v3.messaging import (
-    Configuration, ApiClient, MessagingApi,
-    TextMessage, QuickReply, QuickReplyItem, PostbackAction,
-    PushMessageRequest, ReplyMessageRequest, FlexMessage, FlexContainer, DatetimePickerAction
-)
-from subscribetest import ALL_TOPICS             # 只有主題清單 :contentReference[oaicite:1]{index=1}
-import db                                       # 讀寫訂閱與推播設定 :contentReference[oaicite:2]{index=2}
-
-# 快取使用者的推播偏好（不包括訂閱清單）
-user_push_selection = {}   # { user_id: { topic: bool, ... } }
-user_push_time      = {}   # { user_id: "HH:MM", ... }
-
-def get_default_push_time():
-    return (datetime.now() + timedelta(minutes=1)).strftime("%H:%M")
-
-def fetch_google_news(topic, count=3):
-    rss = f"https://news.google.com/rss/search?q={quote(topic)}&hl=zh-TW&gl=TW&ceid=TW:zh-Hant"
-    try:
-        r = requests.get(rss, timeout=5); r.raise_for_status()
-        root = ET.fromstring(r.content)
-    except:
-        return []
-    items = root.findall('.//item')[:count]
-    return [{"title": it.findtext('title','').strip(),
-             "url": it.findtext('link','').strip()} for it in items]
-
-def build_push_quickreply(user_id):
-    # 以 DB 為來源，不用 user_subscriptions
-    subs     = db.list_subscriptions(user_id)
-    settings = user_push_selection.setdefault(user_id, db.list_push_topics(user_id))
-    items = []
-    for topic in subs:
-        enabled = settings.get(topic, False)
-        label   = f"{topic}主題{'不' if enabled else ''}推播"
-        choice  = not enabled
-        items.append( QuickReplyItem(
-            action=PostbackAction(
-                label=label,
-                data=f"action=set_push_choice&topic={topic}&choice={int(choice)}"
-            )
-        ))
-    if any(settings.values()):
-        items.append( QuickReplyItem(
-            action=DatetimePickerAction(
-                label="設定推播時間",
-                data="action=set_push_time",
-                mode="time",
-                initial=get_default_push_time(),
-                min="00:00", max="23:59"
-            )
-        ))
-    items.append( QuickReplyItem(
-        action=PostbackAction(label="完成推播設定", data="action=confirm_push")
-    ))
-    return QuickReply(items=items)
-
-def build_push_status_text(user_id):
-    subs     = db.list_subscriptions(user_id)
-    settings = user_push_selection.get(user_id, {})
-    push_t   = [t for t,en in settings.items() if en]
-    txt = "請選擇要推播的訂閱主題:"
-    if push_t:
-        txt += "\n" + "\n".join(f"{t}:推播" for t in push_t)
-        if ttime := user_push_time.get(user_id):
-            txt += f"\n{ttime} 將推播 {'、'.join(push_t)} 的資訊"
-    return txt
-
-def handle_push_message(event, line_bot_api):
-    user_id = event.source.user_id
-    subs    = db.list_subscriptions(user_id)
-    if not subs:
-        from linebot.v3.messaging import QuickReplyItem  # 重新引入避免循環
-        qr = QuickReply(items=[ QuickReplyItem(
-            action=PostbackAction(label="＋ 新增訂閱", data="action=start_add_subscription")
-        )])
-        msg = TextMessage(text="目前沒有訂閱主題，請先新增訂閱", quick_reply=qr)
-        return line_bot_api.reply_message_with_http_info(
-            ReplyMessageRequest(reply_token=event.reply_token, messages=[msg])
-        )
-    # 每次都從 DB 載入最新選擇
-    user_push_selection[user_id] = db.list_push_topics(user_id)
-    text = build_push_status_text(user_id)
-    qr   = build_push_quickreply(user_id)
-    return line_bot_api.reply_message_with_http_info(
-        ReplyMessageRequest(reply_token=event.reply_token,
-                            messages=[TextMessage(text=text, quick_reply=qr)])
-    )
-
-def handle_push_postback(event, line_bot_api):
-    data    = event.postback.data or ""
-    user_id = event.source.user_id
-    # 處理選擇推播與設定時間等，維持與 DB 同步
-    if data.startswith("action=set_push_choice"):
-        parts = dict(p.split("=",1) for p in data.split("&")[1:])
-        topic = parts["topic"]
-        choice= bool(int(parts["choice"]))
-        # 更新快取 & DB
-        user_push_selection.setdefault(user_id, {})[topic] = choice
-        db.set_push_choice(user_id, topic, choice)
-        # 若全取消則清掉時間
-        if not any(user_push_selection[user_id].values()):
-            db.set_push_time(user_id, None)
-            user_push_time.pop(user_id, None)
-        return line_bot_api.reply_message_with_http_info(
-            ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[ TextMessage(text=build_push_status_text(user_id),
-                                       quick_reply=build_push_quickreply(user_id)) ]
-            )
-        )
-    if data == "action=set_push_time":
-        t = event.postback.params.get("time")
-        if t:
-            db.set_push_time(user_id, t)
-            user_push_time[user_id] = t
-            msg = TextMessage(text=f"{t}將會傳送 {'、'.join([tp for tp,en in user_push_selection[user_id].items() if en])} 的資訊",
-                              quick_reply=build_push_quickreply(user_id))
-        else:
-            msg = TextMessage(text="設定推播時間失敗", quick_reply=build_push_quickreply(user_id))
-        return line_bot_api.reply_message_with_http_info(
-            ReplyMessageRequest(reply_token=event.reply_token, messages=[msg])
-        )
-    if data == "action=confirm_push":
-        sel = [t for t,en in user_push_selection.get(user_id,{}).items() if en]
-        tme = user_push_time.get(user_id,"未設定時間")
-        final = ("已完成所有推播設定，無主題啟用。" if not sel
-                 else f"設定 {'、'.join(sel)} 推播，{tme} 將送出。")
-        return line_bot_api.reply_message_with_http_info(
-            ReplyMessageRequest(reply_token=event.reply_token,
-                                messages=[TextMessage(text=final)])
-        )
-
-def send_scheduled_news():
-    now = datetime.now().strftime("%H:%M")
-    # 重新從 DB 載入所有排程與選擇
-    schedule_map = db.list_push_schedule()
-    topics_map   = {uid: db.list_push_topics(uid) for uid in schedule_map}
-    for uid, t in schedule_map.items():
-        if t == now:
-            bubbles = []
-            for topic, enabled in topics_map[uid].items():
-                if not enabled: continue
-                for n in fetch_google_news(topic):
-                    bubbles.append({
-                        "type":"bubble","size":"micro",
-                        "body":{"type":"box","layout":"vertical","contents":[
-                            {"type":"text","text":topic,"weight":"bold","size":"md","margin":"md"},
-                            {"type":"text","text":n["title"],"size":"sm","weight":"bold","wrap":True,"margin":"sm"}
-                        ]},
-                        "footer":{"type":"box","layout":"vertical","contents":[
-                            {"type":"button","action":{"type":"uri","label":"開啟新聞","uri":n["url"]},
-                             "style":"primary","height":"sm","gravity":"center","margin":"md"}
-                        ],"spacing":"sm","paddingAll":"10px"}
-                    })
-            if bubbles:
-                config = Configuration(access_token=os.getenv('CHANNEL_ACCESS_TOKEN'))
-                with ApiClient(config) as client:
-                    api = MessagingApi(client)
-                    carousel = {"type":"carousel","contents":bubbles}
-                    flex = FlexMessage(alt_text="定時新聞推播",
-                                      contents=FlexContainer.from_dict(carousel))
-                    api.push_message(PushMessageRequest(to=uid, messages=[flex]))
-
-def start_push_scheduler():
-    schedule.every(1).minutes.do(send_scheduled_news)
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+# pushs.py
+import os, time
+import concurrent.futures
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+load_dotenv()
+
+from linebot.v3.messaging import (
+    TextMessage, QuickReply, QuickReplyItem, PostbackAction,
+    ReplyMessageRequest, DatetimePickerAction
+)
+from subscribetest import ALL_TOPICS             # 只有主題清單 :contentReference[oaicite:1]{index=1}
+import db                                       # 讀寫訂閱與推播設定 :contentReference[oaicite:2]{index=2}
+import metrics
+import postback                                 # postback 路由
+import user_state                               # 訂閱 / 推播設定快取（write-through）
+from rss import fetch_cached                    # 與即時新聞共用快取
+from delivery import deliver
+from flex import build_carousel_messages
+from line_client import get_messaging_api
+from timewheel import PushWheel, format_minute
+from cluster import coordinator                 # 多 worker 時分配推播分片
+import ingest                                   # 背景匯入的新聞庫
+import seen                                     # 每位使用者已送過的新聞
+import merge                                    # 跨主題的重複新聞合併
+
+# 排程推播時同時抓取 RSS 的最大執行緒數
+PUSH_FETCH_WORKERS = int(os.getenv("PUSH_FETCH_WORKERS", "8"))
+# 每個主題讀幾則：略過已送過的新聞時多讀一些候選（預抓與發送必須相同，快取以 (topic, count) 為 key）
+PUSH_FETCH_COUNT = seen.DELIVERY_CANDIDATES if seen.DELIVERY_DEDUP else 3
+
+# 最近一次排程發送的統計（delivered / failed / retried / elapsed …）
+last_delivery_report = {}
+
+# 推播時間輪（只用來預抓；到期名單一律以 DB 為準）與排程設定
+push_wheel = PushWheel()
+PUSH_CATCHUP_MINUTES = int(os.getenv("PUSH_CATCHUP_MINUTES", "5"))   # 落後時最多補送幾分鐘
+PUSH_WHEEL_RESYNC    = float(os.getenv("PUSH_WHEEL_RESYNC", "600"))  # 幾秒與 DB 對帳一次，0 = 不對帳
+
+PUSH_PREFETCH_MINUTES = int(os.getenv("PUSH_PREFETCH_MINUTES", "3"))  # 提前幾分鐘預抓新聞，0 = 不預抓
+PUSH_REBALANCE_LEAD   = float(os.getenv("PUSH_REBALANCE_LEAD", "20"))  # 整分前幾秒釋放超額的分片
+
+# 其他行程改了推播時間時，同步更新本行程的時間輪
+user_state.on_remote_change(lambda uid: push_wheel.set(uid, db.get_push_time(uid)))
+
+# 已預抓的時段：{ "HH:MM": {topic, ...} }；發送時取出，有預抓的時段才統計發送當下的快取命中
+prefetched_topics = {}
+_prefetcher = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+# 排程統計：lag 為實際開始發送時間與設定分鐘的差距（秒）；
+# delivery_delay 為發送完成時間與設定分鐘的差距（秒）
+scheduler_stats = {
+    "ticks": 0, "lag_last": 0.0, "lag_max": 0.0, "due_users_last": 0,
+    "caught_up_minutes": 0, "skipped_minutes": 0, "errors": 0,
+    "prefetch_topics": 0, "prefetch_hits": 0,
+    "delivery_delay_last": 0.0, "delivery_delay_max": 0.0,
+}
+
+def get_default_push_time():
+    return (datetime.now() + timedelta(minutes=1)).strftime("%H:%M")
+
+def build_push_quickreply(user_id):
+    # 以 user_state 快取為來源（寫入時同步寫 DB）
+    subs     = user_state.list_subscriptions(user_id)
+    settings = user_state.list_push_topics(user_id)
+    items = []
+    for topic in subs:
+        enabled = settings.get(topic, False)
+        label   = f"{topic}主題{'不' if enabled else ''}推播"
+        choice  = not enabled
+        items.append( QuickReplyItem(
+            action=PostbackAction(
+                label=label,
+                data=postback.build("set_push_choice", topic=topic, choice=int(choice))
+            )
+        ))
+    if any(settings.values()):
+        items.append( QuickReplyItem(
+            action=DatetimePickerAction(
+                label="設定推播時間",
+                data="action=set_push_time",
+                mode="time",
+                initial=get_default_push_time(),
+                min="00:00", max="23:59"
+            )
+        ))
+    items.append( QuickReplyItem(
+        action=PostbackAction(label="完成推播設定", data="action=confirm_push")
+    ))
+    return QuickReply(items=items)
+
+def build_push_status_text(user_id):
+    settings = user_state.list_push_topics(user_id)
+    push_t   = [t for t,en in settings.items() if en]
+    txt = "請選擇要推播的訂閱主題:"
+    if push_t:
+        txt += "\n" + "\n".join(f"{t}:推播" for t in push_t)
+        if ttime := user_state.get_push_time(user_id):
+            txt += f"\n{ttime} 將推播 {'、'.join(push_t)} 的資訊"
+    return txt
+
+def handle_push_message(event, line_bot_api):
+    user_id = event.source.user_id
+    subs    = user_state.list_subscriptions(user_id)
+    if not subs:
+        from linebot.v3.messaging import QuickReplyItem  # 重新引入避免循環
+        qr = QuickReply(items=[ QuickReplyItem(
+            action=PostbackAction(label="＋ 新增訂閱", data="action=start_add_subscription")
+        )])
+        msg = TextMessage(text="目前沒有訂閱主題，請先新增訂閱", quick_reply=qr)
+        return line_bot_api.reply_message_with_http_info(
+            ReplyMessageRequest(reply_token=event.reply_token, messages=[msg])
+        )
+    text = build_push_status_text(user_id)
+    qr   = build_push_quickreply(user_id)
+    return line_bot_api.reply_message_with_http_info(
+        ReplyMessageRequest(reply_token=event.reply_token,
+                            messages=[TextMessage(text=text, quick_reply=qr)])
+    )
+
+# 推播設定的 postback：選擇推播與設定時間等，維持與 DB 同步
+@postback.route("set_push_choice", "topic", "choice")
+def handle_set_push_choice(event, line_bot_api, action):
+    user_id = event.source.user_id
+    try:
+        choice = bool(int(action["choice"]))
+    except ValueError:
+        return None
+    # 更新快取 & DB
+    settings = user_state.set_push_choices(user_id, {action["topic"]: choice})
+    # 若全取消則清掉時間
+    if not any(settings.values()):
+        user_state.set_push_time(user_id, None)
+        push_wheel.set(user_id, None)
+    return line_bot_api.reply_message_with_http_info(
+        ReplyMessageRequest(
+            reply_token=event.reply_token,
+            messages=[ TextMessage(text=build_push_status_text(user_id),
+                                   quick_reply=build_push_quickreply(user_id)) ]
+        )
+    )
+
+@postback.route("set_push_time")
+def handle_set_push_time(event, line_bot_api, action):
+    user_id = event.source.user_id
+    t = (event.postback.params or {}).get("time")
+    if t:
+        user_state.set_push_time(user_id, t)
+        push_wheel.set(user_id, t)
+        msg = TextMessage(text=f"{t}將會傳送 {'、'.join([tp for tp,en in user_state.list_push_topics(user_id).items() if en])} 的資訊",
+                          quick_reply=build_push_quickreply(user_id))
+    else:
+        msg = TextMessage(text="設定推播時間失敗", quick_reply=build_push_quickreply(user_id))
+    return line_bot_api.reply_message_with_http_info(
+        ReplyMessageRequest(reply_token=event.reply_token, messages=[msg])
+    )
+
+@postback.route("confirm_push")
+def handle_confirm_push(event, line_bot_api, action):
+    user_id = event.source.user_id
+    sel = [t for t,en in user_state.list_push_topics(user_id).items() if en]
+    tme = user_state.get_push_time(user_id) or "未設定時間"
+    final = ("已完成所有推播設定，無主題啟用。" if not sel
+             else f"設定 {'、'.join(sel)} 推播，{tme} 將送出。")
+    return line_bot_api.reply_message_with_http_info(
+        ReplyMessageRequest(reply_token=event.reply_token,
+                            messages=[TextMessage(text=final)])
+    )
+
+def fetch_topics(topics, valid_until=None, count=3, hits=None):
+    """
+    每個主題只抓一次，以有上限的執行緒池並行抓取，回傳 { topic: [news, ...] }。
+    hits 為 set 時加入直接由快取提供（不必等 RSS）的主題。
+    """
+    results = {}
+    if not topics:
+        return results
+    workers = max(1, min(PUSH_FETCH_WORKERS, len(topics)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as exe:
+        futures = {exe.submit(fetch_cached, t, count, valid_until): t for t in topics}
+        for fut in concurrent.futures.as_completed(futures):
+            topic = futures[fut]
+            results[topic], hit = fut.result()
+            if hit and hits is not None:
+                hits.add(topic)
+    return results
+
+def send_scheduled_news(push_time=None, user_ids=None, due=None):
+    """
+    發送 push_time（"HH:MM"，預設為現在）到期的推播。
+    user_ids 未提供時由 DB 查詢到期使用者。
+    due 為已查好的 { user_id: [topic, ...] }（排程由 DB 讀出），只發送其中 user_ids 的部分。
+    """
+    global last_delivery_report
+    push_time = push_time or datetime.now().strftime("%H:%M")
+    if due is not None:
+        due = {uid: due[uid] for uid in user_ids or () if uid in due}
+        if not due:
+            return
+    elif user_ids is None:
+        # 一次查詢只撈出這分鐘到期的使用者與其啟用主題
+        due = db.list_due_pushes(push_time)
+    elif user_ids:
+        due = db.list_enabled_push_topics(user_ids)
+    else:
+        return
+
+    # 先把到期使用者反轉成 主題 → 使用者，每個主題只抓一次
+    topic_users = {}
+    for uid, topics in due.items():
+        for topic in topics:
+            topic_users.setdefault(topic, []).append(uid)
+    count = PUSH_FETCH_COUNT
+    fetched, hits = [], set()
+
+    def fetch(topics):
+        fetched.extend(topics)
+        return fetch_topics(topics, count=count, hits=hits)
+
+    if ingest.NEWS_INGEST:
+        news_by_topic = ingest.latest(topic_users, count, fetch)
+    else:
+        news_by_topic = fetch(list(topic_users))
+    # 預抓命中率：這個時段有預抓時，發送當下要抓的主題中有幾個直接命中快取
+    if prefetched_topics.pop(push_time, None) is not None:
+        scheduler_stats["prefetch_topics"] += len(fetched)
+        scheduler_stats["prefetch_hits"] += len(hits)
+
+    # 再用共用的抓取結果組每個人的輪播；內容相同的使用者歸成同一批，只產生一次 Flex
+    filters = seen.load(list(due)) if seen.DELIVERY_DEDUP else {}
+    # 這一輪抓到的新聞只分群一次，每位使用者合併時查表
+    clusters = merge.cluster_index(news_by_topic) if merge.NEWS_MERGE else None
+    groups = {}
+    for uid, topics in due.items():
+        if seen.DELIVERY_DEDUP:
+            articles = seen.unseen_articles(filters[uid], topics, news_by_topic, 3)
+        else:
+            articles = [(topic, n) for topic in topics for n in news_by_topic.get(topic, [])]
+        if clusters is not None:
+            articles = merge.merge_articles(articles, clusters)
+        if articles:
+            key = tuple((topic, n["url"], n["title"]) for topic, n in articles)
+            groups.setdefault(key, (articles, []))[1].append(uid)
+    if not groups:
+        return
+    batches = [(build_carousel_messages(articles, "定時新聞推播"), uids)
+               for articles, uids in groups.values()]
+
+    # 共用常駐的 API client，相同內容合併 multicast
+    delivered = []
+    last_delivery_report = deliver(get_messaging_api(), batches, delivered)
+
+    # 送達的使用者記下這次的新聞，整批一個 statement 寫回
+    if seen.DELIVERY_DEDUP and delivered:
+        delivered = set(delivered)
+        updated = {}
+        for articles, uids in groups.values():
+            for uid in uids:
+                if uid in delivered:
+                    seen.mark(filters[uid], articles)
+                    updated[uid] = filters[uid]
+        seen.save(updated)
+
+def _run_slot(slot):
+    # 發送某一分鐘的推播，並記錄相對於該分鐘的排程延遲
+    lag = (datetime.now() - slot).total_seconds()
+    scheduler_stats["ticks"] += 1
+    scheduler_stats["lag_last"] = lag
+    scheduler_stats["lag_max"] = max(scheduler_stats["lag_max"], lag)
+    owned, gained = coordinator.acquire()
+    if gained and not coordinator.standalone:
+        # 接手了其他 worker 的分片，時間輪與 DB 對帳（預抓用）
+        push_wheel.load(db.list_push_schedule())
+    minute = slot.hour * 60 + slot.minute
+    push_time = format_minute(minute)
+    # 到期名單以 DB 為準：時間輪只即時反映本行程寫入的設定，共用同一個 DB 的其他行程
+    # （包括各自視為單機的 SQLite worker）剛設定的時間也不會因為別的行程先 claim 而漏送
+    due = db.list_due_pushes(push_time) if owned else {}
+    user_ids = list(due)
+    if user_ids and owned:
+        # 只發送自己負責、且這一分鐘還沒有其他 worker 發送過的分片
+        claimed = set(db.claim_push_slots(sorted(owned), slot.strftime("%Y-%m-%d %H:%M")))
+        if len(claimed) < coordinator.shards:
+            user_ids = [uid for uid in user_ids if coordinator.shard_of(uid) in claimed]
+    else:
+        user_ids = []
+    scheduler_stats["due_users_last"] = len(user_ids)
+    metrics.inc("scheduler_due_users_total", len(user_ids))
+    if not user_ids:
+        prefetched_topics.pop(push_time, None)
+        return
+    with metrics.timer("scheduler_tick_seconds"):
+        send_scheduled_news(push_time, user_ids, due)
+    # 發送完成時間相對於使用者設定時間的延遲
+    delay = (datetime.now() - slot).total_seconds()
+    scheduler_stats["delivery_delay_last"] = delay
+    scheduler_stats["delivery_delay_max"] = max(scheduler_stats["delivery_delay_max"], delay)
+
+def _prefetch_upcoming(next_slot):
+    # 預看接下來 PUSH_PREFETCH_MINUTES 分鐘到期的主題，在背景先把新聞抓進快取
+    # （有背景匯入時新聞已在資料庫，不需要預抓）
+    if ingest.NEWS_INGEST:
+        return
+    for i in range(PUSH_PREFETCH_MINUTES):
+        slot = next_slot + timedelta(minutes=i)
+        key = format_minute(slot.hour * 60 + slot.minute)
+        if key in prefetched_topics:
+            continue
+        user_ids = push_wheel.due(slot.hour * 60 + slot.minute)
+        if not coordinator.standalone:
+            owned = coordinator.owned()
+            user_ids = [uid for uid in user_ids if coordinator.shard_of(uid) in owned]
+        if not user_ids:
+            continue
+        topics = set()
+        for ts in db.list_enabled_push_topics(user_ids).values():
+            topics.update(ts)
+        prefetched_topics[key] = topics
+        # 快取至少要撐到該分鐘發送完畢
+        valid_until = time.monotonic() + (slot - datetime.now()).total_seconds() + 60
+        _prefetcher.submit(fetch_topics, list(topics), valid_until, PUSH_FETCH_COUNT)
+
+def start_push_scheduler():
+    # 啟動時載入一次時間輪，之後由推播設定的 postback 增量更新
+    push_wheel.load(db.list_push_schedule())
+    coordinator.acquire()
+    last_resync = time.monotonic()
+    next_slot = datetime.now().replace(second=0, microsecond=0) + timedelta(minutes=1)
+    rebalanced = False
+    if PUSH_PREFETCH_MINUTES:
+        _prefetch_upcoming(next_slot)
+    while True:
+        # 睡到下一個整分；多 worker 時在整分前 PUSH_REBALANCE_LEAD 秒釋放超額分片
+        wait = (next_slot - datetime.now()).total_seconds()
+        if wait > 0:
+            if not rebalanced and wait > PUSH_REBALANCE_LEAD:
+                time.sleep(wait - PUSH_REBALANCE_LEAD)
+                coordinator.rebalance()
+                rebalanced = True
+                continue
+            time.sleep(wait)
+            continue
+        rebalanced = False
+
+        # 落後太多時只補最近 PUSH_CATCHUP_MINUTES 分鐘，更早的直接略過
+        now = datetime.now()
+        oldest = now.replace(second=0, microsecond=0) - timedelta(minutes=PUSH_CATCHUP_MINUTES)
+        if next_slot < oldest:
+            scheduler_stats["skipped_minutes"] += int((oldest - next_slot).total_seconds() // 60)
+            next_slot = oldest
+        while next_slot <= now:
+            if next_slot.minute != now.minute or next_slot.hour != now.hour:
+                scheduler_stats["caught_up_minutes"] += 1
+            try:
+                _run_slot(next_slot)
+            except Exception:
+                scheduler_stats["errors"] += 1
+            next_slot += timedelta(minutes=1)
+
+        if PUSH_PREFETCH_MINUTES:
+            try:
+                _prefetch_upcoming(next_slot)
+            except Exception:
+                scheduler_stats["errors"] += 1
+
+        # 定期與 DB 對帳，涵蓋其他行程寫入的設定
+        if PUSH_WHEEL_RESYNC and time.monotonic() - last_resync >= PUSH_WHEEL_RESYNC:
+            try:
+                push_wheel.load(db.list_push_schedule())
+            except Exception:
+                scheduler_stats["errors"] += 1
+            last_resync = time.monotonic()
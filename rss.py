@@ -0,0 +1,271 @@
+# rss.py
+# Google News RSS 抓取 + 主題層級的共用快取
+import os
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+import xml.etree.ElementTree as ET
+
+import metrics
+
+# 快取設定（可由環境變數調整）
+NEWS_CACHE_TTL  = float(os.getenv("NEWS_CACHE_TTL", "60"))   # 秒
+NEWS_CACHE_SIZE = int(os.getenv("NEWS_CACHE_SIZE", "256"))   # 最多保留幾組 (topic, count)
+RSS_BASE_URL    = os.getenv("RSS_BASE_URL", "https://news.google.com/rss/")  # 壓測時可指向 mock server
+RSS_TIMEOUT     = float(os.getenv("RSS_TIMEOUT", "5"))
+RSS_MAX_BYTES   = int(os.getenv("RSS_MAX_BYTES", str(2 * 1024 * 1024)))  # 單次最多讀幾 bytes
+RSS_CHUNK_SIZE  = 16 * 1024
+RSS_DRAIN_MAX   = int(os.getenv("RSS_DRAIN_MAX", str(256 * 1024)))  # 解析完後最多再讀幾 bytes 以保留連線
+RSS_POOL_SIZE   = int(os.getenv("RSS_POOL_SIZE", "10"))
+RSS_VALIDATOR_SIZE = int(os.getenv("RSS_VALIDATOR_SIZE", "1024"))   # 最多記住幾個 URL 的 ETag
+
+def build_rss_url(topic):
+    return (
+        f"{RSS_BASE_URL}"
+        f"search?q={quote(topic)}"
+        "&hl=zh-TW&gl=TW&ceid=TW:zh-Hant"
+    )
+
+def parse_pubdate(text):
+    """RSS 的 pubDate（RFC 822）轉成 epoch 秒，無法解析時回傳 None"""
+    if not text:
+        return None
+    try:
+        return parsedate_to_datetime(text.strip()).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+def parse_items(chunks, count, max_bytes=None):
+    """
+    以串流方式解析 RSS：一邊讀 chunk 一邊解析，拿到 count 則 <item> 就停，
+    超過 max_bytes 也停止讀取，回傳目前已解析的新聞。
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    path = []   # 目前開著的元素（用來找 <item> 的父節點）
+    news_list = []
+    read = 0
+    for chunk in chunks:
+        if not chunk:
+            continue
+        read += len(chunk)
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == "start":
+                path.append(elem)
+                continue
+            path.pop()
+            if elem.tag != "item":
+                continue
+            news_list.append({"title": elem.findtext('title', default='').strip(),
+                              "url":   elem.findtext('link',  default='').strip(),
+                              "published": parse_pubdate(elem.findtext('pubDate'))})
+            # 用完就從 <channel> 拿掉並釋放：只 clear 的話空元素仍掛在樹上，隨則數成長
+            if path:
+                path[-1].remove(elem)
+            elem.clear()
+            if len(news_list) >= count:
+                return news_list
+        if max_bytes and read >= max_bytes:
+            break
+    return news_list
+
+def _count_bytes(chunks):
+    for chunk in chunks:
+        with _http_lock:
+            http_stats_counters["bytes"] += len(chunk)
+        yield chunk
+
+@metrics.timed("rss_http_seconds")
+def _download_news(topic, count):
+    # 失敗時直接丟例外，交給快取決定（失敗結果不快取）
+    url = build_rss_url(topic)
+    with _http_lock:
+        v = _validators.get(url)
+        if v is not None:
+            _validators.move_to_end(url)
+    headers = {}
+    # 上次存的結果夠用時才帶 validator，304 直接沿用上次解析結果
+    if v is not None and v["count"] >= count:
+        if v["etag"]:
+            headers["If-None-Match"] = v["etag"]
+        if v["last_modified"]:
+            headers["If-Modified-Since"] = v["last_modified"]
+
+    with _session.get(url, headers=headers, timeout=RSS_TIMEOUT, stream=True) as r:
+        with _http_lock:
+            http_stats_counters["requests"] += 1
+        if r.status_code == 304 and headers:
+            with _http_lock:
+                http_stats_counters["status_304"] += 1
+            return v["items"][:count]
+        r.raise_for_status()
+        with _http_lock:
+            http_stats_counters["status_200"] += 1
+
+        chunks = _count_bytes(r.iter_content(chunk_size=RSS_CHUNK_SIZE))
+        items = parse_items(chunks, count, RSS_MAX_BYTES)
+        # 剩下的內容不多就讀完，連線才能放回連線池重用
+        drained = 0
+        for chunk in chunks:
+            drained += len(chunk)
+            if drained > RSS_DRAIN_MAX:
+                break
+        etag, last_modified = r.headers.get("ETag"), r.headers.get("Last-Modified")
+
+    if etag or last_modified:
+        with _http_lock:
+            _validators[url] = {"etag": etag, "last_modified": last_modified,
+                                "items": items, "count": count}
+            _validators.move_to_end(url)
+            while len(_validators) > RSS_VALIDATOR_SIZE:
+                _validators.popitem(last=False)
+    return items
+
+
+# 共用的 HTTP session（keep-alive 連線池）與每個 URL 的 ETag / Last-Modified
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=RSS_POOL_SIZE))
+_http_lock = threading.Lock()
+_validators = OrderedDict()   # url -> {"etag", "last_modified", "items", "count"}
+http_stats_counters = {"requests": 0, "status_200": 0, "status_304": 0, "bytes": 0}
+
+def http_stats():
+    """RSS HTTP 統計：200 / 304 次數、傳輸 bytes、新建與重用的連線數"""
+    with _http_lock:
+        s = dict(http_stats_counters)
+        s["validators"] = len(_validators)
+    created = 0
+    for adapter in set(_session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                created += pool.num_connections
+    s["connections_created"] = created
+    s["connections_reused"] = max(s["requests"] - created, 0)
+    return s
+
+
+class _Call:
+    # 正在進行中的抓取，其他同 key 的請求等它完成後共用結果
+    def __init__(self):
+        self.done   = threading.Event()
+        self.result = None
+        self.error  = None
+
+
+class NewsCache:
+    """
+    以 (topic, count) 為 key 的 TTL + LRU 快取。
+    同一個 key 同時只會有一個 HTTP 請求（single-flight），其餘請求等待共用結果。
+    """
+
+    def __init__(self, loader, ttl=60, maxsize=256):
+        self._loader  = loader
+        self.ttl      = ttl
+        self.maxsize  = max(maxsize, 1)
+        self._lock    = threading.Lock()
+        self._entries = OrderedDict()   # key -> (expires_at, items)
+        self._inflight = {}             # key -> _Call
+        self._stats = {
+            "hits": 0, "misses": 0, "shared": 0, "evictions": 0,
+            "fetches": 0, "fetch_errors": 0,
+            "fetch_time_total": 0.0, "fetch_time_max": 0.0,
+        }
+
+    def get(self, topic, count, valid_until=None):
+        """
+        valid_until（time.monotonic() 時間）：要求結果至少要有效到這個時間點，
+        預抓時用來確保到了推播時間快取還沒過期。
+        """
+        return self.lookup(topic, count, valid_until)[0]
+
+    def lookup(self, topic, count, valid_until=None):
+        """同 get，回傳 (items, hit)：hit 表示直接由快取提供，沒有等待任何抓取"""
+        key = (topic, count)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > max(time.monotonic(), valid_until or 0):
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[1], True
+            self._stats["misses"] += 1
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+            else:
+                self._stats["shared"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, False
+
+        start = time.monotonic()
+        try:
+            call.result = self._loader(topic, count)
+        except Exception as e:
+            call.error = e
+        elapsed = time.monotonic() - start
+
+        with self._lock:
+            self._stats["fetches"] += 1
+            self._stats["fetch_time_total"] += elapsed
+            self._stats["fetch_time_max"] = max(self._stats["fetch_time_max"], elapsed)
+            if call.error is None:
+                expires_at = max(time.monotonic() + self.ttl, valid_until or 0)
+                self._entries[key] = (expires_at, call.result)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self._stats["evictions"] += 1
+            else:
+                self._stats["fetch_errors"] += 1
+            del self._inflight[key]
+        call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result, False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s["size"] = len(self._entries)
+        s["fetch_time_avg"] = s["fetch_time_total"] / s["fetches"] if s["fetches"] else 0.0
+        lookups = s["hits"] + s["misses"]
+        s["hit_ratio"] = s["hits"] / lookups if lookups else 0.0
+        return s
+
+
+news_cache = NewsCache(_download_news, ttl=NEWS_CACHE_TTL, maxsize=NEWS_CACHE_SIZE)
+
+def fetch_google_news(topic, count=3, valid_until=None):
+    return fetch_cached(topic, count, valid_until)[0]
+
+@metrics.timed("news_fetch_seconds")
+def fetch_cached(topic, count=3, valid_until=None):
+    """經快取抓新聞，回傳 (items, hit)；失敗時回傳 ([], False)"""
+    try:
+        return news_cache.lookup(topic, count, valid_until)
+    except Exception:
+        return [], False
+
+def fetch_feed(topic, count):
+    """不經快取直接抓 RSS（背景匯入用，仍會帶 ETag），失敗時丟例外"""
+    return _download_news(topic, count)
+
+def cache_stats():
+    """新聞快取命中 / 未命中 / 抓取延遲等統計"""
+    return news_cache.stats()
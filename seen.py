@@ -0,0 +1,113 @@
+# seen.py
+# 每位使用者「已送過的新聞」紀錄：兩代輪替的 Bloom filter，存在 DB，
+# 組輪播時略過已送過的新聞，發送完成後一次寫回
+import os
+import math
+import hashlib
+
+import db
+
+# 設定（可由環境變數調整）
+DELIVERY_DEDUP       = os.getenv("DELIVERY_DEDUP", "0") == "1"              # 略過已送過的新聞（預設關閉）
+DELIVERY_BLOOM_BYTES = int(os.getenv("DELIVERY_BLOOM_BYTES", "256"))    # 每位使用者每一代的大小
+DELIVERY_BLOOM_FP    = float(os.getenv("DELIVERY_BLOOM_FP", "0.01"))    # 每一代滿載時的誤判率
+DELIVERY_CANDIDATES  = int(os.getenv("DELIVERY_CANDIDATES", "10"))      # 每個主題讀幾則候選新聞
+
+
+def bloom_params(nbytes, fp):
+    """回傳 (bits, 雜湊次數 k, 每一代容量)"""
+    bits = max(nbytes, 1) * 8
+    capacity = max(int(bits * math.log(2) ** 2 / -math.log(fp)), 1)
+    k = max(round(bits / capacity * math.log(2)), 1)
+    return bits, k, capacity
+
+
+class RollingBloom:
+    """
+    兩代 Bloom filter：目前這代放滿 capacity 則後變成上一代，再開新的一代。
+    至少記得最近 capacity 則，最多 2 × capacity 則；查詢兩代都看，
+    所以實際誤判率最多約為設定值的兩倍。
+    存 DB 時為 current + previous 兩段 bytes 加上目前這代的筆數。
+    """
+    __slots__ = ("bits", "k", "capacity", "count", "current", "previous")
+
+    def __init__(self, nbytes=256, fp=0.01, data=None, count=0):
+        self.bits, self.k, self.capacity = bloom_params(nbytes, fp)
+        size = self.bits // 8
+        if data is not None and len(data) == 2 * size:
+            self.current, self.previous = bytearray(data[:size]), bytearray(data[size:])
+            self.count = count
+        else:
+            # 沒有紀錄或設定改過（大小不合），從頭開始
+            self.current, self.previous = bytearray(size), bytearray(size)
+            self.count = 0
+
+    def _positions(self, key):
+        d = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(d[:8], "little")
+        h2 = int.from_bytes(d[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.k)]
+
+    @staticmethod
+    def _has(bits, positions):
+        for p in positions:
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def __contains__(self, key):
+        positions = self._positions(key)
+        return self._has(self.current, positions) or self._has(self.previous, positions)
+
+    def add(self, key):
+        """加入一則；已經在裡面時回傳 False"""
+        positions = self._positions(key)
+        if self._has(self.current, positions) or self._has(self.previous, positions):
+            return False
+        if self.count >= self.capacity:
+            self.previous, self.current = self.current, bytearray(len(self.current))
+            self.count = 0
+        for p in positions:
+            self.current[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+        return True
+
+    def to_bytes(self):
+        return bytes(self.current) + bytes(self.previous)
+
+
+def new_filter(data=None, count=0):
+    return RollingBloom(DELIVERY_BLOOM_BYTES, DELIVERY_BLOOM_FP, data, count)
+
+def article_key(n):
+    return n["url"]
+
+def load(user_ids):
+    """一次查詢讀出多位使用者的紀錄，回傳 { user_id: RollingBloom }（沒有紀錄的給空的）"""
+    rows = db.load_delivered(user_ids) if user_ids else {}
+    return {uid: new_filter(*rows[uid]) if uid in rows else new_filter() for uid in user_ids}
+
+def save(filters):
+    """filters: { user_id: RollingBloom }，一個 statement 寫回"""
+    if filters:
+        db.save_delivered([(uid, f.to_bytes(), f.count) for uid, f in filters.items()])
+
+def unseen_articles(bloom, topics, news_by_topic, per_topic=3):
+    """依主題順序挑出還沒送過的新聞，每個主題最多 per_topic 則"""
+    articles = []
+    for topic in topics:
+        picked = 0
+        for n in news_by_topic.get(topic, []):
+            if picked >= per_topic:
+                break
+            if article_key(n) not in bloom:
+                articles.append((topic, n))
+                picked += 1
+    return articles
+
+def mark(bloom, articles):
+    for _topic, n in articles:
+        bloom.add(article_key(n))
+        # 合併成同一個 bubble 的其他網址也算送過
+        for url in n.get("merged_urls", ()):
+            bloom.add(url)
@@ -0,0 +1,21 @@
+# conftest.py
+# 測試共用設定：從 repo 根目錄 import 模組；沒有指定 DATABASE_URL 時用記憶體 SQLite
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+
+@pytest.fixture
+def push_state():
+    """清空推播設定與各分片已發送的時段"""
+    import db
+    db.init_db()
+    with db.get_conn() as conn:
+        cur = conn.cursor()
+        for table in ("push_shard_state", "push_schedule", "push_topics"):
+            cur.execute(f"DELETE FROM {table}")
+        conn.commit()
@@ -0,0 +1,179 @@
+# test_cluster.py
+# 推播分片協調：多個 ShardCoordinator 共用同一組 advisory lock。
+#   fake：記憶體中模擬 Postgres session 層級的 advisory lock（一定會跑）
+#   postgres：DATABASE_URL 指向 Postgres 時用真的 pg_advisory_lock
+import random
+import threading
+from datetime import datetime
+
+import pytest
+
+import db
+import cluster
+import pushs
+
+
+class _FakeSession:
+    def __init__(self, server):
+        self.server = server
+        self.closed = False
+
+    def close(self):
+        # 連線中斷時 session 持有的鎖全部釋放
+        with self.server.lock:
+            self.closed = True
+            for key, holder in list(self.server.exclusive.items()):
+                if holder is self:
+                    del self.server.exclusive[key]
+            for holders in self.server.shared.values():
+                holders.discard(self)
+
+
+class FakeLockServer:
+    """pg_try_advisory_lock / pg_advisory_unlock / pg_advisory_lock_shared 的最小模擬"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.exclusive = {}   # (key, n) -> session
+        self.shared = {}      # (key, n) -> {session, ...}
+
+    def _check(self, conn):
+        if conn.closed:
+            raise ConnectionError("session closed")
+
+    def open_lock_session(self):
+        return _FakeSession(self)
+
+    def try_lock(self, conn, key, n):
+        with self.lock:
+            self._check(conn)
+            holder = self.exclusive.get((key, n))
+            if holder is not None and holder is not conn:
+                return False
+            self.exclusive[(key, n)] = conn
+            return True
+
+    def unlock(self, conn, key, n):
+        with self.lock:
+            self._check(conn)
+            if self.exclusive.get((key, n)) is conn:
+                del self.exclusive[(key, n)]
+                return True
+            return False
+
+    def lock_shared(self, conn, key, n):
+        with self.lock:
+            self._check(conn)
+            self.shared.setdefault((key, n), set()).add(conn)
+
+    def count_lock_holders(self, conn, key, n):
+        with self.lock:
+            self._check(conn)
+            return len(self.shared.get((key, n), ()))
+
+
+@pytest.fixture(params=["fake", "postgres"])
+def locks(request, monkeypatch):
+    if request.param == "postgres":
+        if not db.SUPPORTS_ADVISORY_LOCKS:
+            pytest.skip("DATABASE_URL 沒有指向 Postgres")
+        return
+    server = FakeLockServer()
+    monkeypatch.setattr(db, "SUPPORTS_ADVISORY_LOCKS", True, raising=False)
+    for name in ("open_lock_session", "try_lock", "unlock", "lock_shared", "count_lock_holders"):
+        monkeypatch.setattr(db, name, getattr(server, name), raising=False)
+
+
+def _members(n, shards=8):
+    key = random.randrange(1 << 30)   # 每個測試各自的鎖，不受同一資料庫上其他測試影響
+    return [cluster.ShardCoordinator(shards=shards, key=key, retry=0) for _ in range(n)]
+
+def _join(members):
+    # 都加入後再 rebalance，釋放出的分片由其他成員補上
+    for m in members:
+        m.acquire()
+    for m in members:
+        m.rebalance()
+    for m in members:
+        m.acquire()
+
+def _close(member):
+    member._close(member._conn)
+
+
+def test_members_split_shards(locks):
+    a, b = _members(2)
+    try:
+        assert not a.standalone
+        owned_a, gained_a = a.acquire()
+        assert owned_a == gained_a == set(range(8))   # 只有一個成員時拿全部
+        assert b.acquire() == (set(), set())          # 全被 a 持有
+        a.rebalance()                                  # 兩個成員，公平份額 4
+        assert len(a.owned()) == 4
+        owned_b, _ = b.acquire()
+        assert len(owned_b) == 4
+        assert owned_b.isdisjoint(a.owned())
+        assert owned_b | a.owned() == set(range(8))
+        assert a.stats()["members"] == b.stats()["members"] == 2
+    finally:
+        _close(a)
+        _close(b)
+
+
+def test_three_members_fair_share(locks):
+    members = _members(3, shards=16)
+    try:
+        _join(members)
+        owned = [m.owned() for m in members]
+        assert sum(len(o) for o in owned) == 16
+        assert all(len(o) <= 6 for o in owned)        # ceil(16 / 3)
+        assert set().union(*owned) == set(range(16))
+    finally:
+        for m in members:
+            _close(m)
+
+
+def test_failover_after_session_closes(locks):
+    a, b = _members(2)
+    try:
+        _join([a, b])
+        lost = a.owned()
+        assert len(lost) == 4
+        _close(a)                                      # a 的行程死掉，鎖跟著釋放
+        owned_b, gained_b = b.acquire()
+        assert b.stats()["members"] == 1
+        assert gained_b == lost
+        assert owned_b == set(range(8))
+    finally:
+        _close(b)
+
+
+def test_claim_prevents_second_send(locks, push_state, monkeypatch):
+    users = [f"Ucluster{i:03d}" for i in range(40)]
+    for uid in users:
+        db.set_push_choices(uid, {"颱風": True})
+        db.set_push_time(uid, "06:00")
+    sent = []
+    monkeypatch.setattr(pushs, "send_scheduled_news",
+                        lambda push_time, user_ids, due: sent.append(set(user_ids)))
+    slot = datetime(2030, 1, 1, 6, 0)
+
+    a, b = _members(2, shards=pushs.coordinator.shards)
+    try:
+        _join([a, b])
+        for member in (a, b):
+            monkeypatch.setattr(pushs, "coordinator", member)
+            pushs._run_slot(slot)
+        assert len(sent) == 2 and sent[0].isdisjoint(sent[1])
+        assert sent[0] | sent[1] == set(users)
+        assert all(a.shard_of(uid) in a.owned() for uid in sent[0])
+
+        # a 死掉後 b 接手全部分片，同一分鐘重跑：全部分片都已發送過，不會再送
+        _close(a)
+        b.acquire()
+        assert b.owned() == set(range(b.shards))
+        pushs._run_slot(slot)
+        assert len(sent) == 2
+    finally:
+        _close(a)
+        _close(b)
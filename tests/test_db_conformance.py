@@ -0,0 +1,248 @@
+# test_db_conformance.py
+# 儲存後端一致性測試：同一組測試跑在每個後端上
+#   SQLite 一定會跑（記憶體資料庫）；DATABASE_URL 指向 Postgres 時也跑 Postgres
+import os
+import time
+import importlib
+from urllib.parse import urlparse
+
+import pytest
+
+TABLES = ["subscriptions", "push_topics", "push_schedule", "push_shard_state",
+          "news_articles", "delivered_filters"]
+
+
+def _sqlite():
+    module = importlib.import_module("db_sqlite")
+    if module._path is None:
+        module.configure(urlparse("sqlite:///:memory:"))
+    return module
+
+def _postgres():
+    url = urlparse(os.getenv("DATABASE_URL", ""))
+    if url.scheme not in ("postgres", "postgresql"):
+        pytest.skip("DATABASE_URL 沒有指向 Postgres")
+    module = importlib.import_module("db_postgres")
+    module.configure(url)
+    return module
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def backend(request):
+    module = _sqlite() if request.param == "sqlite" else _postgres()
+    module.init_db()
+    with module.get_conn() as conn:
+        cur = conn.cursor()
+        for table in TABLES:
+            cur.execute(f"DELETE FROM {table}")
+        conn.commit()
+    return module
+
+
+def _article(n, published):
+    return {"id": f"id{n}", "title_hash": f"th{n}", "title": f"標題{n}",
+            "url": f"https://news.example.com/{n}", "published": published}
+
+
+def test_init_db_is_idempotent(backend):
+    backend.init_db()
+    assert backend.list_subscriptions("nobody") == []
+
+
+def test_get_conn_commits_on_exit(backend):
+    with backend.get_conn() as conn:
+        conn.cursor().execute("INSERT INTO subscriptions(user_id, topic) VALUES('ugc', '颱風')")
+    with backend.get_conn() as conn:
+        conn.rollback()   # 上一個區塊若沒有 commit，借到同一條連線時就會在這裡丟掉
+    assert backend.list_subscriptions("ugc") == ["颱風"]
+
+
+def test_get_conn_rolls_back_on_error(backend):
+    with pytest.raises(RuntimeError):
+        with backend.get_conn() as conn:
+            conn.cursor().execute("INSERT INTO subscriptions(user_id, topic) VALUES('ugc', '地震')")
+            raise RuntimeError("boom")
+    assert backend.list_subscriptions("ugc") == []
+
+
+def test_subscriptions(backend):
+    backend.add_subscription("u1", "颱風")
+    backend.add_subscription("u1", "地震")
+    backend.add_subscription("u2", "地震")
+    assert sorted(backend.list_subscriptions("u1")) == ["地震", "颱風"]
+    backend.remove_subscription("u1", "颱風")
+    assert backend.list_subscriptions("u1") == ["地震"]
+    assert sorted(backend.list_subscribed_topics()) == ["地震"]
+    assert backend.count_topic_subscribers() == {"地震": 2}
+
+
+def test_push_settings(backend):
+    backend.set_push_choice("u1", "颱風", True)
+    backend.set_push_choice("u1", "地震", False)
+    assert backend.list_push_topics("u1") == {"颱風": True, "地震": False}
+    backend.set_push_time("u1", "08:30")
+    assert backend.get_push_time("u1") == "08:30"
+    backend.set_push_time("u1", "09:00")
+    assert backend.list_push_schedule() == {"u1": "09:00"}
+    assert backend.list_due_pushes("09:00") == {"u1": ["颱風"]}
+    assert backend.list_due_pushes("08:30") == {}
+    assert backend.list_enabled_push_topics(["u1", "u2"]) == {"u1": ["颱風"]}
+    backend.set_push_time("u1", None)
+    assert backend.get_push_time("u1") is None
+
+
+def test_enabled_push_topics_many_users(backend):
+    users = [f"u{i}" for i in range(1200)]   # 超過 SQLite 單批參數上限
+    for uid in users:
+        backend.set_push_choices(uid, {"颱風": True})
+    assert len(backend.list_enabled_push_topics(users)) == len(users)
+
+
+def test_claim_push_slots(backend):
+    assert sorted(backend.claim_push_slots([0, 1, 2], "2024-06-01 08:00")) == [0, 1, 2]
+    assert backend.claim_push_slots([0, 1, 2], "2024-06-01 08:00") == []
+    assert backend.claim_push_slots([1], "2024-06-01 08:01") == [1]
+    assert backend.claim_push_slots([1], "2024-06-01 07:59") == []
+
+
+def test_articles(backend):
+    now = time.time()
+    rows = [_article(i, now - i) for i in range(5)]
+    assert backend.save_articles("颱風", rows, now) == 5
+    # 同網址或同標題都算重複
+    dup = dict(_article(9, now), title_hash="th0")
+    assert backend.save_articles("颱風", rows + [dup], now) == 0
+    latest = backend.latest_articles(["颱風", "地震"], 3)
+    assert list(latest) == ["颱風"]
+    assert [a["title"] for a in latest["颱風"]] == ["標題0", "標題1", "標題2"]
+    assert backend.save_matched_articles({"山陀兒": rows[:2], "颱風": rows[:1]}, now) == 2
+    assert len(backend.latest_articles(["山陀兒"], 10)["山陀兒"]) == 2
+    assert set(backend.recent_titles(now - 2.5)) == {"標題0", "標題1", "標題2"}
+    # 依匯入時間清除：早就匯入的舊新聞清掉，剛匯入的不論發布時間都保留
+    old = [_article(i, now - 86400 * 30) for i in range(20, 22)]
+    assert backend.save_articles("地震", old, now - 86400 * 10) == 2
+    assert backend.purge_articles(now - 86400 * 7) == 2
+    assert "地震" not in backend.latest_articles(["地震"], 10)
+    assert len(backend.latest_articles(["颱風"], 10)["颱風"]) == 5
+
+
+def test_delivered_filters(backend):
+    backend.save_delivered([("u1", b"\x01\x02", 2), ("u2", b"\x03", 1)])
+    backend.save_delivered([("u1", b"\x04", 3)])
+    assert backend.load_delivered(["u1", "u2", "u3"]) == {"u1": (b"\x04", 3), "u2": (b"\x03", 1)}
+    assert backend.load_delivered([]) == {}
+
+
+def test_topic_pairs(backend):
+    backend.add_subscriptions("u1", ["颱風", "地震", "海嘯"])
+    backend.add_subscriptions("u2", ["颱風", "地震"])
+    pairs = {(a, b): n for a, b, n in backend.list_topic_pairs(1)}
+    assert pairs[tuple(sorted(["颱風", "地震"]))] == 2
+    assert len(pairs) == 3
+    assert len(backend.list_topic_pairs(2)) == 1
+
+
+def test_add_subscriptions_batch(backend):
+    assert backend.add_subscriptions("u1", ["颱風", "地震", "AT&T"]) == sorted(["颱風", "地震", "AT&T"])
+    # 重複新增不會重複，回傳完整清單
+    assert backend.add_subscriptions("u1", ["地震", "海嘯"]) == sorted(["颱風", "地震", "AT&T", "海嘯"])
+    assert backend.add_subscriptions("u1", ["地震"]) == backend.list_subscriptions("u1")
+    assert backend.add_subscriptions("u1", []) == sorted(["颱風", "地震", "AT&T", "海嘯"])
+    assert backend.list_subscriptions("u2") == []
+
+
+def test_remove_subscriptions_batch(backend):
+    backend.add_subscriptions("u1", ["颱風", "地震", "海嘯"])
+    backend.add_subscriptions("u2", ["颱風"])
+    assert backend.remove_subscriptions("u1", ["颱風", "不存在"]) == sorted(["地震", "海嘯"])
+    # 再刪一次結果不變
+    assert backend.remove_subscriptions("u1", ["颱風"]) == sorted(["地震", "海嘯"])
+    assert backend.remove_subscriptions("u1", ["地震", "海嘯"]) == []
+    assert backend.list_subscriptions("u2") == ["颱風"]
+
+
+def test_subscription_order_is_stable(backend):
+    topics = ["颱風", "b", "地震", "A", "海嘯", "火災"]
+    for t in topics:
+        backend.add_subscriptions("u1", [t])
+    expected = sorted(topics)
+    assert backend.list_subscriptions("u1") == expected
+    assert backend.add_subscriptions("u1", ["颱風"]) == expected
+    assert backend.remove_subscriptions("u1", ["b"]) == [t for t in expected if t != "b"]
+
+
+def test_push_topic_order_is_stable(backend):
+    topics = ["颱風", "b", "地震", "A", "海嘯"]
+    backend.set_push_choices("u1", {t: True for t in topics})
+    backend.set_push_time("u1", "07:00")
+    assert backend.list_due_pushes("07:00") == {"u1": sorted(topics)}
+    assert backend.list_enabled_push_topics(["u1"]) == {"u1": sorted(topics)}
+
+
+def test_set_push_choices_batch(backend):
+    assert backend.set_push_choices("u1", {"颱風": True, "地震": False}) == {"颱風": True, "地震": False}
+    # 覆寫既有設定並新增，回傳完整設定
+    result = backend.set_push_choices("u1", {"地震": True, "海嘯": True})
+    assert result == {"颱風": True, "地震": True, "海嘯": True}
+    assert list(result) == sorted(result)
+    assert backend.set_push_choices("u1", {"颱風": False}) == backend.list_push_topics("u1")
+    assert backend.list_push_topics("u1")["颱風"] is False
+    assert backend.list_push_topics("u2") == {}
+
+
+def test_capability_flags(backend):
+    assert isinstance(backend.SUPPORTS_NOTIFY, bool)
+    assert isinstance(backend.SUPPORTS_ADVISORY_LOCKS, bool)
+    # 不支援的能力不匯出對應的操作
+    if not backend.SUPPORTS_NOTIFY:
+        assert not {"notify", "open_listener", "poll_notifications"} & set(backend.__all__)
+    if not backend.SUPPORTS_ADVISORY_LOCKS:
+        assert not {"open_lock_session", "try_lock", "unlock"} & set(backend.__all__)
+    if backend.__name__ == "db_sqlite":
+        assert not backend.SUPPORTS_NOTIFY and not backend.SUPPORTS_ADVISORY_LOCKS
+
+
+def test_standalone_coordinator_owns_all_shards():
+    import db
+    import cluster
+    if db.SUPPORTS_ADVISORY_LOCKS:
+        pytest.skip("後端支援 advisory lock")
+    coordinator = cluster.ShardCoordinator(shards=4)
+    assert coordinator.standalone
+    assert coordinator.acquire() == ({0, 1, 2, 3}, set())
+
+
+class _FakePgConn:
+    def __init__(self):
+        self.calls = []
+
+    def commit(self):
+        self.calls.append("commit")
+
+    def rollback(self):
+        self.calls.append("rollback")
+
+
+class _FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+        self.released = []
+
+    def acquire(self):
+        return self.conn
+
+    def release(self, conn, discard=False):
+        self.released.append((list(conn.calls), discard))
+
+
+def test_postgres_get_conn_ends_transaction_before_release(monkeypatch):
+    # 不需要 Postgres：確認歸還連線池之前一定 commit 或 rollback
+    module = importlib.import_module("db_postgres")
+    pool = _FakePool(_FakePgConn())
+    monkeypatch.setattr(module, "_pool", pool)
+    with module.get_conn():
+        pass
+    with pytest.raises(RuntimeError):
+        with module.get_conn():
+            raise RuntimeError("boom")
+    assert pool.released == [(["commit"], False), (["commit", "rollback"], False)]
@@ -0,0 +1,62 @@
+# test_ingest.py
+import os
+import time
+
+import pytest
+
+import ingest
+
+
+def test_normalize_skips_items_older_than_retention():
+    now = time.time()
+    old = now - (ingest.NEWS_RETENTION_DAYS + 1) * 86400
+    items = [{"title": "舊新聞", "url": "https://news.example.com/old", "published": old},
+             {"title": "新新聞", "url": "https://news.example.com/new", "published": now - 60},
+             {"title": "沒有日期", "url": "https://news.example.com/undated", "published": None}]
+    rows = ingest.normalize(items, now)
+    assert [r["title"] for r in rows] == ["新新聞", "沒有日期"]
+    assert rows[1]["published"] == now
+
+
+def test_normalize_dedupes_by_url_and_title():
+    now = time.time()
+    items = [{"title": "颱風 來了", "url": "https://news.example.com/1#top", "published": now},
+             {"title": "颱風  來了", "url": "https://news.example.com/2", "published": now},
+             {"title": "另一則", "url": "https://news.example.com/1", "published": now}]
+    assert [r["url"] for r in ingest.normalize(items, now)] == ["https://news.example.com/1"]
+
+
+@pytest.mark.skipif("NEWS_FEED_TOPICS" in os.environ, reason="NEWS_FEED_TOPICS 已自訂")
+def test_feed_topics_default_to_all_topics():
+    import subscribetest
+    assert ingest.NEWS_FEED_TOPICS == subscribetest.ALL_TOPICS
+
+
+def test_covered_topic_is_paused_and_keeps_interval(monkeypatch):
+    ing = ingest.NewsIngester(min_interval=60, max_interval=1800, workers=1)
+    covered = {"山陀兒"}
+    monkeypatch.setattr(ingest.matcher, "KEYWORD_MATCH", True)
+    monkeypatch.setattr(ingest.matcher, "covered", lambda t, within: t in covered)
+    monkeypatch.setattr(ingest, "NEWS_FEED_TOPICS", ["颱風"])
+    monkeypatch.setattr(ingest.db, "list_subscribed_topics", lambda: ["山陀兒", "颱風"])
+
+    ing.track(["山陀兒"])
+    ing._topics["山陀兒"].interval = 900
+    ing._sync_topics()
+    assert ing._topics["山陀兒"].paused
+    due, _wait = ing._due(time.time() + 1)
+    assert due == ["颱風"]
+    assert ing.stats()["paused_topics"] == 1
+
+    # 不再被涵蓋：恢復輪詢，沿用原本的間隔
+    covered.clear()
+    ing._sync_topics()
+    state = ing._topics["山陀兒"]
+    assert not state.paused and state.interval == 900
+    due, _wait = ing._due(time.time() + 1)
+    assert due == ["山陀兒"]
+
+    # 沒人訂閱了才移除
+    monkeypatch.setattr(ingest.db, "list_subscribed_topics", lambda: [])
+    ing._sync_topics()
+    assert "山陀兒" not in ing._topics and "颱風" in ing._topics
@@ -0,0 +1,43 @@
+# test_postback.py
+import pytest
+
+import postback
+
+
+def test_parse_basic():
+    action = postback.parse("action=subscribe&topic=地震")
+    assert action.name == "subscribe"
+    assert action.params == {"topic": "地震"}
+
+
+@pytest.mark.parametrize("topic", ["AT&T", "a=b", "100%", "x&y=z%26", "地震"])
+def test_build_round_trip(topic):
+    data = postback.build("unsubscribe", topic=topic)
+    action = postback.parse(data)
+    assert action is not None
+    assert action.name == "unsubscribe"
+    assert action["topic"] == topic
+
+
+def test_build_keeps_cjk_short():
+    assert postback.build("subscribe", topic="颱風") == "action=subscribe&topic=颱風"
+
+
+def test_resolve_topic_with_ampersand():
+    import subscribetest  # noqa: F401  登記 subscribe / unsubscribe 路由
+    resolved = postback.resolve(postback.build("unsubscribe", topic="AT&T"))
+    assert resolved is not None
+    assert resolved[1]["topic"] == "AT&T"
+
+
+@pytest.mark.parametrize("data", [
+    "",
+    "topic=地震",
+    "action=",
+    "action=subscribe&topic",
+    "action=subscribe&topic=a&topic=b",
+    "action=x" + "&k=v" * 20,
+    "action=" + "x" * 400,
+])
+def test_parse_rejects_malformed(data):
+    assert postback.parse(data) is None
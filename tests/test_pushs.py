@@ -0,0 +1,20 @@
+# test_pushs.py
+from datetime import datetime
+
+import db
+import pushs
+
+
+def test_run_slot_reads_due_users_from_db(push_state, monkeypatch):
+    # 其他行程寫入的推播時間：本行程的時間輪不知道，仍要發送
+    db.set_push_choices("Uother", {"颱風": True})
+    db.set_push_time("Uother", "07:31")
+    pushs.push_wheel.set("Uother", None)
+    sent = []
+    monkeypatch.setattr(pushs, "send_scheduled_news",
+                        lambda push_time, user_ids, due: sent.append((push_time, user_ids, due)))
+    pushs._run_slot(datetime(2024, 6, 1, 7, 31))
+    assert sent == [("07:31", ["Uother"], {"Uother": ["颱風"]})]
+    # 同一分鐘已 claim 過，不會再送一次
+    pushs._run_slot(datetime(2024, 6, 1, 7, 31))
+    assert len(sent) == 1
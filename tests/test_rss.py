@@ -0,0 +1,62 @@
+# test_rss.py
+import time
+
+import rss
+
+
+def test_lookup_reports_cache_hits():
+    calls = []
+
+    def loader(topic, count):
+        calls.append(topic)
+        return [{"title": topic, "url": f"https://news.example.com/{topic}"}][:count]
+
+    cache = rss.NewsCache(loader, ttl=60)
+    items, hit = cache.lookup("颱風", 3)
+    assert not hit and calls == ["颱風"]
+    assert cache.lookup("颱風", 3) == (items, True)
+    assert cache.get("颱風", 3) == items
+    # 要求的有效期限超過快取期限時視為未命中、重新抓取
+    _items, hit = cache.lookup("颱風", 3, valid_until=time.monotonic() + 3600)
+    assert not hit and calls == ["颱風", "颱風"]
+
+
+def test_fetch_topics_collects_hits(monkeypatch):
+    import pushs
+    cache = rss.NewsCache(lambda topic, count: [{"title": topic, "url": topic}], ttl=60)
+    monkeypatch.setattr(rss, "news_cache", cache)
+    pushs.fetch_topics(["地震"], count=3)   # 預抓
+    hits = set()
+    news = pushs.fetch_topics(["地震", "海嘯"], count=3, hits=hits)
+    assert set(news) == {"地震", "海嘯"}
+    assert hits == {"地震"}
+
+
+def _feed(items):
+    body = "".join(f"<item><title>新聞 {i}</title><link>https://news.example.com/{i}</link>"
+                   f"<pubDate>Mon, 03 Jun 2024 08:00:00 GMT</pubDate></item>" for i in range(items))
+    data = f'<?xml version="1.0" encoding="UTF-8"?><rss><channel><title>t</title>{body}</channel></rss>'.encode()
+    return [data[i:i + 256] for i in range(0, len(data), 256)]
+
+
+def test_parse_items_stops_at_count_and_byte_budget():
+    items = rss.parse_items(_feed(50), 3)
+    assert [n["title"] for n in items] == ["新聞 0", "新聞 1", "新聞 2"]
+    assert items[0]["url"] == "https://news.example.com/0" and items[0]["published"]
+    assert 0 < len(rss.parse_items(_feed(500), 10 ** 6, max_bytes=2048)) < 500
+
+
+def test_parse_items_detaches_processed_items(monkeypatch):
+    channels = []
+
+    class Recording(rss.ET.XMLPullParser):
+        def read_events(self):
+            for event, elem in super().read_events():
+                if event == "start" and elem.tag == "channel":
+                    channels.append(elem)
+                yield event, elem
+
+    monkeypatch.setattr(rss.ET, "XMLPullParser", Recording)
+    assert len(rss.parse_items(_feed(200), 10 ** 6)) == 200
+    # 解析過的 <item> 不會留在 <channel> 底下
+    assert [child.tag for child in channels[0]] == ["title"]
@@ -0,0 +1,66 @@
+# timewheel.py
+# 以「一天中的第幾分鐘」為槽的推播時間輪，預看接下來幾分鐘到期的使用者（預抓新聞用）
+import threading
+
+MINUTES_PER_DAY = 24 * 60
+
+def minute_of_day(hhmm):
+    """'07:05' -> 425；格式不對回傳 None"""
+    try:
+        h, m = hhmm.split(":")[:2]
+        minute = int(h) * 60 + int(m)
+    except (AttributeError, ValueError):
+        return None
+    return minute if 0 <= minute < MINUTES_PER_DAY else None
+
+def format_minute(minute):
+    minute %= MINUTES_PER_DAY
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+class PushWheel:
+    """
+    記憶體中的推播時間輪：{ minute: {user_id, ...} }
+    啟動時從 DB 載入一次，之後隨使用者設定時間增量更新。
+    """
+
+    def __init__(self):
+        self._lock  = threading.Lock()
+        self._slots = {}   # minute -> set(user_id)
+        self._users = {}   # user_id -> minute
+
+    def load(self, schedule_map):
+        """schedule_map: { user_id: "HH:MM" }（db.list_push_schedule 的結果）"""
+        slots, users = {}, {}
+        for user_id, push_time in schedule_map.items():
+            minute = minute_of_day(push_time)
+            if minute is None:
+                continue
+            slots.setdefault(minute, set()).add(user_id)
+            users[user_id] = minute
+        with self._lock:
+            self._slots, self._users = slots, users
+
+    def set(self, user_id, push_time):
+        """更新某位使用者的推播時間；push_time 為 None 表示取消"""
+        minute = minute_of_day(push_time) if push_time else None
+        with self._lock:
+            old = self._users.pop(user_id, None)
+            if old is not None:
+                slot = self._slots.get(old)
+                if slot is not None:
+                    slot.discard(user_id)
+                    if not slot:
+                        del self._slots[old]
+            if minute is not None:
+                self._slots.setdefault(minute, set()).add(user_id)
+                self._users[user_id] = minute
+
+    def due(self, minute):
+        """回傳在 minute 到期的使用者"""
+        with self._lock:
+            return sorted(self._slots.get(minute % MINUTES_PER_DAY, ()))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._users)
@@ -0,0 +1,283 @@
+# trending.py
+# 推薦關鍵字：訂閱人數、共同訂閱（「訂閱颱風的人也訂閱…」）與近期新聞標題的熱門詞，
+# 背景定期組成快照，postback 只讀快照、不查 DB
+import os
+import re
+import math
+import time
+import heapq
+import threading
+from collections import Counter
+
+import db
+import user_state
+
+# 設定（可由環境變數調整）
+TRENDING         = os.getenv("TRENDING", "0") == "1"               # 依訂閱與新聞統計推薦關鍵字（預設關閉）
+TRENDING_REFRESH = float(os.getenv("TRENDING_REFRESH", "300"))    # 幾秒重組一次快照、重讀新聞標題
+TRENDING_RECOUNT = float(os.getenv("TRENDING_RECOUNT", "3600"))   # 幾秒從 DB 重新統計一次訂閱
+TRENDING_WINDOW  = float(os.getenv("TRENDING_WINDOW", "24"))      # 熱門詞看最近幾小時的新聞
+TRENDING_MIN_DF  = int(os.getenv("TRENDING_MIN_DF", "3"))         # 熱門詞至少出現在幾則標題
+TRENDING_MIN_CO  = int(os.getenv("TRENDING_MIN_CO", "2"))         # 共同訂閱至少幾人才算相關
+TRENDING_RELATED = int(os.getenv("TRENDING_RELATED", "10"))       # 每個主題保留幾個相關主題
+
+# 沒有任何資料時（剛啟動、還沒人訂閱）的預設推薦
+DEFAULT_KEYWORDS = ["AI", "疫情", "豪大雨", "農業部", "缺電預警"]
+SNAPSHOT_SIZE = 50       # 熱門主題 / 熱門詞各保留幾個
+MAX_LABEL = 20           # QuickReply 標籤上限
+SUBSTRING_RATIO = 0.8    # 短詞幾乎只出現在某個長詞裡時（出現次數 <= 長詞 / 0.8），只留長詞
+
+_CJK = re.compile(r"[㐀-鿿豈-﫿]+")
+_LATIN = re.compile(r"[A-Za-z][A-Za-z0-9+.-]*[A-Za-z0-9+]|[A-Za-z]{2,}")
+_STOPWORDS = {
+    "新聞", "記者", "今天", "今日", "最新", "影音", "影片", "直播", "快訊", "獨家", "報導",
+    "一個", "不是", "沒有", "什麼", "我們", "他們", "因為", "所以", "可能", "表示", "指出",
+    "這個", "那個", "已經", "還是", "就是", "如何", "為何", "今年", "去年", "明天", "昨天",
+    "the", "and", "for", "with", "news", "live",
+}
+
+
+def _usable(term):
+    # 要能放進 postback data（action=subscribe&topic=...）與按鈕標籤
+    return 0 < len(term) <= MAX_LABEL and "&" not in term and "=" not in term
+
+def title_terms(title):
+    """一則標題的候選詞：中文連續字的 2–4 字 n-gram 與英文單字（去掉結尾的「 - 媒體名稱」）"""
+    head, sep, _source = (title or "").rpartition(" - ")
+    if sep and head:
+        title = head
+    terms = set()
+    for run in _CJK.findall(title):
+        for size in range(2, 5):
+            for i in range(len(run) - size + 1):
+                terms.add(run[i:i + size])
+    terms.update(_LATIN.findall(title))
+    return terms
+
+def headline_terms(titles, min_df=3, limit=SNAPSHOT_SIZE):
+    """
+    依「出現在幾則標題」排序的熱門詞，回傳 [(詞, 則數), ...]。
+    n-gram 會切出「颱風山」「風山陀」這類碎片，短詞若幾乎只出現在某個長詞裡就只留長詞。
+    """
+    df = Counter()
+    for title in titles:
+        df.update(title_terms(title))
+    df = {t: n for t, n in df.items() if n >= min_df and t.casefold() not in _STOPWORDS}
+    dropped = set()
+    for term in sorted(df, key=len, reverse=True):
+        n = df[term]
+        if len(term) < 3 or not _CJK.fullmatch(term):
+            continue
+        for size in range(2, len(term)):
+            for i in range(len(term) - size + 1):
+                sub = term[i:i + size]
+                if sub in df and df[sub] * SUBSTRING_RATIO <= n:
+                    dropped.add(sub)
+    ranked = [(t, n) for t, n in df.items() if t not in dropped and _usable(t)]
+    return heapq.nlargest(limit, ranked, key=lambda x: (x[1], len(x[0])))
+
+
+class TrendingIndex:
+    """
+    - popularity：{ 主題: 訂閱人數 }
+    - co：稀疏的共同訂閱矩陣 { 主題: { 主題: 同時訂閱的人數 } }（對稱，只存非零）
+    兩者在啟動時與每 recount 秒從 DB 重新統計，期間由 user_state 的訂閱變更事件增量更新
+    （其他行程的變更要等下次重新統計）。快照每 refresh 秒重組一次並整個換掉，
+    recommend() 只讀快照。
+    """
+
+    def __init__(self, refresh=300, recount=3600, window=24, min_df=3, min_co=2, related=10):
+        self.refresh = refresh
+        self.recount_every = recount
+        self.window = window
+        self.min_df = min_df
+        self.min_co = min_co
+        self.related = related
+        self._lock = threading.Lock()
+        self._popularity = Counter()
+        self._co = {}
+        self._terms = []
+        self._dirty = True
+        self._started = False
+        self._snapshot = {"popular": [], "headline_terms": [], "related": {}, "built_at": 0.0}
+        self._stats = {"recounts": 0, "builds": 0, "updates": 0, "unknown_before": 0,
+                       "served": 0, "errors": 0, "build_seconds": 0.0, "recount_seconds": 0.0}
+
+    # ---- 統計 ----
+    def recount(self):
+        """從 DB 重新統計訂閱人數與共同訂閱"""
+        started = time.perf_counter()
+        popularity = Counter(db.count_topic_subscribers())
+        co = {}
+        for a, b, n in db.list_topic_pairs(1):
+            co.setdefault(a, {})[b] = n
+            co.setdefault(b, {})[a] = n
+        with self._lock:
+            self._popularity, self._co = popularity, co
+            self._dirty = True
+            self._stats["recounts"] += 1
+            self._stats["recount_seconds"] = time.perf_counter() - started
+
+    def refresh_terms(self, now=None):
+        """重讀最近 window 小時的新聞標題，算出熱門詞"""
+        since = (now or time.time()) - self.window * 3600
+        terms = headline_terms(db.recent_titles(since), self.min_df)
+        with self._lock:
+            self._terms = terms
+            self._dirty = True
+
+    def _bump(self, a, b, delta):
+        row = self._co.setdefault(a, {})
+        n = row.get(b, 0) + delta
+        if n > 0:
+            row[b] = n
+        else:
+            row.pop(b, None)
+            if not row:
+                del self._co[a]
+
+    def on_subscriptions_changed(self, user_id, before, after):
+        """user_state 的訂閱變更事件：只更新這位使用者新增 / 取消的主題那幾列，O(訂閱數)"""
+        if before is None:
+            # 不知道原本訂了什麼，交給下次重新統計
+            with self._lock:
+                self._stats["unknown_before"] += 1
+            return
+        before_set, after_set = set(before), set(after)
+        removed = [t for t in before if t not in after_set]
+        added = [t for t in after if t not in before_set]
+        if not removed and not added:
+            return
+        with self._lock:
+            base = set(before_set)
+            for t in removed:
+                base.discard(t)
+                self._popularity[t] -= 1
+                if self._popularity[t] <= 0:
+                    del self._popularity[t]
+                for s in base:
+                    self._bump(t, s, -1)
+                    self._bump(s, t, -1)
+            for t in added:
+                self._popularity[t] += 1
+                for s in base:
+                    self._bump(t, s, 1)
+                    self._bump(s, t, 1)
+                base.add(t)
+            self._dirty = True
+            self._stats["updates"] += 1
+
+    # ---- 快照 ----
+    def build(self):
+        """組新的快照：熱門主題、熱門詞、每個主題的相關主題（cosine：共同人數 / sqrt(兩邊人數相乘)）"""
+        started = time.perf_counter()
+        with self._lock:
+            popularity = dict(self._popularity)
+            co = {t: dict(row) for t, row in self._co.items()}
+            terms = list(self._terms)
+            self._dirty = False
+        popular = [t for t, _n in heapq.nlargest(SNAPSHOT_SIZE * 2, popularity.items(),
+                                                 key=lambda x: x[1]) if _usable(t)][:SNAPSHOT_SIZE]
+        related = {}
+        for a, row in co.items():
+            pa = popularity.get(a, 0)
+            if pa <= 0:
+                continue
+            scored = [(n / math.sqrt(pa * popularity[b]), b) for b, n in row.items()
+                      if n >= self.min_co and popularity.get(b, 0) > 0 and _usable(b)]
+            if scored:
+                related[a] = [(b, round(score, 4)) for score, b in heapq.nlargest(self.related, scored)]
+        snapshot = {"popular": popular, "headline_terms": [t for t, _n in terms],
+                    "related": related, "built_at": time.time()}
+        self._snapshot = snapshot
+        with self._lock:
+            self._stats["builds"] += 1
+            self._stats["build_seconds"] = time.perf_counter() - started
+        return snapshot
+
+    def snapshot(self):
+        return self._snapshot
+
+    def recommend(self, subscriptions=(), n=5):
+        """
+        依序輪流取：使用者各訂閱主題的相關主題、近期新聞熱門詞、熱門主題，
+        略過已訂閱的；都沒有時用 DEFAULT_KEYWORDS。
+        """
+        snap = self._snapshot
+        have = set(subscriptions)
+        picked = []
+
+        def take(term):
+            if term not in have and len(picked) < n:
+                have.add(term)
+                picked.append(term)
+
+        related = [snap["related"].get(t, ()) for t in subscriptions]
+        for rank in range(self.related):
+            if len(picked) >= n:
+                break
+            for row in related:
+                if rank < len(row):
+                    take(row[rank][0])
+        # 熱門詞與熱門主題交錯，兩種來源都看得到
+        terms, popular = snap["headline_terms"], snap["popular"]
+        for i in range(max(len(terms), len(popular))):
+            if len(picked) >= n:
+                break
+            if i < len(terms):
+                take(terms[i])
+            if i < len(popular):
+                take(popular[i])
+        for term in DEFAULT_KEYWORDS:
+            take(term)
+        self._stats["served"] += 1
+        return picked
+
+    # ---- 背景 ----
+    def run(self):
+        last_recount = last_terms = 0.0
+        while True:
+            now = time.time()
+            try:
+                if now - last_recount >= self.recount_every:
+                    self.recount()
+                    last_recount = now
+                if now - last_terms >= self.refresh:
+                    self.refresh_terms(now)
+                    last_terms = now
+                if self._dirty:
+                    self.build()
+            except Exception:
+                with self._lock:
+                    self._stats["errors"] += 1
+            time.sleep(self.refresh)
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        threading.Thread(target=self.run, name="trending", daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s["topics"] = len(self._popularity)
+            s["pairs"] = sum(len(row) for row in self._co.values()) // 2
+        snap = self._snapshot
+        s["related_topics"] = len(snap["related"])
+        s["headline_terms"] = len(snap["headline_terms"])
+        s["snapshot_age"] = time.time() - snap["built_at"] if snap["built_at"] else 0.0
+        return s
+
+
+index = TrendingIndex(refresh=TRENDING_REFRESH, recount=TRENDING_RECOUNT, window=TRENDING_WINDOW,
+                      min_df=TRENDING_MIN_DF, min_co=TRENDING_MIN_CO, related=TRENDING_RELATED)
+
+recommend = index.recommend
+stats = index.stats
+
+def start():
+    """TRENDING=1 時登記訂閱變更事件並啟動背景統計；關閉時 recommend() 只回傳 DEFAULT_KEYWORDS"""
+    if TRENDING:
+        user_state.on_subscriptions_changed(index.on_subscriptions_changed)
+        index.start()
@@ -0,0 +1,258 @@
+# user_state.py
+# 使用者訂閱 / 推播設定的記憶體快取：讀取走快取，寫入同時寫 DB（write-through）
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+import db
+
+# 快取設定（可由環境變數調整）
+USER_STATE_MAX_USERS   = int(os.getenv("USER_STATE_MAX_USERS", "10000"))
+USER_STATE_TTL         = float(os.getenv("USER_STATE_TTL", "300"))       # 秒
+USER_STATE_NOTIFY      = os.getenv("USER_STATE_NOTIFY", "0") == "1"      # 以 LISTEN/NOTIFY 跨行程失效
+USER_STATE_NOTIFY_POLL = float(os.getenv("USER_STATE_NOTIFY_POLL", "1"))  # 幾秒檢查一次通知
+
+NOTIFY_CHANNEL = "user_state"
+_INSTANCE_ID = uuid.uuid4().hex[:12]   # 分辨通知是不是自己發的
+
+_MISSING = object()
+
+
+class _Entry:
+    __slots__ = ("expires_at", "version", "subscriptions", "push_topics", "push_time")
+
+    def __init__(self, ttl):
+        self.expires_at    = time.monotonic() + ttl
+        self.version       = 0
+        self.subscriptions = _MISSING   # [topic, ...]
+        self.push_topics   = _MISSING   # { topic: bool }
+        self.push_time     = _MISSING   # "HH:MM" | None
+
+
+class UserStateCache:
+    """
+    每位使用者一筆，LRU 上限 max_users、TTL 秒後重新從 DB 載入。
+    各欄位用到才載入；寫入時先寫 DB 再更新快取。
+    """
+
+    def __init__(self, max_users=10000, ttl=300):
+        self.max_users = max(max_users, 1)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # user_id -> _Entry
+        self._listeners = []
+        self._subscription_listeners = []
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    # ---- 讀取 ----
+    def list_subscriptions(self, user_id):
+        return list(self._get(user_id, "subscriptions", db.list_subscriptions))
+
+    def list_push_topics(self, user_id):
+        return dict(self._get(user_id, "push_topics", db.list_push_topics))
+
+    def get_push_time(self, user_id):
+        return self._get(user_id, "push_time", db.get_push_time)
+
+    # ---- 寫入（write-through）----
+    def add_subscriptions(self, user_id, topics):
+        """一次新增多個訂閱，回傳新增後的訂閱清單"""
+        before = self._peek(user_id, "subscriptions")
+        subs = db.add_subscriptions(user_id, topics)
+        self._update(user_id, "subscriptions", lambda _: subs, replace=True)
+        self._subscriptions_changed(user_id, before, subs)
+        return list(subs)
+
+    def remove_subscriptions(self, user_id, topics):
+        """一次取消多個訂閱，回傳取消後的訂閱清單"""
+        before = self._peek(user_id, "subscriptions")
+        subs = db.remove_subscriptions(user_id, topics)
+        self._update(user_id, "subscriptions", lambda _: subs, replace=True)
+        self._subscriptions_changed(user_id, before, subs)
+        return list(subs)
+
+    def set_push_choices(self, user_id, choices):
+        """一次寫入多個推播選擇 { topic: bool }，回傳寫入後的完整推播設定"""
+        settings = db.set_push_choices(user_id, choices)
+        self._update(user_id, "push_topics", lambda _: settings, replace=True)
+        return dict(settings)
+
+    def add_subscription(self, user_id, topic):
+        return self.add_subscriptions(user_id, [topic])
+
+    def remove_subscription(self, user_id, topic):
+        return self.remove_subscriptions(user_id, [topic])
+
+    def set_push_choice(self, user_id, topic, choice):
+        return self.set_push_choices(user_id, {topic: choice})
+
+    def set_push_time(self, user_id, push_time):
+        db.set_push_time(user_id, push_time)
+        self._update(user_id, "push_time", lambda _: push_time, replace=True)
+
+    # ---- 失效 ----
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+            self._stats["invalidations"] += 1
+
+    def on_remote_change(self, callback):
+        """登記其他行程改了某位使用者設定時要呼叫的函式：callback(user_id)"""
+        self._listeners.append(callback)
+
+    def on_subscriptions_changed(self, callback):
+        """
+        登記本行程改了訂閱時要呼叫的函式：callback(user_id, before, after)，
+        before 為寫入前的訂閱（快取裡沒有時為 None，無法得知差異）
+        """
+        self._subscription_listeners.append(callback)
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s["size"] = len(self._entries)
+        lookups = s["hits"] + s["misses"]
+        s["hit_ratio"] = s["hits"] / lookups if lookups else 0.0
+        return s
+
+    # ---- 內部 ----
+    def _entry_locked(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is not None and entry.expires_at <= time.monotonic():
+            del self._entries[user_id]
+            entry = None
+        if entry is None:
+            entry = self._entries[user_id] = _Entry(self.ttl)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+        else:
+            self._entries.move_to_end(user_id)
+        return entry
+
+    def _peek(self, user_id, field):
+        # 只看快取、不載入；沒有時回傳 None
+        with self._lock:
+            entry = self._entries.get(user_id)
+            fresh = entry is not None and entry.expires_at > time.monotonic()
+            value = getattr(entry, field) if fresh else _MISSING
+        return None if value is _MISSING else list(value)
+
+    def _subscriptions_changed(self, user_id, before, after):
+        for callback in self._subscription_listeners:
+            try:
+                callback(user_id, before, list(after))
+            except Exception:
+                pass
+
+    def _get(self, user_id, field, loader):
+        with self._lock:
+            entry = self._entry_locked(user_id)
+            value = getattr(entry, field)
+            if value is not _MISSING:
+                self._stats["hits"] += 1
+                return value
+            self._stats["misses"] += 1
+            version = entry.version
+
+        value = loader(user_id)
+
+        with self._lock:
+            # 載入期間若有寫入（version 變了），就不要用舊資料覆蓋
+            if self._entries.get(user_id) is entry and entry.version == version:
+                setattr(entry, field, value)
+        return value
+
+    def _update(self, user_id, field, fn, replace=False):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                if not replace:
+                    return
+                entry = self._entry_locked(user_id)
+            entry.version += 1
+            current = getattr(entry, field)
+            if replace or current is not _MISSING:
+                setattr(entry, field, fn(current))
+        _notify(user_id)
+
+    def _remote_change(self, user_id):
+        self.invalidate(user_id)
+        for callback in self._listeners:
+            try:
+                callback(user_id)
+            except Exception:
+                pass
+
+
+cache = UserStateCache(max_users=USER_STATE_MAX_USERS, ttl=USER_STATE_TTL)
+
+# 模組層級的便利函式，呼叫端用法與 db.py 相同
+list_subscriptions  = cache.list_subscriptions
+list_push_topics    = cache.list_push_topics
+get_push_time       = cache.get_push_time
+add_subscription    = cache.add_subscription
+remove_subscription = cache.remove_subscription
+set_push_choice     = cache.set_push_choice
+add_subscriptions   = cache.add_subscriptions
+remove_subscriptions = cache.remove_subscriptions
+set_push_choices    = cache.set_push_choices
+set_push_time       = cache.set_push_time
+invalidate          = cache.invalidate
+on_remote_change    = cache.on_remote_change
+on_subscriptions_changed = cache.on_subscriptions_changed
+stats               = cache.stats
+
+
+def _notify(user_id):
+    if not USER_STATE_NOTIFY or not db.SUPPORTS_NOTIFY:
+        return
+    try:
+        db.notify(NOTIFY_CHANNEL, f"{_INSTANCE_ID}:{user_id}")
+    except Exception:
+        # 通知失敗不影響寫入，其他行程最晚 TTL 後也會重新載入
+        pass
+
+def _listen_loop():
+    backoff = 1
+    while True:
+        try:
+            conn = db.open_listener(NOTIFY_CHANNEL)
+        except Exception:
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+            continue
+        backoff = 1
+        # 重新連上時可能漏掉通知，整個快取作廢
+        cache.invalidate()
+        try:
+            while True:
+                payloads = db.poll_notifications(conn)
+                if len(payloads) >= db.NOTIFICATION_BUFFER:
+                    # pg8000 的通知緩衝區滿了，可能有漏接，整個快取作廢
+                    cache.invalidate()
+                for payload in payloads:
+                    instance, _, uid = payload.partition(":")
+                    if instance != _INSTANCE_ID:
+                        cache._remote_change(uid)
+                time.sleep(USER_STATE_NOTIFY_POLL)
+        except Exception:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+_listener_started = False
+
+def start_listener():
+    """USER_STATE_NOTIFY=1 且後端支援 LISTEN/NOTIFY 時啟動背景執行緒，接收其他行程的失效通知"""
+    global _listener_started
+    if not USER_STATE_NOTIFY or not db.SUPPORTS_NOTIFY or _listener_started:
+        return
+    _listener_started = True
+    threading.Thread(target=_listen_loop, name="user-state-listener", daemon=True).start()
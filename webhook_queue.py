@@ -0,0 +1,96 @@
+# webhook_queue.py
+# /callback 的非同步處理：驗章後把 webhook 丟進有上限的佇列，由背景 worker 處理
+import os
+import queue
+import threading
+import time
+
+# 設定（可由環境變數調整）
+WEBHOOK_ASYNC         = os.getenv("WEBHOOK_ASYNC", "0") == "1"
+WEBHOOK_WORKERS       = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_SIZE    = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_BACKPRESSURE  = os.getenv("WEBHOOK_BACKPRESSURE", "503")     # 佇列滿時：drop | block | 503
+WEBHOOK_BLOCK_TIMEOUT = float(os.getenv("WEBHOOK_BLOCK_TIMEOUT", "2"))  # block 模式最多等幾秒
+
+
+class WorkQueue:
+    """
+    有上限的工作佇列 + 固定數量的 worker 執行緒。
+    佇列滿時依 policy 處理：
+    - drop：直接丟棄（submit 回傳 False，呼叫端仍回 200）
+    - block：最多等 block_timeout 秒，仍滿則回傳 False
+    - 503：立即回傳 False，讓呼叫端回 503
+    """
+
+    def __init__(self, handler, workers=4, maxsize=1000, policy="503", block_timeout=2):
+        if policy not in ("drop", "block", "503"):
+            raise ValueError(f"未知的 backpressure 設定：{policy}")
+        self._handler = handler
+        self.workers = max(workers, 1)
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0, "rejected": 0, "processed": 0, "errors": 0,
+            "wait_time_total": 0.0, "wait_time_max": 0.0,
+            "process_time_total": 0.0, "process_time_max": 0.0,
+        }
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"webhook-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, *args):
+        item = (time.monotonic(), args)
+        try:
+            if self.policy == "block":
+                self._queue.put(item, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self._stats["rejected"] += 1
+            return False
+        with self._lock:
+            self._stats["enqueued"] += 1
+        return True
+
+    def _worker(self):
+        while True:
+            enqueued_at, args = self._queue.get()
+            start = time.monotonic()
+            ok = True
+            try:
+                self._handler(*args)
+            except Exception:
+                ok = False
+            finally:
+                self._queue.task_done()
+            done = time.monotonic()
+            wait, took = start - enqueued_at, done - start
+            with self._lock:
+                s = self._stats
+                s["processed"] += 1
+                if not ok:
+                    s["errors"] += 1
+                s["wait_time_total"] += wait
+                s["wait_time_max"] = max(s["wait_time_max"], wait)
+                s["process_time_total"] += took
+                s["process_time_max"] = max(s["process_time_max"], took)
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+        s.update(depth=self._queue.qsize(), maxsize=self._queue.maxsize,
+                 workers=self.workers, policy=self.policy)
+        n = s["processed"]
+        s["wait_time_avg"] = s["wait_time_total"] / n if n else 0.0
+        s["process_time_avg"] = s["process_time_total"] / n if n else 0.0
+        return s